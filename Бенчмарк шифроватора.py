@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+import Шифроватор_ядро as engine
+
+MIB = 1024 * 1024
+
+# Наборы данных: много мелких файлов, несколько огромных и смешанное дерево
+SCALES = {
+    "small": {"tiny_count": 500, "tiny_size": 2 * 1024, "huge_count": 2, "huge_size": 32 * MIB, "mixed_count": 300},
+    "medium": {"tiny_count": 5000, "tiny_size": 4 * 1024, "huge_count": 2, "huge_size": 256 * MIB, "mixed_count": 2000},
+    "large": {"tiny_count": 50000, "tiny_size": 4 * 1024, "huge_count": 4, "huge_size": 1024 * MIB, "mixed_count": 20000},
+}
+
+EXTENSIONS = {".dat"}
+PASSWORD = "benchmark-password"
+
+
+def write_file(path, size, rng):
+    """Воспроизводимое содержимое: половина блоков случайная, половина - текстоподобная"""
+    with open(path, 'wb') as file:
+        left = size
+        while left > 0:
+            block = min(left, MIB)
+            if rng.random() < 0.5:
+                # randbytes появился только в Python 3.9
+                file.write(rng.getrandbits(8 * block).to_bytes(block, "little"))
+            else:
+                line = f"{rng.randrange(10 ** 9)};строка журнала;{rng.random():.6f}\n".encode()
+                file.write((line * (block // len(line) + 1))[:block])
+            left -= block
+
+
+def make_datasets(base, scale, seed):
+    rng = random.Random(seed)
+    datasets = {}
+
+    tiny = os.path.join(base, "tiny")
+    os.makedirs(tiny)
+    for i in range(scale["tiny_count"]):
+        write_file(os.path.join(tiny, f"{i:06d}.dat"), rng.randrange(1, scale["tiny_size"] + 1), rng)
+    datasets["tiny"] = tiny
+
+    huge = os.path.join(base, "huge")
+    os.makedirs(huge)
+    for i in range(scale["huge_count"]):
+        write_file(os.path.join(huge, f"{i:02d}.dat"), scale["huge_size"], rng)
+    datasets["huge"] = huge
+
+    # Смешанное дерево: вложенные папки, размеры по логнормальному закону (от байтов до десятков МБ)
+    mixed = os.path.join(base, "mixed")
+    for i in range(scale["mixed_count"]):
+        folder = os.path.join(mixed, f"d{rng.randrange(8)}", f"d{rng.randrange(8)}")
+        os.makedirs(folder, exist_ok=True)
+        size = min(int(rng.lognormvariate(9, 2.5)), 64 * MIB)
+        write_file(os.path.join(folder, f"{i:06d}.dat"), size, rng)
+    datasets["mixed"] = mixed
+    return datasets
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss: в Linux - килобайты, в macOS - байты
+    unit = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return round(max(own, children) / MIB, 1)
+
+
+def install_kdf_timer():
+    """Учёт времени KDF пароля в текущем процессе (подмена функции модуля)"""
+    stats = {"calls": 0, "seconds": 0.0}
+    original = engine.derive_password_key
+
+    def timed_derive_password_key(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            stats["calls"] += 1
+            stats["seconds"] += time.perf_counter() - started
+
+    engine.derive_password_key = timed_derive_password_key
+    return stats
+
+
+def dataset_files(path, extensions):
+    files = engine.collect_files(path, extensions, True)
+    return files, sum(os.path.getsize(file_path) for file_path in files)
+
+
+def run_scenario(scenario):
+    """Выполняется в отдельном процессе, чтобы пиковая память относилась только к сценарию"""
+    # Время этапов (чтение, шифрование, запись, ключи) - встроенными замерами движка, включая процессы пула
+    stages = engine.StageMetrics()
+    with engine.collect_metrics(stages):
+        measured = measure_scenario(scenario)
+    measured["stages"] = stages.summary()
+    return measured
+
+
+def measure_scenario(scenario):
+    kdf = install_kdf_timer()
+    private_key = None
+    if scenario.get("private_pem"):
+        private_key = engine.load_private_key_from_pem(scenario["private_pem"])
+    cipher = scenario["cipher"]
+    chunk_size = scenario["chunk_size"]
+    compression = scenario["compression"]
+
+    if scenario["operation"] == "kdf":
+        started = time.perf_counter()
+        for _ in range(scenario["rounds"]):
+            engine.derive_password_key(PASSWORD, os.urandom(engine.SALT_SIZE), scenario["kdf"])
+        seconds = time.perf_counter() - started
+        return {"seconds": seconds, "kdf_calls": kdf["calls"], "kdf_seconds": kdf["seconds"],
+                "files": 0, "bytes": 0, "errors": 0, "peak_rss_mb": peak_rss_mb()}
+
+    encrypt = scenario["operation"].endswith("encrypt")
+    ext = ".rsa" if scenario["asymmetric"] else ".enc"
+    files, total_bytes = dataset_files(scenario["path"], EXTENSIONS if encrypt else {ext})
+    errors = 0
+    started = time.perf_counter()
+
+    if scenario["operation"].startswith("file_"):
+        # Отдельные вызовы encrypt_file/decrypt_file: KDF на каждый файл
+        for file_path in files:
+            try:
+                if encrypt:
+                    engine.encrypt_file_password(file_path, file_path + ext, PASSWORD, chunk_size, cipher=cipher,
+                                                 compression=compression, kdf=scenario["kdf"])
+                else:
+                    engine.decrypt_file_password(file_path, engine.decrypted_path(file_path, ext), PASSWORD)
+            except Exception:
+                errors += 1
+    else:
+        # Движок process_folder: пакетный ключ и пул процессов
+        public_keys = [private_key.public_key()] if private_key and encrypt else None
+        job = engine.make_job(
+            "encrypt" if encrypt else "decrypt",
+            None if scenario["asymmetric"] else PASSWORD,
+            False,
+            scenario["asymmetric"],
+            public_keys=public_keys,
+            private_key=None if encrypt else private_key,
+            cipher=cipher,
+            chunk_size=chunk_size,
+            compression=compression,
+            segment_workers=engine.segment_workers_for(scenario["workers"]),
+            kdf=scenario["kdf"]
+        )
+        for _, result, _, _, _ in engine.run_jobs(files, job, scenario["workers"]):
+            if not result:
+                errors += 1
+
+    seconds = time.perf_counter() - started
+    # Объём записанных контейнеров (при сжатии меньше исходного)
+    output_bytes = sum(os.path.getsize(file_path + ext) for file_path in files if os.path.exists(file_path + ext)) if encrypt else None
+    return {"seconds": seconds, "kdf_calls": kdf["calls"], "kdf_seconds": kdf["seconds"],
+            "files": len(files), "bytes": total_bytes, "output_bytes": output_bytes, "errors": errors,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def run_isolated(scenario):
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(run_scenario, scenario).result()
+
+
+def remove_outputs(path, ext):
+    for file_path in engine.collect_files(path, {ext}, True):
+        os.remove(file_path)
+
+
+def summarize(scenario, measured):
+    seconds = measured["seconds"] or 1e-9
+    result = {
+        "scenario": scenario["name"],
+        "dataset": scenario.get("dataset"),
+        "operation": scenario["operation"],
+        "workers": scenario.get("workers", 1),
+        "files": measured["files"],
+        "bytes": measured["bytes"],
+        "output_bytes": measured.get("output_bytes"),
+        "errors": measured["errors"],
+        "seconds": round(seconds, 4),
+        "mb_per_s": round(measured["bytes"] / MIB / seconds, 2),
+        "files_per_s": round(measured["files"] / seconds, 2),
+        # Время KDF учитывается только в измеряющем процессе (не в процессах пула)
+        "kdf_calls": measured["kdf_calls"],
+        "kdf_seconds": round(measured["kdf_seconds"], 4),
+        "kdf_share": round(measured["kdf_seconds"] / seconds, 4),
+        "peak_rss_mb": measured["peak_rss_mb"],
+        "stages": measured["stages"],
+    }
+    if scenario["operation"] == "kdf":
+        result["seconds_per_call"] = round(seconds / scenario["rounds"], 4)
+    return result
+
+
+def build_scenarios(datasets, args, private_pem):
+    common = {"cipher": engine.CIPHER_NAMES[args.cipher], "chunk_size": args.chunk_size, "workers": args.workers,
+              "compression": engine.COMPRESSION_NAMES[args.compression],
+              "kdf": engine.kdf_for(engine.KDF_NAMES[args.kdf] if args.kdf else None)}
+    scenarios = [dict(common, name="kdf", operation="kdf", rounds=args.kdf_rounds, asymmetric=False)]
+    for dataset, path in datasets.items():
+        for operation, asymmetric in (("file_", False), ("folder_", False), ("hybrid_", True)):
+            # Для отдельных файлов пул не используется
+            workers = 1 if operation == "file_" else args.workers
+            for step in ("encrypt", "decrypt"):
+                scenarios.append(dict(
+                    common,
+                    name=f"{operation}{step}:{dataset}",
+                    dataset=dataset,
+                    path=path,
+                    operation=(operation if operation == "file_" else "folder_") + step,
+                    asymmetric=asymmetric,
+                    workers=workers,
+                    private_pem=private_pem if asymmetric else None,
+                    cleanup=step == "decrypt",
+                ))
+    return scenarios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк шифроватора: MB/s, файлов/с, доля KDF, пиковая память")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--cipher", choices=list(engine.CIPHER_NAMES), default="AES-256-GCM")
+    parser.add_argument("--chunk-size", type=int, default=engine.CHUNK_SIZE)
+    parser.add_argument("--compression", choices=list(engine.COMPRESSION_NAMES), default="Без сжатия")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--kdf", choices=list(engine.KDF_NAMES), help="по умолчанию - параметры из калибровки")
+    parser.add_argument("--kdf-rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=48)
+    parser.add_argument("--only", help="выполнить только сценарии, имя которых содержит эту строку")
+    parser.add_argument("--dir", help="папка для наборов данных (по умолчанию временная)")
+    parser.add_argument("-o", "--output", help="файл JSON с результатами (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    base = tempfile.mkdtemp(prefix="shfr-bench-", dir=args.dir)
+    try:
+        started = time.perf_counter()
+        datasets = make_datasets(base, SCALES[args.scale], args.seed)
+        print(f"Наборы данных созданы за {time.perf_counter() - started:.1f} с: {base}", file=sys.stderr)
+
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_pem = engine.private_key_to_pem(private_key)
+
+        results = []
+        for scenario in build_scenarios(datasets, args, private_pem):
+            if args.only and args.only not in scenario["name"]:
+                continue
+            result = summarize(scenario, run_isolated(scenario))
+            results.append(result)
+            print(f"{result['scenario']}: {result['mb_per_s']} MB/s, {result['files_per_s']} файлов/с, "
+                  f"KDF {result['kdf_share']:.0%}, RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+            if scenario.get("cleanup"):
+                remove_outputs(scenario["path"], ".rsa" if scenario["asymmetric"] else ".enc")
+
+        report = {
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "params": {
+                "scale": args.scale,
+                "cipher": args.cipher,
+                "chunk_size": args.chunk_size,
+                "compression": args.compression,
+                "workers": args.workers,
+                "kdf": engine.describe_kdf(engine.kdf_for(engine.KDF_NAMES[args.kdf] if args.kdf else None)),
+                "seed": args.seed,
+            },
+            "results": results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                file.write(output + "\n")
+        else:
+            print(output)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,131 @@
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
-import base64
+from tkinter import ttk, messagebox, filedialog, simpledialog
+from collections import deque
+import multiprocessing
 import os
 import threading
 import string
 import platform
+import sys
+import time
+
+# Движок без интерфейса (форматы, пакетная обработка, командная строка)
+import Шифроватор_ядро as engine
+
+# Вывод хода пакетных операций: частота обновления интерфейса, предел строк лога в окне, папка полных логов
+UI_REFRESH_MS = 100
+LOG_WIDGET_LINES = 5000
+LOG_DIR = os.path.join(os.path.expanduser("~"), ".shfr", "logs")
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressChannel:
+    """Сводка хода пакетной операции: события от обработчиков копятся и забираются интерфейсом с фиксированной частотой
+
+    Лог в окне ограничен последними строками, полный лог пишется в файл.
+    """
+    
+    def __init__(self, log_limit=LOG_WIDGET_LINES):
+        self.lock = threading.Lock()
+        self.lines = deque(maxlen=log_limit)
+        self.dropped = 0
+        self.log_file = None
+        self.log_path = None
+        # Замеры этапов текущей операции (StageMetrics) для живой сводки; None - замеры выключены
+        self.metrics = None
+        self.reset()
+    
+    def reset(self):
+        self.started = time.monotonic()
+        self.done = 0
+        self.total = 0
+        self.bytes = 0
+        self.current = None
+        self.scanning = False
+        self.status = None
+        self.changed = True
+    
+    def start(self, operation):
+        """Новая пакетная операция: обнуление счётчиков и новый файл полного лога"""
+        with self.lock:
+            self.reset()
+            self._close_log()
+            try:
+                os.makedirs(LOG_DIR, exist_ok=True)
+                self.log_path = os.path.join(LOG_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{operation}.log")
+                self.log_file = open(self.log_path, 'a', encoding='utf-8')
+            except OSError:
+                self.log_path = None
+        return self.log_path
+    
+    def finish(self):
+        with self.lock:
+            self.scanning = False
+            self.changed = True
+            self._close_log()
+    
+    def _close_log(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+    
+    def log(self, message):
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(message)
+            if self.log_file is not None:
+                self.log_file.write(message + "\n")
+    
+    def update(self, done, total, size=0, current=None, scanning=False):
+        with self.lock:
+            self.status = None
+            self.done = done
+            self.total = total
+            self.bytes += size
+            self.current = current
+            self.scanning = scanning
+            self.changed = True
+    
+    def report(self, i, total_files, file_path, result, messages, scanning=False, size=0):
+        """Лог и прогресс по результату одного файла (в окно попадают при очередном refresh_progress)"""
+        for message in messages:
+            self.log(message)
+        self.update(i + 1, total_files, size, os.path.basename(file_path), scanning)
+    
+    def set_status(self, status):
+        with self.lock:
+            self.status = status
+            self.changed = True
+    
+    def snapshot(self):
+        """Новые строки лога (и число не попавших в окно) и состояние прогресса, если оно изменилось"""
+        with self.lock:
+            lines, dropped = list(self.lines), self.dropped
+            self.lines.clear()
+            self.dropped = 0
+            if not self.changed:
+                return lines, dropped, None
+            self.changed = False
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            files_per_s = self.done / elapsed
+            state = {
+                "done": self.done,
+                "total": self.total,
+                "percent": int(self.done / self.total * 100) if self.total else 0,
+                "files_per_s": files_per_s,
+                "mb_per_s": self.bytes / (1024 * 1024) / elapsed,
+                "eta": (self.total - self.done) / files_per_s if files_per_s and not self.scanning else None,
+                "current": self.current,
+                "scanning": self.scanning,
+                "status": self.status,
+            }
+            return lines, dropped, state
+
 
 class CryptoApp:
     def __init__(self, root):
@@ -21,6 +136,28 @@ class CryptoApp:
         # Инициализация ключей
         self.public_key = None
         self.private_key = None
+        # Получатели для гибридного шифрования файлов (первый - загруженный публичный ключ)
+        self.public_keys = []
+        
+        # Шифр для текста и файлов (общий для всех вкладок)
+        self.cipher_name = tk.StringVar(value="AES-256-GCM")
+        
+        # Сжатие перед шифрованием файлов
+        self.compression_name = tk.StringVar(value="Без сжатия")
+        
+        # Получение ключа из пароля: алгоритм и параметры из калибровки (~/.shfr/kdf.json)
+        self.kdf_name = tk.StringVar(value=engine.kdf_name(engine.load_kdf_settings()[0]))
+        self.kdf_target = tk.StringVar(value=str(engine.DEFAULT_KDF_TARGET))
+        self.kdf_info = tk.StringVar(value=engine.describe_kdf(engine.load_kdf_settings()))
+        
+        # Тип новых ключей; следующий ключ выбранного типа заранее создаётся в фоне
+        self.key_type = tk.StringVar(value=engine.DEFAULT_KEY_TYPE)
+        self.key_pool = engine.KeyPool()
+        self.key_pool.fill(engine.DEFAULT_KEY_TYPE)
+        
+        # Ход пакетных операций вкладок файлов; окно обновляется таймером, а не на каждый файл
+        self.file_channel = ProgressChannel()
+        self.asym_channel = ProgressChannel()
         
         # Создаем вкладки
         self.tab_control = ttk.Notebook(root)
@@ -31,7 +168,7 @@ class CryptoApp:
         self.about_tab = ttk.Frame(self.tab_control)
         
         self.tab_control.add(self.symmetric_tab, text='Симметричное (AES)')
-        self.tab_control.add(self.asymmetric_tab, text='Асимметричное (RSA)')
+        self.tab_control.add(self.asymmetric_tab, text='Асимметричное (RSA, X25519)')
         self.tab_control.add(self.file_tab, text='Шифрование файлов')
         self.tab_control.add(self.about_tab, text='О программе')
         
@@ -42,6 +179,8 @@ class CryptoApp:
         self.setup_asymmetric_tab()
         self.setup_file_tab()
         self.setup_about_tab()
+        
+        self.root.after(UI_REFRESH_MS, self.refresh_progress)
     
     def setup_symmetric_tab(self):
         # Поле ввода текста с кнопками
@@ -66,6 +205,23 @@ class CryptoApp:
         ttk.Button(password_frame, text="📋", width=3, command=self.copy_password).pack(side=tk.LEFT, padx=2)
         ttk.Button(password_frame, text="📄", width=3, command=self.paste_password).pack(side=tk.LEFT, padx=2)
         
+        ttk.Label(password_frame, text="Шифр:").pack(side=tk.LEFT, padx=(10, 2))
+        ttk.Combobox(password_frame, textvariable=self.cipher_name, values=list(engine.CIPHER_NAMES), state='readonly', width=18).pack(side=tk.LEFT)
+        
+        # Функция получения ключа и её калибровка под заданное время на этой машине
+        kdf_frame = ttk.Frame(self.symmetric_tab)
+        kdf_frame.pack(pady=5, fill=tk.X, padx=10)
+        
+        ttk.Label(kdf_frame, text="Ключ из пароля:").pack(side=tk.LEFT)
+        kdf_box = ttk.Combobox(kdf_frame, textvariable=self.kdf_name, values=list(engine.KDF_NAMES), state='readonly', width=15)
+        kdf_box.pack(side=tk.LEFT, padx=5)
+        kdf_box.bind("<<ComboboxSelected>>", lambda event: self.kdf_info.set(engine.describe_kdf(self.get_kdf())))
+        ttk.Label(kdf_frame, text="Время, с:").pack(side=tk.LEFT, padx=(10, 2))
+        ttk.Entry(kdf_frame, textvariable=self.kdf_target, width=5).pack(side=tk.LEFT)
+        self.kdf_button = ttk.Button(kdf_frame, text="Подобрать", command=self.calibrate_kdf)
+        self.kdf_button.pack(side=tk.LEFT, padx=5)
+        ttk.Label(kdf_frame, textvariable=self.kdf_info).pack(side=tk.LEFT, padx=5)
+        
         # Кнопки операций
         btn_frame = ttk.Frame(self.symmetric_tab)
         btn_frame.pack(pady=10)
@@ -89,10 +245,19 @@ class CryptoApp:
         key_frame = ttk.LabelFrame(self.asymmetric_tab, text="Ключи")
         key_frame.pack(pady=5, fill=tk.X, padx=10)
         
-        ttk.Button(key_frame, text="Сгенерировать ключи", command=self.generate_keys).pack(pady=5, side=tk.LEFT, padx=5)
+        self.generate_button = ttk.Button(key_frame, text="Сгенерировать ключи", command=self.generate_keys)
+        self.generate_button.pack(pady=5, side=tk.LEFT, padx=5)
+        key_type_box = ttk.Combobox(key_frame, textvariable=self.key_type, values=list(engine.KEY_TYPES), state='readonly', width=9)
+        key_type_box.pack(pady=5, side=tk.LEFT)
+        key_type_box.bind("<<ComboboxSelected>>", lambda event: self.key_pool.fill(self.key_type.get()))
         
         # Кнопки загрузки ключей
         ttk.Button(key_frame, text="Загрузить публичный ключ", command=self.load_public_key).pack(pady=5, side=tk.LEFT, padx=5)
+        ttk.Button(key_frame, text="Добавить получателя", command=self.add_recipient_key).pack(pady=5, side=tk.LEFT, padx=5)
+        ttk.Combobox(key_frame, textvariable=self.cipher_name, values=list(engine.CIPHER_NAMES), state='readonly', width=18).pack(pady=5, side=tk.RIGHT, padx=5)
+        ttk.Label(key_frame, text="Шифр:").pack(pady=5, side=tk.RIGHT)
+        ttk.Combobox(key_frame, textvariable=self.compression_name, values=list(engine.COMPRESSION_NAMES), state='readonly', width=11).pack(pady=5, side=tk.RIGHT, padx=5)
+        ttk.Label(key_frame, text="Сжатие:").pack(pady=5, side=tk.RIGHT)
         ttk.Button(key_frame, text="Загрузить приватный ключ", command=self.load_private_key).pack(pady=5, side=tk.LEFT, padx=5)
         
         # Поле ввода текста с кнопкой вставки
@@ -161,6 +326,9 @@ class CryptoApp:
         self.asym_extensions.insert(0, extensions_str)
         self.asym_extensions.pack(pady=5, fill=tk.X, padx=10)
         
+        # Правила отбора файлов
+        self.asym_selection = self.setup_selection_options(file_frame, ".rsa")
+        
         # Опции
         options_frame = ttk.Frame(file_frame)
         options_frame.pack(pady=10, fill=tk.X, padx=10)
@@ -171,12 +339,45 @@ class CryptoApp:
         self.asym_delete_original = tk.BooleanVar(value=False)
         ttk.Checkbutton(options_frame, text="Удалить исходные файлы", variable=self.asym_delete_original).pack(side=tk.LEFT, padx=5)
         
+        self.asym_incremental = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Только изменённые", variable=self.asym_incremental).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(options_frame, text="Процессов:").pack(side=tk.LEFT, padx=(15, 2))
+        self.asym_workers = tk.IntVar(value=os.cpu_count() or 1)
+        ttk.Spinbox(options_frame, from_=1, to=256, width=4, textvariable=self.asym_workers).pack(side=tk.LEFT)
+        
+        # Сброс на диск (fsync) группами по N файлов; 0 - полагаться на ОС
+        ttk.Label(options_frame, text="fsync каждые:").pack(side=tk.LEFT, padx=(15, 2))
+        self.asym_fsync_every = tk.IntVar(value=engine.DEFAULT_FSYNC_EVERY)
+        ttk.Spinbox(options_frame, from_=0, to=100000, width=6, textvariable=self.asym_fsync_every).pack(side=tk.LEFT)
+        
+        # Упаковка в архивы ограниченного размера (МБ) вместо отдельного файла на каждый исходный
+        self.asym_archive = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="В архивы по", variable=self.asym_archive).pack(side=tk.LEFT, padx=(15, 2))
+        self.asym_archive_size = tk.IntVar(value=engine.DEFAULT_ARCHIVE_SIZE // (1024 * 1024))
+        ttk.Spinbox(options_frame, from_=0, to=1048576, width=6, textvariable=self.asym_archive_size).pack(side=tk.LEFT)
+        ttk.Label(options_frame, text="МБ").pack(side=tk.LEFT, padx=2)
+        
+        # Одинаковые файлы шифруются один раз, на их месте - ссылки на общий объект
+        self.asym_dedup = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Без дубликатов", variable=self.asym_dedup).pack(side=tk.LEFT, padx=(15, 2))
+        
+        # Зашифрованный каталог: поиск и восстановление отдельных файлов без обхода папки
+        self.asym_catalog = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Каталог", variable=self.asym_catalog).pack(side=tk.LEFT, padx=5)
+        
+        # Время этапов (обход, ключи, чтение, шифрование, запись): сводка под прогрессом и отчёт рядом с логом
+        self.asym_metrics = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Замеры", variable=self.asym_metrics).pack(side=tk.LEFT, padx=5)
+        
         # Кнопки для файлов
         file_btn_frame = ttk.Frame(file_frame)
         file_btn_frame.pack(pady=10)
         
         ttk.Button(file_btn_frame, text="Зашифровать", command=self.encrypt_asym_folder).pack(side=tk.LEFT, padx=5)
         ttk.Button(file_btn_frame, text="Расшифровать", command=self.decrypt_asym_folder).pack(side=tk.LEFT, padx=5)
+        ttk.Button(file_btn_frame, text="Проверить", command=self.verify_asym_folder).pack(side=tk.LEFT, padx=5)
+        ttk.Button(file_btn_frame, text="Найти в каталоге", command=lambda: self.search_catalog_files(True)).pack(side=tk.LEFT, padx=5)
         
         # Лог операций с прокруткой
         log_frame = ttk.Frame(file_frame)
@@ -213,6 +414,10 @@ class CryptoApp:
         # Метка для отображения текущего файла
         self.current_file_var = tk.StringVar(value="Текущий файл: ")
         ttk.Label(progress_frame, textvariable=self.current_file_var, anchor=tk.W).pack(fill=tk.X, pady=2)
+        
+        # Сводка замеров этапов (если включены)
+        self.asym_metrics_info = tk.StringVar(value="")
+        ttk.Label(progress_frame, textvariable=self.asym_metrics_info, anchor=tk.W).pack(fill=tk.X, pady=2)
     
     def setup_file_tab(self):
         # Выбор папки
@@ -229,6 +434,16 @@ class CryptoApp:
         self.file_password = ttk.Entry(self.file_tab, show="*")
         self.file_password.pack(pady=5, fill=tk.X, padx=10)
         
+        # Выбор шифра
+        cipher_frame = ttk.Frame(self.file_tab)
+        cipher_frame.pack(pady=5, fill=tk.X, padx=10)
+        ttk.Label(cipher_frame, text="Шифр:").pack(side=tk.LEFT)
+        ttk.Combobox(cipher_frame, textvariable=self.cipher_name, values=list(engine.CIPHER_NAMES), state='readonly', width=18).pack(side=tk.LEFT, padx=5)
+        ttk.Label(cipher_frame, text="Сжатие:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Combobox(cipher_frame, textvariable=self.compression_name, values=list(engine.COMPRESSION_NAMES), state='readonly', width=11).pack(side=tk.LEFT, padx=5)
+        ttk.Label(cipher_frame, text="Ключ из пароля:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Combobox(cipher_frame, textvariable=self.kdf_name, values=list(engine.KDF_NAMES), state='readonly', width=15).pack(side=tk.LEFT, padx=5)
+        
         # Расширения файлов (полный список)
         ttk.Label(self.file_tab, text="Расширения файлов (через запятую):").pack(pady=5)
         self.file_extensions = ttk.Entry(self.file_tab)
@@ -237,6 +452,9 @@ class CryptoApp:
         self.file_extensions.insert(0, extensions_str)
         self.file_extensions.pack(pady=5, fill=tk.X, padx=10)
         
+        # Правила отбора файлов
+        self.file_selection = self.setup_selection_options(self.file_tab, ".enc")
+        
         # Опции
         options_frame = ttk.Frame(self.file_tab)
         options_frame.pack(pady=10, fill=tk.X, padx=10)
@@ -247,12 +465,45 @@ class CryptoApp:
         self.delete_original = tk.BooleanVar(value=False)
         ttk.Checkbutton(options_frame, text="Удалить исходные файлы", variable=self.delete_original).pack(side=tk.LEFT, padx=5)
         
+        self.incremental_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Только изменённые", variable=self.incremental_var).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(options_frame, text="Процессов:").pack(side=tk.LEFT, padx=(15, 2))
+        self.file_workers = tk.IntVar(value=os.cpu_count() or 1)
+        ttk.Spinbox(options_frame, from_=1, to=256, width=4, textvariable=self.file_workers).pack(side=tk.LEFT)
+        
+        # Сброс на диск (fsync) группами по N файлов; 0 - полагаться на ОС
+        ttk.Label(options_frame, text="fsync каждые:").pack(side=tk.LEFT, padx=(15, 2))
+        self.file_fsync_every = tk.IntVar(value=engine.DEFAULT_FSYNC_EVERY)
+        ttk.Spinbox(options_frame, from_=0, to=100000, width=6, textvariable=self.file_fsync_every).pack(side=tk.LEFT)
+        
+        # Упаковка в архивы ограниченного размера (МБ) вместо отдельного файла на каждый исходный
+        self.archive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="В архивы по", variable=self.archive_var).pack(side=tk.LEFT, padx=(15, 2))
+        self.archive_size = tk.IntVar(value=engine.DEFAULT_ARCHIVE_SIZE // (1024 * 1024))
+        ttk.Spinbox(options_frame, from_=0, to=1048576, width=6, textvariable=self.archive_size).pack(side=tk.LEFT)
+        ttk.Label(options_frame, text="МБ").pack(side=tk.LEFT, padx=2)
+        
+        # Одинаковые файлы шифруются один раз, на их месте - ссылки на общий объект
+        self.dedup_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Без дубликатов", variable=self.dedup_var).pack(side=tk.LEFT, padx=(15, 2))
+        
+        # Зашифрованный каталог: поиск и восстановление отдельных файлов без обхода папки
+        self.catalog_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Каталог", variable=self.catalog_var).pack(side=tk.LEFT, padx=5)
+        
+        # Время этапов (обход, ключ из пароля, чтение, шифрование, запись): сводка под прогрессом и отчёт рядом с логом
+        self.metrics_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="Замеры", variable=self.metrics_var).pack(side=tk.LEFT, padx=5)
+        
         # Кнопки
         btn_frame = ttk.Frame(self.file_tab)
         btn_frame.pack(pady=10)
         
         ttk.Button(btn_frame, text="Зашифровать папку", command=self.encrypt_folder).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Расшифровать папку", command=self.decrypt_folder).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Проверить папку", command=self.verify_folder_files).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Найти в каталоге", command=lambda: self.search_catalog_files(False)).pack(side=tk.LEFT, padx=5)
         
         # Лог операций с прокруткой
         log_frame = ttk.Frame(self.file_tab)
@@ -285,14 +536,71 @@ class CryptoApp:
         # Прогресс-бар
         self.progress = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, mode='determinate')
         self.progress.pack(fill=tk.X, pady=2)
+        
+        # Сводка замеров этапов (если включены)
+        self.file_metrics_info = tk.StringVar(value="")
+        ttk.Label(progress_frame, textvariable=self.file_metrics_info, anchor=tk.W).pack(fill=tk.X, pady=2)
+    
+    def setup_selection_options(self, parent, output_ext):
+        """Поля правил отбора: маски, исключаемые папки, размер, давность изменения"""
+        options = {
+            "include": tk.StringVar(),
+            "exclude": tk.StringVar(),
+            "prune": tk.StringVar(value=engine.DEFAULT_PRUNE),
+            "min_size": tk.StringVar(),
+            "max_size": tk.StringVar(),
+            "days": tk.StringVar(),
+            "skip_encrypted": tk.BooleanVar(value=False),
+            "output_ext": output_ext,
+        }
+        
+        masks_frame = ttk.Frame(parent)
+        masks_frame.pack(pady=2, fill=tk.X, padx=10)
+        ttk.Label(masks_frame, text="Включать:").pack(side=tk.LEFT)
+        ttk.Entry(masks_frame, textvariable=options["include"], width=18).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        ttk.Label(masks_frame, text="Исключать:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Entry(masks_frame, textvariable=options["exclude"], width=18).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        ttk.Label(masks_frame, text="Пропускать папки:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Entry(masks_frame, textvariable=options["prune"], width=24).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        
+        limits_frame = ttk.Frame(parent)
+        limits_frame.pack(pady=2, fill=tk.X, padx=10)
+        ttk.Label(limits_frame, text="Размер от:").pack(side=tk.LEFT)
+        ttk.Entry(limits_frame, textvariable=options["min_size"], width=8).pack(side=tk.LEFT, padx=2)
+        ttk.Label(limits_frame, text="до:").pack(side=tk.LEFT)
+        ttk.Entry(limits_frame, textvariable=options["max_size"], width=8).pack(side=tk.LEFT, padx=2)
+        ttk.Label(limits_frame, text="Изменены за дней:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Entry(limits_frame, textvariable=options["days"], width=6).pack(side=tk.LEFT, padx=2)
+        ttk.Checkbutton(limits_frame, text="Пропускать уже зашифрованные", variable=options["skip_encrypted"]).pack(side=tk.LEFT, padx=10)
+        return options
+    
+    def get_selector(self, extensions, options):
+        """Правила отбора из полей вкладки (ValueError при некорректном вводе)"""
+        days = options["days"].get().strip()
+        newer_than = None
+        if days:
+            try:
+                newer_than = time.time() - float(days.replace(",", ".")) * 86400
+            except ValueError:
+                raise ValueError(f"Некорректное число дней: {days}")
+        return engine.FileSelector(
+            extensions,
+            include=engine.parse_patterns(options["include"].get()),
+            exclude=engine.parse_patterns(options["exclude"].get()),
+            prune_dirs=engine.parse_patterns(options["prune"].get()),
+            min_size=engine.parse_size(options["min_size"].get()),
+            max_size=engine.parse_size(options["max_size"].get()),
+            newer_than=newer_than,
+            skip_encrypted=options["output_ext"] if options["skip_encrypted"].get() else None
+        )
     
     def setup_about_tab(self):
         about_text = """
         Криптографическая программа
         
         Функции:
-        1. Симметричное шифрование (AES-256)
-        2. Асимметричное шифрование (RSA-2048)
+        1. Симметричное шифрование (AES-256-GCM / ChaCha20-Poly1305)
+        2. Асимметричное шифрование (RSA 2048-4096, X25519)
         3. Шифрование файлов в папках
         4. Шифрование целых дисков (только Windows)
         
@@ -374,155 +682,103 @@ class CryptoApp:
             self.decrypt_path.set(drive)
         dialog.destroy()
     
-    def derive_key(self, password, salt):
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-            backend=default_backend()
-        )
-        return base64.urlsafe_b64encode(kdf.derive(password.encode()))
-    
     def log_message(self, message, tab="file", asym=False):
-        def _log():
-            if tab == "file":
-                if asym:
-                    self.asym_log.config(state=tk.NORMAL)
-                    self.asym_log.insert(tk.END, message + "\n")
-                    self.asym_log.see(tk.END)
-                    self.asym_log.config(state=tk.DISABLED)
-                else:
-                    self.file_log.config(state=tk.NORMAL)
-                    self.file_log.insert(tk.END, message + "\n")
-                    self.file_log.see(tk.END)
-                    self.file_log.config(state=tk.DISABLED)
-            else:
-                self.sym_result.insert(tk.END, message + "\n")
-        self.root.after(0, _log)
+        if tab == "file":
+            # Лог вкладок файлов выводится пачками в refresh_progress
+            (self.asym_channel if asym else self.file_channel).log(message)
+            return
+        self.root.after(0, lambda: self.sym_result.insert(tk.END, message + "\n"))
     
-    def encrypt_file(self, file_path, password):
+    def refresh_progress(self):
+        """Перенос накопленных строк лога и прогресса в окно (UI_REFRESH_MS раз в секунду)"""
         try:
-            salt = os.urandom(16)
-            key = self.derive_key(password, salt)
-            f = Fernet(key)
-            
-            with open(file_path, 'rb') as file:
-                original = file.read()
-            
-            encrypted = f.encrypt(original)
-            
-            # Сохраняем соль вместе с зашифрованными данными
-            with open(file_path + '.enc', 'wb') as file:
-                file.write(salt + encrypted)
-            
-            return True
-        except Exception as e:
-            self.log_message(f"Ошибка при шифровании {file_path}: {str(e)}")
-            return False
+            self.apply_channel(self.file_channel, self.file_log, self.progress, self.file_progress_var, None,
+                               self.file_metrics_info)
+            self.apply_channel(self.asym_channel, self.asym_log, self.asym_progress, self.asym_progress_var, self.current_file_var,
+                               self.asym_metrics_info)
+        finally:
+            self.root.after(UI_REFRESH_MS, self.refresh_progress)
     
-    def decrypt_file(self, file_path, password):
-        try:
-            with open(file_path, 'rb') as file:
-                data = file.read()
-            
-            salt = data[:16]
-            encrypted = data[16:]
-            
-            key = self.derive_key(password, salt)
-            f = Fernet(key)
-            decrypted = f.decrypt(encrypted)
-            
-            # Удаляем расширение .enc при сохранении
-            if file_path.endswith('.enc'):
-                output_path = file_path[:-4]
-            else:
-                output_path = file_path + '.dec'
-                
-            with open(output_path, 'wb') as file:
-                file.write(decrypted)
-            
-            return True
-        except Exception as e:
-            self.log_message(f"Ошибка при расшифровке {file_path}: {str(e)}")
-            return False
+    def apply_channel(self, channel, log_widget, progress_bar, progress_var, current_var, metrics_var=None):
+        lines, dropped, state = channel.snapshot()
+        if metrics_var is not None and channel.metrics is not None:
+            metrics_var.set(channel.metrics.brief())
+        if lines:
+            log_widget.config(state=tk.NORMAL)
+            log_widget.insert(tk.END, "\n".join(lines) + "\n")
+            # Кольцевой буфер: в окне остаются только последние LOG_WIDGET_LINES строк
+            excess = int(log_widget.index("end-1c").split(".")[0]) - 1 - LOG_WIDGET_LINES
+            if excess > 0:
+                log_widget.delete("1.0", f"{excess + 1}.0")
+            if dropped:
+                log_widget.insert("1.0", f"... пропущено строк: {dropped} (полный лог: {channel.log_path})\n")
+            log_widget.see(tk.END)
+            log_widget.config(state=tk.DISABLED)
+        if state is None:
+            return
+        
+        progress_bar.config(maximum=max(state["total"], 1), value=state["done"])
+        label = f"Прогресс: {state['percent']}%"
+        if state["done"]:
+            label += f" · {state['files_per_s']:.1f} файлов/с · {state['mb_per_s']:.1f} МБ/с"
+        if state["scanning"]:
+            label += f" (найдено {state['total']}, поиск продолжается...)"
+        elif state["eta"] is not None and state["done"] < state["total"]:
+            label += f" · осталось {format_duration(state['eta'])}"
+        progress_var.set(label)
+        if current_var is not None:
+            if state["status"]:
+                current_var.set(state["status"])
+            elif state["current"]:
+                current_var.set(f"Обработка: {state['current']}...")
     
-    def encrypt_file_asymmetric(self, file_path):
-        """Шифрование файла с использованием гибридного подхода (RSA + AES)"""
-        try:
-            # Генерируем случайный симметричный ключ
-            symmetric_key = Fernet.generate_key()
-            f = Fernet(symmetric_key)
-            
-            # Шифруем файл с помощью симметричного ключа
-            with open(file_path, 'rb') as file:
-                original = file.read()
-            
-            encrypted_data = f.encrypt(original)
-            
-            # Шифруем симметричный ключ с помощью RSA
-            encrypted_key = self.public_key.encrypt(
-                symmetric_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
-            
-            # Сохраняем зашифрованный ключ и данные
-            with open(file_path + '.rsa', 'wb') as file:
-                file.write(encrypted_key + encrypted_data)
-            
-            return True
-        except Exception as e:
-            self.log_message(f"Ошибка при асимметричном шифровании {file_path}: {str(e)}", asym=True)
-            return False
+    def get_cipher(self):
+        return engine.CIPHER_NAMES.get(self.cipher_name.get(), engine.DEFAULT_CIPHER)
     
-    def decrypt_file_asymmetric(self, file_path):
-        """Дешифрование файла с использованием гибридного подхода (RSA + AES)"""
+    def get_compression(self):
+        return engine.COMPRESSION_NAMES.get(self.compression_name.get(), engine.COMPRESS_NONE)
+    
+    def get_kdf(self):
+        return engine.kdf_for(engine.KDF_NAMES.get(self.kdf_name.get()))
+    
+    def calibrate_kdf(self):
+        """Подбор параметров KDF в отдельном потоке (замер занимает около секунды)"""
         try:
-            with open(file_path, 'rb') as file:
-                data = file.read()
-            
-            # Фиксированный размер зашифрованного ключа для RSA-2048
-            key_size = 256  # 2048 бит / 8 байт
-            encrypted_key = data[:key_size]
-            encrypted_data = data[key_size:]
-            
-            # Дешифруем симметричный ключ
-            symmetric_key = self.private_key.decrypt(
-                encrypted_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
-            
-            # Дешифруем данные с помощью симметричного ключа
-            f = Fernet(symmetric_key)
-            decrypted_data = f.decrypt(encrypted_data)
-            
-            # Сохраняем дешифрованные данные
-            if file_path.endswith('.rsa'):
-                output_path = file_path[:-4]
-            else:
-                output_path = file_path + '.dec'
-                
-            with open(output_path, 'wb') as file:
-                file.write(decrypted_data)
+            target = float(self.kdf_target.get().replace(",", "."))
+            if not 0 < target <= 60:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Ошибка", "Время должно быть числом секунд от 0 до 60")
+            return
+        algorithm = engine.KDF_NAMES[self.kdf_name.get()]
+        self.kdf_button.config(state=tk.DISABLED)
+        self.kdf_info.set("Подбор параметров...")
+        
+        def run_calibration():
+            try:
+                kdf = engine.calibrate_kdf(algorithm, target)
+                engine.save_kdf_settings(kdf, target)
+                seconds = engine.measure_kdf(kdf, os.urandom(engine.SALT_SIZE))
+                message = f"{engine.describe_kdf(kdf)}: {seconds:.2f} с"
+            except Exception as e:
+                kdf, message = None, f"Ошибка калибровки: {str(e)}"
             
-            return True
-        except Exception as e:
-            self.log_message(f"Ошибка при асимметричной расшифровке {file_path}: {str(e)}", asym=True)
-            return False
+            def finish():
+                self.kdf_button.config(state=tk.NORMAL)
+                self.kdf_info.set(message if kdf else engine.describe_kdf(self.get_kdf()))
+                if kdf is None:
+                    messagebox.showerror("Ошибка", message)
+            self.root.after(0, finish)
+        
+        threading.Thread(target=run_calibration, daemon=True).start()
     
-    def process_folder(self, operation, password, extensions, recursive, delete_original, asymmetric=False, path=None):
+    def process_folder(self, operation, password, rules, recursive, delete_original, asymmetric=False, path=None, workers=1,
+                       incremental=False, fsync_every=engine.DEFAULT_FSYNC_EVERY, archive=False, archive_size=engine.DEFAULT_ARCHIVE_SIZE,
+                       dedup=False, catalog=False, metrics=False):
         if not path:
             if asymmetric and operation == "encrypt":
                 path = self.encrypt_path.get()
-            elif asymmetric and operation == "decrypt":
+            elif asymmetric:
                 path = self.decrypt_path.get()
             else:
                 path = self.folder_path.get()
@@ -531,110 +787,80 @@ class CryptoApp:
             messagebox.showerror("Ошибка", "Выберите корректный путь")
             return
         
-        # Получаем список файлов с правильной фильтрацией по расширениям
-        files_to_process = []
-        if recursive:
-            for root, dirs, files in os.walk(path):
-                # Пропускаем папки с ошибками доступа
-                try:
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        _, file_ext = os.path.splitext(file)
-                        if file_ext.lower() in extensions:
-                            files_to_process.append(file_path)
-                except PermissionError:
-                    continue
-        else:
-            if os.path.isfile(path):
-                _, file_ext = os.path.splitext(path)
-                if file_ext.lower() in extensions:
-                    files_to_process = [path]
-            else:
-                for file in os.listdir(path):
-                    file_path = os.path.join(path, file)
-                    if os.path.isfile(file_path):
-                        _, file_ext = os.path.splitext(file)
-                        if file_ext.lower() in extensions:
-                            files_to_process.append(file_path)
-        
-        total_files = len(files_to_process)
-        if total_files == 0:
-            self.log_message("Файлы для обработки не найдены", asym=asymmetric)
+        channel = self.asym_channel if asymmetric else self.file_channel
+        log_path = channel.start(operation)
+        if log_path:
+            self.log_message(f"Полный лог: {log_path}", asym=asymmetric)
+        channel.metrics = engine.StageMetrics() if metrics else None
+        started = time.perf_counter()
+        try:
+            with engine.collect_metrics(channel.metrics):
+                return self.run_folder_job(operation, password, rules, recursive, delete_original, asymmetric, path, workers,
+                                           incremental, fsync_every, archive, archive_size, dedup, catalog)
+        finally:
+            if channel.metrics is not None:
+                self.report_metrics(channel.metrics, operation, path, time.perf_counter() - started, log_path, asymmetric)
+            channel.finish()
+    
+    def report_metrics(self, metrics, operation, path, seconds, log_path, asymmetric):
+        """Итог замеров этапов в лог и отчёты JSON и CSV рядом с полным логом"""
+        for item in metrics.summary().values():
+            line = f"{item['name']}: {item['count']} замеров, {item['seconds']:.3f} с"
+            if item["mb_per_s"] is not None:
+                line += f", {item['bytes'] / (1024 * 1024):.1f} МБ, {item['mb_per_s']:.1f} МБ/с"
+            line += f"; p50 {item['p50'] * 1000:.2f} мс, p99 {item['p99'] * 1000:.2f} мс"
+            self.log_message(line, asym=asymmetric)
+        if not log_path:
             return
-        
-        if asymmetric:
-            self.root.after(0, lambda: self.asym_progress.config(maximum=total_files, value=0))
-            self.root.after(0, lambda: self.asym_progress_var.set("Прогресс: 0%"))
-            self.root.after(0, lambda: self.current_file_var.set("Подготовка к обработке..."))
-        else:
-            self.root.after(0, lambda: self.progress.config(maximum=total_files, value=0))
-            self.root.after(0, lambda: self.file_progress_var.set("Прогресс: 0%"))
-        
-        # Обрабатываем файлы
-        success_count = 0
-        for i, file_path in enumerate(files_to_process):
-            try:
-                # Обновляем информацию о текущем файле
-                short_path = os.path.basename(file_path)
-                if asymmetric:
-                    self.root.after(0, lambda: self.current_file_var.set(f"Обработка: {short_path}..."))
-                
-                if operation == "encrypt":
-                    if asymmetric:
-                        result = self.encrypt_file_asymmetric(file_path)
-                    else:
-                        result = self.encrypt_file(file_path, password)
-                    
-                    # Удаляем оригинал только после успешного шифрования
-                    if result and delete_original:
-                        try:
-                            os.remove(file_path)
-                            self.log_message(f"Удален исходный файл: {file_path}", asym=asymmetric)
-                        except Exception as e:
-                            self.log_message(f"Ошибка удаления файла: {file_path} - {str(e)}", asym=asymmetric)
-                else:
-                    if asymmetric and file_path.endswith('.rsa'):
-                        result = self.decrypt_file_asymmetric(file_path)
-                    elif not asymmetric and file_path.endswith('.enc'):
-                        result = self.decrypt_file(file_path, password)
-                    else:
-                        ext = ".rsa" if asymmetric else ".enc"
-                        self.log_message(f"Пропущен файл (не {ext}): {file_path}", asym=asymmetric)
-                        result = False
-                    
-                    # Удаляем зашифрованный файл только после успешной расшифровки
-                    if result and delete_original:
-                        try:
-                            os.remove(file_path)
-                            self.log_message(f"Удален зашифрованный файл: {file_path}", asym=asymmetric)
-                        except Exception as e:
-                            self.log_message(f"Ошибка удаления файла: {file_path} - {str(e)}", asym=asymmetric)
-                
-                if result:
-                    success_count += 1
-                    self.log_message(f"Успешно: {file_path}", asym=asymmetric)
-                else:
-                    self.log_message(f"Ошибка: {file_path}", asym=asymmetric)
-            except Exception as e:
-                self.log_message(f"Критическая ошибка: {file_path} - {str(e)}", asym=asymmetric)
-            
-            # Обновляем прогресс
-            progress_value = i + 1
-            percentage = int(progress_value / total_files * 100)
-            
-            if asymmetric:
-                self.root.after(0, lambda v=progress_value: self.asym_progress.config(value=v))
-                self.root.after(0, lambda p=percentage: self.asym_progress_var.set(f"Прогресс: {p}%"))
-            else:
-                self.root.after(0, lambda v=progress_value: self.progress.config(value=v))
-                self.root.after(0, lambda p=percentage: self.file_progress_var.set(f"Прогресс: {p}%"))
-        
-        if asymmetric:
-            self.root.after(0, lambda: self.current_file_var.set("Обработка завершена"))
-        self.log_message(f"\nОбработка завершена! Успешно: {success_count}/{total_files}", asym=asymmetric)
-        
-        # Возвращаем статистику для уведомления
-        return success_count, total_files
+        base = os.path.splitext(log_path)[0]
+        info = {"operation": operation, "path": path, "seconds": round(seconds, 4)}
+        try:
+            metrics.write_report(base + "-metrics.json", info)
+            metrics.write_report(base + "-metrics.csv")
+            self.log_message(f"Отчёт о замерах: {base}-metrics.json", asym=asymmetric)
+        except OSError as e:
+            self.log_message(f"Не удалось сохранить отчёт о замерах: {str(e)}", asym=asymmetric)
+    
+    def run_folder_job(self, operation, password, rules, recursive, delete_original, asymmetric, path, workers,
+                       incremental, fsync_every, archive, archive_size, dedup=False, catalog=False):
+        """Пакетная операция над папкой: задание из настроек вкладки, выполнение - в движке (run_folder)"""
+        job = engine.make_job(
+            operation,
+            password,
+            delete_original,
+            asymmetric,
+            public_keys=self.public_keys if asymmetric and operation == "encrypt" else None,
+            private_key=self.private_key if asymmetric and operation != "encrypt" else None,
+            cipher=self.get_cipher(),
+            compression=self.get_compression(),
+            segment_workers=engine.segment_workers_for(workers),
+            kdf=self.get_kdf() if not asymmetric else None
+        )
+        return engine.run_folder(job, path, rules, recursive, workers, incremental, fsync_every, archive, archive_size,
+                          self.channel_for(asymmetric), dedup, catalog)
+    
+    def channel_for(self, asymmetric):
+        return self.asym_channel if asymmetric else self.file_channel
+    
+    def get_workers(self, variable):
+        """Число процессов из поля ввода (некорректное значение - все ядра)"""
+        try:
+            return max(1, int(variable.get()))
+        except (tk.TclError, ValueError):
+            return os.cpu_count() or 1
+    
+    def get_archive_size(self, variable):
+        """Предельный размер архива в байтах из поля в МБ (0 - без ограничения)"""
+        try:
+            return max(0, int(variable.get())) * 1024 * 1024
+        except (tk.TclError, ValueError):
+            return engine.DEFAULT_ARCHIVE_SIZE
+    
+    def get_fsync_every(self, variable):
+        try:
+            return max(0, int(variable.get()))
+        except (tk.TclError, ValueError):
+            return engine.DEFAULT_FSYNC_EVERY
     
     def encrypt_folder(self):
         password = self.file_password.get().strip()
@@ -656,25 +882,40 @@ class CryptoApp:
                     ext_clean = "." + ext_clean
                 extensions.add(ext_clean)
         
+        try:
+            selector = self.get_selector(extensions, self.file_selection)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+        
         # Запускаем в отдельном потоке
         def run_encryption():
             try:
                 success, total = self.process_folder(
                     "encrypt",
                     password,
-                    extensions,
+                    selector,
                     self.recursive_var.get(),
                     self.delete_original.get(),
-                    False
+                    False,
+                    workers=self.get_workers(self.file_workers),
+                    incremental=self.incremental_var.get(),
+                    fsync_every=self.get_fsync_every(self.file_fsync_every),
+                    archive=self.archive_var.get(),
+                    archive_size=self.get_archive_size(self.archive_size),
+                    dedup=self.dedup_var.get(),
+                    catalog=self.catalog_var.get(),
+                    metrics=self.metrics_var.get()
                 )
                 self.root.after(0, lambda: messagebox.showinfo(
                     "Шифрование завершено",
                     f"Успешно зашифровано: {success}/{total} файлов\n\nПроверьте лог операций для деталей."
                 ))
             except Exception as e:
+                error = str(e)
                 self.root.after(0, lambda: messagebox.showerror(
                     "Ошибка",
-                    f"Произошла ошибка при шифровании: {str(e)}"
+                    f"Произошла ошибка при шифровании: {error}"
                 ))
         
         threading.Thread(target=run_encryption, daemon=True).start()
@@ -685,8 +926,8 @@ class CryptoApp:
             messagebox.showerror("Ошибка", "Введите пароль")
             return
         
-        # Для расшифровки используем только .enc файлы
-        extensions = {".enc"}
+        # Для расшифровки используем только .enc файлы и архивы
+        extensions = {".enc", engine.ARCHIVE_EXT}
         
         # Запускаем в отдельном потоке
         def run_decryption():
@@ -697,20 +938,58 @@ class CryptoApp:
                     extensions,
                     self.recursive_var.get(),
                     self.delete_original.get(),
-                    False
+                    False,
+                    workers=self.get_workers(self.file_workers),
+                    fsync_every=self.get_fsync_every(self.file_fsync_every),
+                    metrics=self.metrics_var.get()
                 )
                 self.root.after(0, lambda: messagebox.showinfo(
                     "Расшифровка завершена",
                     f"Успешно расшифровано: {success}/{total} файлов\n\nПроверьте лог операций для деталей."
                 ))
             except Exception as e:
+                error = str(e)
                 self.root.after(0, lambda: messagebox.showerror(
                     "Ошибка",
-                    f"Произошла ошибка при расшифровке: {str(e)}"
+                    f"Произошла ошибка при расшифровке: {error}"
                 ))
         
         threading.Thread(target=run_decryption, daemon=True).start()
     
+    def verify_folder_files(self):
+        password = self.file_password.get().strip()
+        if not password:
+            messagebox.showerror("Ошибка", "Введите пароль")
+            return
+        
+        # Проверяются .enc файлы и архивы; расшифрованные данные никуда не записываются
+        extensions = {".enc", engine.ARCHIVE_EXT}
+        
+        def run_verification():
+            try:
+                success, total = self.process_folder(
+                    "verify",
+                    password,
+                    extensions,
+                    self.recursive_var.get(),
+                    False,
+                    False,
+                    workers=self.get_workers(self.file_workers),
+                    metrics=self.metrics_var.get()
+                )
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Проверка завершена",
+                    f"Прошли проверку: {success}/{total} файлов\n\nПроверьте лог операций для деталей."
+                ))
+            except Exception as e:
+                error = str(e)
+                self.root.after(0, lambda: messagebox.showerror(
+                    "Ошибка",
+                    f"Произошла ошибка при проверке: {error}"
+                ))
+        
+        threading.Thread(target=run_verification, daemon=True).start()
+    
     def encrypt_asym_folder(self):
         # Проверяем загружен ли публичный ключ
         if not self.public_key:
@@ -736,26 +1015,41 @@ class CryptoApp:
                     ext_clean = "." + ext_clean
                 extensions.add(ext_clean)
         
+        try:
+            selector = self.get_selector(extensions, self.asym_selection)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", str(e))
+            return
+        
         # Запускаем в отдельном потоке
         def run_asym_encryption():
             try:
                 success, total = self.process_folder(
                     "encrypt",
                     None,
-                    extensions,
+                    selector,
                     self.asym_recursive.get(),
                     self.asym_delete_original.get(),
                     True,
-                    path
+                    path,
+                    workers=self.get_workers(self.asym_workers),
+                    incremental=self.asym_incremental.get(),
+                    fsync_every=self.get_fsync_every(self.asym_fsync_every),
+                    archive=self.asym_archive.get(),
+                    archive_size=self.get_archive_size(self.asym_archive_size),
+                    dedup=self.asym_dedup.get(),
+                    catalog=self.asym_catalog.get(),
+                    metrics=self.asym_metrics.get()
                 )
                 self.root.after(0, lambda: messagebox.showinfo(
                     "Асимметричное шифрование завершено",
                     f"Успешно зашифровано: {success}/{total} файлов\n\nПроверьте лог операций для деталей."
                 ))
             except Exception as e:
+                error = str(e)
                 self.root.after(0, lambda: messagebox.showerror(
                     "Ошибка",
-                    f"Произошла ошибка при асимметричном шифровании: {str(e)}"
+                    f"Произошла ошибка при асимметричном шифровании: {error}"
                 ))
         
         threading.Thread(target=run_asym_encryption, daemon=True).start()
@@ -771,8 +1065,8 @@ class CryptoApp:
             messagebox.showerror("Ошибка", "Выберите корректный путь для расшифровки")
             return
         
-        # Для расшифровки используем только .rsa файлы
-        extensions = {".rsa"}
+        # Для расшифровки используем только .rsa файлы и архивы
+        extensions = {".rsa", engine.ARCHIVE_EXT}
         
         # Запускаем в отдельном потоке
         def run_asym_decryption():
@@ -784,20 +1078,124 @@ class CryptoApp:
                     self.asym_recursive.get(),
                     self.asym_delete_original.get(),
                     True,
-                    path
+                    path,
+                    workers=self.get_workers(self.asym_workers),
+                    fsync_every=self.get_fsync_every(self.asym_fsync_every),
+                    metrics=self.asym_metrics.get()
                 )
                 self.root.after(0, lambda: messagebox.showinfo(
                     "Асимметричная расшифровка завершена",
                     f"Успешно расшифровано: {success}/{total} файлов\n\nПроверьте лог операций для деталей."
                 ))
             except Exception as e:
+                error = str(e)
                 self.root.after(0, lambda: messagebox.showerror(
                     "Ошибка",
-                    f"Произошла ошибка при асимметричной расшифровке: {str(e)}"
+                    f"Произошла ошибка при асимметричной расшифровке: {error}"
                 ))
         
         threading.Thread(target=run_asym_decryption, daemon=True).start()
     
+    def verify_asym_folder(self):
+        if not self.private_key:
+            messagebox.showerror("Ошибка", "Сначала загрузите приватный ключ")
+            return
+        
+        path = self.decrypt_path.get()
+        if not path or not os.path.exists(path):
+            messagebox.showerror("Ошибка", "Выберите корректный путь для проверки")
+            return
+        
+        extensions = {".rsa", engine.ARCHIVE_EXT}
+        
+        def run_asym_verification():
+            try:
+                success, total = self.process_folder(
+                    "verify",
+                    None,
+                    extensions,
+                    self.asym_recursive.get(),
+                    False,
+                    True,
+                    path,
+                    workers=self.get_workers(self.asym_workers),
+                    metrics=self.asym_metrics.get()
+                )
+                self.root.after(0, lambda: messagebox.showinfo(
+                    "Проверка завершена",
+                    f"Прошли проверку: {success}/{total} файлов\n\nПроверьте лог операций для деталей."
+                ))
+            except Exception as e:
+                error = str(e)
+                self.root.after(0, lambda: messagebox.showerror(
+                    "Ошибка",
+                    f"Произошла ошибка при проверке: {error}"
+                ))
+        
+        threading.Thread(target=run_asym_verification, daemon=True).start()
+    
+    def search_catalog_files(self, asymmetric):
+        """Поиск в каталоге папки (маска или начало пути) и восстановление найденных файлов в выбранную папку"""
+        if asymmetric and not self.private_key:
+            messagebox.showerror("Ошибка", "Сначала загрузите приватный ключ")
+            return
+        password = None if asymmetric else self.file_password.get().strip()
+        if not asymmetric and not password:
+            messagebox.showerror("Ошибка", "Введите пароль")
+            return
+        path = self.decrypt_path.get() if asymmetric else self.folder_path.get()
+        if not path or not os.path.exists(path):
+            messagebox.showerror("Ошибка", "Выберите корректный путь")
+            return
+        query = simpledialog.askstring("Поиск в каталоге", "Маска (*.xlsx) или начало пути (docs/2024/); пусто - все файлы:",
+                                       parent=self.root)
+        if query is None:
+            return
+        query = query.strip()
+        root = os.path.dirname(engine.manifest_location(path))
+        private_key = self.private_key if asymmetric else None
+        
+        def run_search():
+            try:
+                skipped = []
+                entries = engine.load_catalog(root, password, private_key, skipped)
+                is_glob = any(char in query for char in "*?[")
+                found = engine.search_catalog(entries, query if is_glob else None, None if is_glob else query)
+            except Exception as e:
+                error = str(e)
+                self.root.after(0, lambda: messagebox.showerror("Ошибка", f"Не удалось прочитать каталог: {error}"))
+                return
+            for name, entry in found:
+                self.log_message(f"{entry['size']:>12}  {name}  ->  {entry['container']}", asym=asymmetric)
+            self.log_message(f"Найдено в каталоге: {len(found)} из {len(entries)}", asym=asymmetric)
+            if skipped:
+                self.log_message(f"Пропущено частей каталога другого пароля или ключа: {len(skipped)}", asym=asymmetric)
+            if found:
+                self.root.after(0, lambda: self.restore_catalog_files(root, entries, found, password, private_key, asymmetric))
+        
+        threading.Thread(target=run_search, daemon=True).start()
+    
+    def restore_catalog_files(self, root, entries, found, password, private_key, asymmetric):
+        if not messagebox.askyesno("Каталог", f"Восстановить найденные файлы ({len(found)})?"):
+            return
+        target_dir = filedialog.askdirectory(title="Папка для восстановленных файлов")
+        if not target_dir:
+            return
+        
+        def run_restore():
+            restored = 0
+            for name, _ in found:
+                try:
+                    output_path = engine.member_path(target_dir, name)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                    engine.restore_from_catalog(root, name, output_path, password, private_key, entries)
+                    restored += 1
+                except Exception as e:
+                    self.log_message(f"Ошибка восстановления {name}: {str(e)}", asym=asymmetric)
+            self.log_message(f"Восстановлено файлов: {restored}/{len(found)} в {target_dir}", asym=asymmetric)
+        
+        threading.Thread(target=run_restore, daemon=True).start()
+    
     def encrypt_symmetric(self):
         text = self.sym_text.get("1.0", tk.END).strip()
         password = self.password_entry.get().strip()
@@ -807,13 +1205,8 @@ class CryptoApp:
             return
         
         try:
-            salt = os.urandom(16)
-            key = self.derive_key(password, salt)
-            f = Fernet(key)
-            encrypted = f.encrypt(text.encode())
-            
-            # Сохраняем соль вместе с зашифрованными данными
-            result = base64.urlsafe_b64encode(salt + encrypted).decode()
+            # Соль, nonce и параметры шифра хранятся в заголовке контейнера
+            result = engine.encrypt_text_password(text, password, self.get_cipher(), self.get_kdf())
             self.sym_result.delete("1.0", tk.END)
             self.sym_result.insert(tk.END, result)
             messagebox.showinfo("Успех", "Текст успешно зашифрован!")
@@ -829,13 +1222,8 @@ class CryptoApp:
             return
         
         try:
-            data = base64.urlsafe_b64decode(text)
-            salt = data[:16]
-            encrypted = data[16:]
-            
-            key = self.derive_key(password, salt)
-            f = Fernet(key)
-            decrypted = f.decrypt(encrypted).decode()
+            # Поддерживаются и контейнер, и старый формат (соль + Fernet)
+            decrypted = engine.decrypt_text_password(text, password)
             
             self.sym_result.delete("1.0", tk.END)
             self.sym_result.insert(tk.END, decrypted)
@@ -844,28 +1232,26 @@ class CryptoApp:
             messagebox.showerror("Ошибка", f"Ошибка расшифровки: {str(e)}")
     
     def generate_keys(self):
+        """Ключ берётся из фонового пула (или создаётся в отдельном потоке), окно не блокируется"""
+        key_type = self.key_type.get()
+        self.generate_button.config(state=tk.DISABLED)
+        
+        def run_generation():
+            try:
+                private_key = self.key_pool.get(key_type)
+                self.root.after(0, lambda: self.save_generated_keys(private_key))
+            except Exception as e:
+                error = str(e)
+                self.root.after(0, lambda: messagebox.showerror("Ошибка", f"Ошибка генерации ключей: {error}"))
+            finally:
+                self.root.after(0, lambda: self.generate_button.config(state=tk.NORMAL))
+        
+        threading.Thread(target=run_generation, daemon=True).start()
+    
+    def save_generated_keys(self, private_key):
         try:
-            # Генерация приватного ключа
-            private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=2048,
-                backend=default_backend()
-            )
-            
-            # Получение публичного ключа
-            public_key = private_key.public_key()
-            
-            # Сохранение ключей в файлы
-            private_pem = private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-            
-            public_pem = public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
+            private_pem = engine.private_key_to_pem(private_key)
+            public_pem = engine.public_key_to_pem(private_key.public_key())
             
             # Запрос места сохранения
             private_path = filedialog.asksaveasfilename(
@@ -888,7 +1274,7 @@ class CryptoApp:
                 with open(public_path, 'wb') as f:
                     f.write(public_pem)
             
-            messagebox.showinfo("Успех", "Ключи успешно сгенерированы и сохранены")
+            messagebox.showinfo("Успех", f"Ключи {engine.key_type_name(private_key)} успешно сгенерированы и сохранены")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка генерации ключей: {str(e)}")
     
@@ -900,13 +1286,32 @@ class CryptoApp:
         )
         if file_path:
             try:
-                with open(file_path, "rb") as key_file:
-                    public_key = serialization.load_pem_public_key(
-                        key_file.read(),
-                        backend=default_backend()
-                    )
+                public_key = engine.load_public_key_file(file_path)
                 self.public_key = public_key
-                messagebox.showinfo("Успех", "Публичный ключ успешно загружен")
+                self.public_keys = [public_key]
+                messagebox.showinfo("Успех", f"Публичный ключ {engine.key_type_name(public_key)} успешно загружен")
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Ошибка загрузки ключа: {str(e)}")
+    
+    def add_recipient_key(self):
+        """Добавление ещё одного получателя для шифрования файлов"""
+        file_path = filedialog.askopenfilename(
+            title="Выберите файл публичного ключа получателя",
+            filetypes=(("PEM files", "*.pem"), ("All files", "*.*"))
+        )
+        if file_path:
+            try:
+                public_key = engine.load_public_key_file(file_path)
+                if any(engine.key_id(key) == engine.key_id(public_key) for key in self.public_keys):
+                    messagebox.showwarning("Повтор", "Этот ключ уже добавлен")
+                    return
+                if len(self.public_keys) >= 255:
+                    messagebox.showerror("Ошибка", "Слишком много получателей")
+                    return
+                self.public_keys.append(public_key)
+                if not self.public_key:
+                    self.public_key = public_key
+                messagebox.showinfo("Успех", f"Получатель добавлен (всего: {len(self.public_keys)})")
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Ошибка загрузки ключа: {str(e)}")
     
@@ -918,14 +1323,9 @@ class CryptoApp:
         )
         if file_path:
             try:
-                with open(file_path, "rb") as key_file:
-                    private_key = serialization.load_pem_private_key(
-                        key_file.read(),
-                        password=None,
-                        backend=default_backend()
-                    )
+                private_key = engine.load_private_key_file(file_path)
                 self.private_key = private_key
-                messagebox.showinfo("Успех", "Приватный ключ успешно загружен")
+                messagebox.showinfo("Успех", f"Приватный ключ {engine.key_type_name(private_key)} успешно загружен")
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Ошибка загрузки ключа: {str(e)}")
     
@@ -942,17 +1342,8 @@ class CryptoApp:
             return
         
         try:
-            # Шифрование с использованием загруженного ключа
-            encrypted = self.public_key.encrypt(
-                text.encode(),
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
-            
-            result = base64.b64encode(encrypted).decode()
+            # Гибридное шифрование с использованием загруженного ключа
+            result = engine.encrypt_text_public_key(text, [self.public_key], self.get_cipher())
             self.asym_result.delete("1.0", tk.END)
             self.asym_result.insert(tk.END, result)
             messagebox.showinfo("Успех", "Текст успешно зашифрован!")
@@ -972,15 +1363,8 @@ class CryptoApp:
             return
         
         try:
-            # Расшифровка с использованием загруженного ключа
-            decrypted = self.private_key.decrypt(
-                base64.b64decode(text),
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            ).decode()
+            # Расшифровка с использованием загруженного ключа (поддерживается и старый формат RSA-OAEP)
+            decrypted = engine.decrypt_text_private_key(text, self.private_key)
             
             self.asym_result.delete("1.0", tk.END)
             self.asym_result.insert(tk.END, decrypted)
@@ -1063,7 +1447,16 @@ class CryptoApp:
         self.asym_text.delete("1.0", tk.END)
         self.asym_result.delete("1.0", tk.END)
 
-if __name__ == "__main__":
+def main(argv=None):
+    """С аргументами - командная строка движка, без аргументов - графический интерфейс"""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return engine.main(argv)
     root = tk.Tk()
-    app = CryptoApp(root)
+    CryptoApp(root)
     root.mainloop()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
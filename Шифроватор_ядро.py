@@ -0,0 +1,3860 @@
+"""Движок шифроватора без графического интерфейса: форматы контейнеров, пакетная обработка папок и командная строка
+
+Импортируется из скриптов и из интерфейса (Шифроватор.py); tkinter не используется.
+Запуск: python Шифроватор_ядро.py --help
+"""
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, x25519
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.backends import default_backend
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import base64
+import argparse
+import contextlib
+import csv
+import fnmatch
+import functools
+import getpass
+import hashlib
+import hmac
+import io
+import json
+import lzma
+import math
+import multiprocessing
+import os
+import struct
+import threading
+import queue
+import re
+import sys
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd - необязательная зависимость
+    zstandard = None
+
+try:
+    from cryptography.hazmat.primitives.kdf.argon2 import Argon2id
+except ImportError:  # Argon2id есть только в cryptography >= 44
+    Argon2id = None
+
+try:
+    from watchdog.observers import Observer
+except ImportError:  # слежение за папкой - необязательная зависимость
+    Observer = None
+
+# Потоковый формат контейнера:
+# MAGIC | версия | тип | шифр | флаги | размер блока | префикс nonce | данные типа | блоки
+# Каждый блок: длина (старший бит - признак последнего блока) + шифротекст с тегом
+MAGIC = b"SHFR"
+FORMAT_VERSION = 1
+KIND_PASSWORD = 1
+KIND_PUBLIC_KEY = 2
+KIND_PASSWORD_BATCH = 3  # Мастер-ключ пакета (KDF пароля) + ключ файла (HKDF с солью файла)
+KIND_PUBLIC_KEY_BATCH = 4  # Общий для пакета ключ, обёрнутый RSA один раз + соль файла
+KIND_RECIPIENTS = 5  # Ключ данных обёрнут для каждого получателя (слоты с идентификатором ключа) + соль файла;
+                     # обёртка слота - RSA-OAEP (длина = размер модуля) или X25519 (эфемерный ключ + AES-GCM)
+CIPHER_AES_GCM = 1
+CIPHER_CHACHA20 = 2
+CHUNK_SIZE = 1024 * 1024
+SALT_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+LAST_CHUNK_FLAG = 0x80000000
+# Длина записи (блок, тег и байт-признак сжатия) должна помещаться в 31 бит: старший - признак последнего блока
+MAX_CHUNK_SIZE = LAST_CHUNK_FLAG - TAG_SIZE - 2
+KEY_ID_SIZE = 8
+X25519_KEY_SIZE = 32
+X25519_WRAP_INFO = b"SHFR X25519 key wrap"
+
+HEADER_STRUCT = struct.Struct(">4sBBBBI")
+
+# Сжатие перед шифрованием: алгоритм в младших битах флагов заголовка,
+# каждый блок сжимается отдельно и начинается с байта-признака (сжат / сохранён как есть)
+COMPRESSION_MASK = 0x0F
+COMPRESS_NONE = 0
+COMPRESS_ZLIB = 1
+COMPRESS_LZMA = 2
+COMPRESS_ZSTD = 3
+CHUNK_STORED = 0
+CHUNK_COMPRESSED = 1
+ENTROPY_SAMPLE_SIZE = 4096
+LZMA_FILTERS = [{"id": lzma.FILTER_LZMA2, "preset": 6}]  # Сырой поток LZMA2 без обёртки xz
+
+# Функция получения ключа из пароля: параметры (алгоритм, стоимость, память, параллелизм).
+# С флагом FLAG_KDF они записаны в начале данных типа (перед солями) и входят в AAD;
+# файлы без флага - PBKDF2-SHA256 со 100000 итераций, как в прежних версиях
+FLAG_KDF = 0x20
+KDF_STRUCT = struct.Struct(">BIIB")
+KDF_PBKDF2 = 1  # стоимость - число итераций
+KDF_SCRYPT = 2  # стоимость - N, память - r, параллелизм - p
+KDF_ARGON2ID = 3  # стоимость - число проходов, память - КиБ, параллелизм - число дорожек
+LEGACY_KDF = (KDF_PBKDF2, 100000, 0, 0)
+# Параметры по умолчанию, если калибровка на этой машине не выполнялась
+KDF_DEFAULTS = {
+    KDF_PBKDF2: LEGACY_KDF,
+    KDF_SCRYPT: (KDF_SCRYPT, 2 ** 17, 8, 1),
+    KDF_ARGON2ID: (KDF_ARGON2ID, 3, 64 * 1024, 4),
+}
+# Нижние границы калибровки (слабее не выбирается даже на медленной машине)
+KDF_MINIMUMS = {
+    KDF_PBKDF2: (KDF_PBKDF2, 50000, 0, 0),
+    KDF_SCRYPT: (KDF_SCRYPT, 2 ** 14, 8, 1),
+    KDF_ARGON2ID: (KDF_ARGON2ID, 2, 19 * 1024, 4),
+}
+# Верхние границы для параметров из заголовка: чужой файл не должен занять всю память
+KDF_MAX_ITERATIONS = 100000000
+KDF_MAX_PASSES = 1024
+KDF_MAX_MEMORY = 4 * 1024 * 1024  # КиБ (4 ГиБ)
+KDF_MAX_LANES = 64
+KDF_CALIBRATION_MEMORY = 256 * 1024  # КиБ: больше калибровка не выбирает
+DEFAULT_KDF_TARGET = 0.5  # секунд на получение ключа
+KDF_SETTINGS_PATH = os.path.join(os.path.expanduser("~"), ".shfr", "kdf.json")
+
+# Архив многих файлов в одном контейнере: содержимое файлов подряд, затем индекс (JSON)
+# и его смещение/длина; всё это - открытый текст контейнера с флагом FLAG_ARCHIVE
+FLAG_ARCHIVE = 0x10
+ARCHIVE_EXT = ".shfa"
+ARCHIVE_PREFIX = "archive-"
+ARCHIVE_VERSION = 1
+ARCHIVE_TRAILER = struct.Struct(">QQ")
+DEFAULT_ARCHIVE_SIZE = 1024 * 1024 * 1024
+ENTROPY_THRESHOLD = 7.5  # бит на байт: выше - данные уже сжаты или зашифрованы
+
+# Сигнатуры форматов, которые уже сжаты (смещение, байты)
+COMPRESSED_SIGNATURES = (
+    (0, b"\xff\xd8\xff"),  # JPEG
+    (0, b"\x89PNG"),
+    (0, b"GIF8"),
+    (0, b"RIFF"),  # WebP, AVI, WAV
+    (0, b"PK\x03\x04"),  # ZIP, DOCX, XLSX, JAR, APK
+    (0, b"\x1f\x8b"),  # gzip
+    (0, b"BZh"),
+    (0, b"\xfd7zXZ\x00"),
+    (0, b"7z\xbc\xaf\x27\x1c"),
+    (0, b"Rar!"),
+    (0, b"\x28\xb5\x2f\xfd"),  # zstd
+    (0, b"\x1a\x45\xdf\xa3"),  # MKV, WebM
+    (0, b"OggS"),
+    (0, b"fLaC"),
+    (0, b"ID3"),  # MP3
+    (0, b"%PDF"),
+    (0, MAGIC),
+    (4, b"ftyp"),  # MP4, MOV, HEIC, M4A
+)
+
+# Манифест инкрементального шифрования (хранится в корне обрабатываемой папки)
+MANIFEST_NAME = ".shfr-manifest.json"
+MANIFEST_VERSION = 1
+MANIFEST_CHECK_SALT = b"SHFR manifest key check"
+
+# Дедупликация: одинаковое содержимое шифруется один раз в объект хранилища (в корне папки),
+# на месте файла - маленькая зашифрованная ссылка (контейнер с флагом FLAG_REFERENCE, открытый текст - JSON)
+FLAG_REFERENCE = 0x40
+STORE_NAME = ".shfr-store"
+STORE_INDEX = "store.json"
+STORE_VERSION = 1
+REFERENCE_VERSION = 1
+
+# Каталог папки: пути, размеры, время изменения, SHA-256 и расположение исходных файлов в контейнерах.
+# Хранится частями (контейнеры с флагом FLAG_CATALOG, открытый текст - JSON) в папке CATALOG_NAME в корне
+FLAG_CATALOG = 0x80
+CATALOG_NAME = ".shfr-catalog"
+CATALOG_PREFIX = "catalog-"
+CATALOG_EXT = ".shfc"
+CATALOG_VERSION = 1
+CATALOG_FIELDS = ("size", "mtime_ns", "sha256", "container", "offset")
+
+# Служебные папки в корне: их файлы не обрабатываются как обычные файлы папки
+SERVICE_DIRS = (STORE_NAME, CATALOG_NAME)
+
+# Журнал пакетного задания для продолжения после сбоя и суффикс временных файлов
+JOURNAL_NAME = ".shfr-journal.jsonl"
+TEMP_SUFFIX = ".shfr-tmp"
+DEFAULT_FSYNC_EVERY = 100
+
+# Конвейер обработки папки: очередь от сканера к обработчикам и размер пачки для процесса
+SCAN_QUEUE_SIZE = 10000
+WORKER_BATCH_SIZE = 16
+
+# Параллельная обработка одного большого файла: с какого размера и сколько блоков в одной задаче процесса
+PARALLEL_MIN_SIZE = 256 * 1024 * 1024
+SEGMENT_CHUNKS = 32
+
+# Потоковая обработка файла: буферов в очередях между чтением, шифрованием и записью
+PIPELINE_DEPTH = 4
+
+# Слежение за папкой: тишина после последнего события (с), прежде чем файл считается дописанным
+WATCH_DEBOUNCE = 2.0
+WATCH_TICK = 0.5
+DEFAULT_PRUNE = ".git, __pycache__, node_modules"
+
+# Замеры этапов обработки: длительности - в логарифмических корзинах (METRICS_BUCKETS_PER_OCTAVE на удвоение,
+# первая - до METRICS_MIN_SECONDS), процентили - по верхним границам корзин
+STAGES = {
+    "scan": "Обход папки",
+    "kdf": "Ключ из пароля",
+    "wrap": "Ключи RSA/X25519",
+    "read": "Чтение",
+    "encrypt": "Шифрование",
+    "decrypt": "Расшифровка",
+    "write": "Запись",
+    "file": "Файл целиком",
+}
+METRICS_BUCKETS_PER_OCTAVE = 4
+METRICS_MIN_SECONDS = 1e-6
+METRICS_PERCENTILES = (50, 90, 99)
+
+# Доступные AEAD-шифры (ключ 256 бит, nonce 96 бит, тег 128 бит); данные хранятся в двоичном виде
+CIPHERS = {
+    CIPHER_AES_GCM: AESGCM,
+    CIPHER_CHACHA20: ChaCha20Poly1305,
+}
+CIPHER_NAMES = {
+    "AES-256-GCM": CIPHER_AES_GCM,
+    "ChaCha20-Poly1305": CIPHER_CHACHA20,
+}
+DEFAULT_CIPHER = CIPHER_AES_GCM
+
+COMPRESSION_NAMES = {
+    "Без сжатия": COMPRESS_NONE,
+    "zlib": COMPRESS_ZLIB,
+    "lzma": COMPRESS_LZMA,
+}
+if zstandard is not None:
+    COMPRESSION_NAMES["zstd"] = COMPRESS_ZSTD
+
+# Типы ключей получателей: RSA любого размера или X25519 (на порядки быстрее в создании и расшифровке)
+KEY_TYPES = {
+    "RSA-2048": 2048,
+    "RSA-3072": 3072,
+    "RSA-4096": 4096,
+    "X25519": None,
+}
+DEFAULT_KEY_TYPE = "RSA-2048"
+RSA_MIN_KEY_SIZE = 2048
+
+KDF_NAMES = {
+    "PBKDF2-SHA256": KDF_PBKDF2,
+    "scrypt": KDF_SCRYPT,
+}
+if Argon2id is not None:
+    KDF_NAMES["Argon2id"] = KDF_ARGON2ID
+
+OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+
+class StageMetrics:
+    """Длительности и объёмы этапов обработки: счётчики и гистограммы по этапам
+
+    Пополняется из потоков конвейера; из процессов-обработчиков приходит пачками (export/merge).
+    Этапы конвейера идут одновременно, поэтому скорость этапа считается по его собственному времени.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+    
+    def add(self, stage, seconds, size=0):
+        if seconds > METRICS_MIN_SECONDS:
+            bucket = int(math.log2(seconds / METRICS_MIN_SECONDS) * METRICS_BUCKETS_PER_OCTAVE) + 1
+        else:
+            bucket = 0
+        with self.lock:
+            data = self.stages.get(stage)
+            if data is None:
+                data = self.stages[stage] = {"count": 0, "seconds": 0.0, "bytes": 0, "max": 0.0, "buckets": {}}
+            data["count"] += 1
+            data["seconds"] += seconds
+            data["bytes"] += size
+            data["max"] = max(data["max"], seconds)
+            data["buckets"][bucket] = data["buckets"].get(bucket, 0) + 1
+    
+    def export(self, reset=False):
+        """Копия данных для передачи между процессами"""
+        with self.lock:
+            exported = {stage: dict(data, buckets=dict(data["buckets"])) for stage, data in self.stages.items()}
+            if reset:
+                self.stages = {}
+        return exported
+    
+    def merge(self, exported):
+        with self.lock:
+            for stage, other in exported.items():
+                data = self.stages.get(stage)
+                if data is None:
+                    self.stages[stage] = dict(other, buckets=dict(other["buckets"]))
+                    continue
+                data["count"] += other["count"]
+                data["seconds"] += other["seconds"]
+                data["bytes"] += other["bytes"]
+                data["max"] = max(data["max"], other["max"])
+                for bucket, count in other["buckets"].items():
+                    data["buckets"][bucket] = data["buckets"].get(bucket, 0) + count
+    
+    @staticmethod
+    def bucket_bound(bucket):
+        """Верхняя граница корзины в секундах"""
+        return METRICS_MIN_SECONDS * 2 ** (bucket / METRICS_BUCKETS_PER_OCTAVE)
+    
+    def summary(self, histogram=False):
+        """Итог по этапам: число замеров, время, байты, скорость, средняя, процентили и максимум длительности"""
+        result = {}
+        for stage, data in sorted(self.export().items(), key=lambda item: list(STAGES).index(item[0]) if item[0] in STAGES else len(STAGES)):
+            buckets = sorted(data["buckets"].items())
+            item = {
+                "name": STAGES.get(stage, stage),
+                "count": data["count"],
+                "seconds": round(data["seconds"], 6),
+                "bytes": data["bytes"],
+                "mb_per_s": round(data["bytes"] / (1024 * 1024) / data["seconds"], 2) if data["bytes"] and data["seconds"] else None,
+                "mean": round(data["seconds"] / data["count"], 6),
+                "max": round(data["max"], 6),
+            }
+            for percent in METRICS_PERCENTILES:
+                threshold = data["count"] * percent / 100
+                seen = 0
+                for bucket, count in buckets:
+                    seen += count
+                    if seen >= threshold:
+                        item[f"p{percent}"] = round(min(self.bucket_bound(bucket), data["max"]), 6)
+                        break
+            if histogram:
+                item["histogram"] = [[round(self.bucket_bound(bucket), 6), count] for bucket, count in buckets]
+            result[stage] = item
+        return result
+    
+    def brief(self):
+        """Одна строка для живой сводки: скорость этапов с данными, время остальных"""
+        parts = []
+        for item in self.summary().values():
+            if item["mb_per_s"] is not None:
+                parts.append(f"{item['name']}: {item['mb_per_s']:.0f} МБ/с")
+            else:
+                parts.append(f"{item['name']}: {item['seconds']:.2f} с")
+        return " · ".join(parts)
+    
+    def write_report(self, path, info=None):
+        """Отчёт в JSON (с гистограммами) или CSV (по строке на этап) - по расширению файла"""
+        if path.lower().endswith(".csv"):
+            columns = ["stage", "name", "count", "seconds", "bytes", "mb_per_s", "mean", "max"] + [f"p{percent}" for percent in METRICS_PERCENTILES]
+            with open(path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.DictWriter(file, columns)
+                writer.writeheader()
+                for stage, item in self.summary().items():
+                    writer.writerow(dict(item, stage=stage))
+            return
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({"info": info or {}, "stages": self.summary(histogram=True)}, file, ensure_ascii=False, indent=2)
+
+
+# Замеры текущей операции процесса (None - замеры выключены); одна операция за раз
+_metrics = None
+
+
+@contextlib.contextmanager
+def collect_metrics(metrics):
+    """Замеры этапов во время блока with в metrics (StageMetrics); None - оставить как есть"""
+    global _metrics
+    if metrics is None:
+        yield None
+        return
+    previous = _metrics
+    _metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _metrics = previous
+
+
+def record_stage(stage, started, size=0):
+    """Замер этапа, начатого в started (time.perf_counter()), если замеры включены"""
+    if _metrics is not None:
+        _metrics.add(stage, time.perf_counter() - started, size)
+
+
+def derive_raw_key(password, salt, iterations=100000):
+    """Получение 256-битного ключа из пароля (PBKDF2-SHA256)"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+        backend=default_backend()
+    )
+    return kdf.derive(password.encode())
+
+
+def check_kdf(kdf):
+    """Проверка параметров KDF из заголовка, манифеста или настроек; возвращает кортеж"""
+    try:
+        algorithm, cost, memory, lanes = (int(value) for value in kdf)
+    except (TypeError, ValueError):
+        raise ValueError("Некорректные параметры KDF")
+    if algorithm == KDF_PBKDF2:
+        valid = 1 <= cost <= KDF_MAX_ITERATIONS
+    elif algorithm == KDF_SCRYPT:
+        # scrypt занимает 128 * r * N байт памяти
+        valid = (1 < cost and cost & (cost - 1) == 0 and 1 <= memory and 1 <= lanes <= KDF_MAX_LANES
+                 and 128 * memory * cost <= KDF_MAX_MEMORY * 1024)
+    elif algorithm == KDF_ARGON2ID:
+        valid = 1 <= cost <= KDF_MAX_PASSES and 1 <= lanes <= KDF_MAX_LANES and 8 * lanes <= memory <= KDF_MAX_MEMORY
+    else:
+        raise ValueError(f"Неизвестный алгоритм KDF: {algorithm}")
+    if not valid:
+        raise ValueError("Недопустимые параметры KDF")
+    return algorithm, cost, memory, lanes
+
+
+def derive_password_key(password, salt, kdf=LEGACY_KDF):
+    """256-битный ключ из пароля по параметрам KDF (алгоритм, стоимость, память, параллелизм)"""
+    algorithm, cost, memory, lanes = kdf
+    started = time.perf_counter()
+    if algorithm == KDF_PBKDF2:
+        key = derive_raw_key(password, salt, cost)
+    elif algorithm == KDF_SCRYPT:
+        key = Scrypt(salt=salt, length=32, n=cost, r=memory, p=lanes, backend=default_backend()).derive(password.encode())
+    elif Argon2id is None:
+        raise ValueError("Для Argon2id нужен пакет cryptography версии 44 или новее")
+    else:
+        key = Argon2id(salt=salt, length=32, iterations=cost, lanes=lanes, memory_cost=memory).derive(password.encode())
+    record_stage("kdf", started)
+    return key
+
+
+@functools.lru_cache(maxsize=32)
+def derive_master_key(password, salt, kdf=LEGACY_KDF):
+    """Мастер-ключ пакета; кэш по (пароль, соль, KDF) избавляет от повторного вывода ключа"""
+    return derive_password_key(password, salt, kdf)
+
+
+def kdf_name(algorithm):
+    return next((name for name, value in KDF_NAMES.items() if value == algorithm), f"KDF {algorithm}")
+
+
+def describe_kdf(kdf):
+    """Параметры KDF для журнала и вывода команд"""
+    algorithm, cost, memory, lanes = kdf
+    if algorithm == KDF_PBKDF2:
+        return f"{kdf_name(algorithm)}, {cost} итераций"
+    if algorithm == KDF_SCRYPT:
+        return f"{kdf_name(algorithm)}, N={cost}, r={memory}, p={lanes} ({128 * memory * cost // (1024 * 1024)} МиБ)"
+    return f"{kdf_name(algorithm)}, t={cost}, m={memory // 1024} МиБ, p={lanes}"
+
+
+@functools.lru_cache(maxsize=1)
+def load_kdf_settings(path=KDF_SETTINGS_PATH):
+    """Параметры KDF, подобранные калибровкой на этой машине (без калибровки - прежний PBKDF2)"""
+    try:
+        with open(path, encoding='utf-8') as file:
+            kdf = check_kdf(json.load(file)["kdf"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return LEGACY_KDF
+    # Argon2id мог стать недоступен после смены версии cryptography
+    return kdf if kdf[0] in KDF_NAMES.values() else LEGACY_KDF
+
+
+def save_kdf_settings(kdf, target=None, path=KDF_SETTINGS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({"algorithm": kdf_name(kdf[0]), "kdf": list(kdf), "target": target}, file, ensure_ascii=False)
+    load_kdf_settings.cache_clear()
+
+
+def kdf_for(algorithm=None):
+    """Параметры KDF для шифрования: сохранённые калибровкой, если алгоритм тот же, иначе стандартные"""
+    saved = load_kdf_settings()
+    if algorithm is None or algorithm == saved[0]:
+        return saved
+    return KDF_DEFAULTS[algorithm]
+
+
+def measure_kdf(kdf, salt):
+    started = time.perf_counter()
+    derive_password_key("calibration", salt, kdf)
+    return max(time.perf_counter() - started, 1e-6)
+
+
+def calibrate_kdf(algorithm=KDF_PBKDF2, target=DEFAULT_KDF_TARGET):
+    """Параметры KDF, при которых вывод ключа на этой машине занимает около target секунд.
+    Время растёт линейно со стоимостью и памятью, поэтому хватает одного замера на минимальных
+    параметрах; результат никогда не слабее KDF_MINIMUMS"""
+    minimum = KDF_MINIMUMS[algorithm]
+    seconds = measure_kdf(minimum, os.urandom(SALT_SIZE))
+    if algorithm == KDF_PBKDF2:
+        iterations = int(minimum[1] * target / seconds)
+        return KDF_PBKDF2, min(max(iterations, minimum[1]), KDF_MAX_ITERATIONS), 0, 0
+    if algorithm == KDF_SCRYPT:
+        # N - степень двойки: удваивается, пока укладывается во время и в предел памяти
+        _, n, r, p = minimum
+        while seconds * 2 <= target and 128 * r * n * 2 <= KDF_CALIBRATION_MEMORY * 1024:
+            n *= 2
+            seconds *= 2
+        return KDF_SCRYPT, n, r, p
+    # Argon2id: сначала память (до предела калибровки), оставшееся время - на проходы
+    _, passes, memory, lanes = minimum
+    unit = seconds / (passes * memory)
+    memory = min(max(int(target / (passes * unit)) // 1024 * 1024, memory), KDF_CALIBRATION_MEMORY)
+    passes = min(max(int(target / (memory * unit)), passes), KDF_MAX_PASSES)
+    return KDF_ARGON2ID, passes, memory, lanes
+
+
+def derive_file_key(master_key, file_salt):
+    """Дешёвый ключ отдельного файла из мастер-ключа пакета (HKDF-SHA256)"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=file_salt,
+        info=b"SHFR file key",
+        backend=default_backend()
+    ).derive(master_key)
+
+
+def x25519_wrap_key(shared_secret, ephemeral_public, recipient_public):
+    """Ключ обёртки X25519: HKDF от общего секрета, привязанный к обоим открытым ключам"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=ephemeral_public + recipient_public,
+        info=X25519_WRAP_INFO,
+        backend=default_backend()
+    ).derive(shared_secret)
+
+
+def wrap_data_key(public_key, data_key):
+    """Обёртка ключа данных для получателя: RSA-OAEP или X25519 (эфемерный открытый ключ + AES-GCM)"""
+    started = time.perf_counter()
+    if isinstance(public_key, x25519.X25519PublicKey):
+        ephemeral = x25519.X25519PrivateKey.generate()
+        ephemeral_public = ephemeral.public_key().public_bytes_raw()
+        wrap_key = x25519_wrap_key(ephemeral.exchange(public_key), ephemeral_public, public_key.public_bytes_raw())
+        # Ключ обёртки одноразовый (свой эфемерный ключ на каждую обёртку), поэтому nonce нулевой
+        wrapped_key = ephemeral_public + AESGCM(wrap_key).encrypt(bytes(12), data_key, None)
+    else:
+        wrapped_key = public_key.encrypt(data_key, OAEP_PADDING)
+    record_stage("wrap", started)
+    return wrapped_key
+
+
+@functools.lru_cache(maxsize=32)
+def unwrap_data_key(private_key, wrapped_key):
+    """Расшифровка ключа данных (RSA или X25519); для файлов одного пакета выполняется один раз"""
+    started = time.perf_counter()
+    if isinstance(private_key, x25519.X25519PrivateKey):
+        ephemeral_public = wrapped_key[:X25519_KEY_SIZE]
+        shared_secret = private_key.exchange(x25519.X25519PublicKey.from_public_bytes(ephemeral_public))
+        wrap_key = x25519_wrap_key(shared_secret, ephemeral_public, private_key.public_key().public_bytes_raw())
+        data_key = AESGCM(wrap_key).decrypt(bytes(12), wrapped_key[X25519_KEY_SIZE:], None)
+    else:
+        data_key = private_key.decrypt(wrapped_key, OAEP_PADDING)
+    record_stage("wrap", started)
+    return data_key
+
+
+def legacy_fernet(private_key, data):
+    """Старый .rsa: RSA-обёртка ключа Fernet (длина - размер модуля ключа) + токен; возвращает (Fernet, токен)"""
+    if not isinstance(private_key, rsa.RSAPrivateKey):
+        raise ValueError("Файлы старого формата расшифровываются только ключом RSA")
+    size = (private_key.key_size + 7) // 8
+    return Fernet(private_key.decrypt(data[:size], OAEP_PADDING)), data[size:]
+
+
+def key_id(public_key):
+    """Короткий идентификатор открытого ключа: начало SHA-256 от SubjectPublicKeyInfo"""
+    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+    digest.update(public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ))
+    return digest.finalize()[:KEY_ID_SIZE]
+
+
+@functools.lru_cache(maxsize=32)
+def private_key_id(private_key):
+    return key_id(private_key.public_key())
+
+
+def wrap_for_recipients(data_key, public_keys):
+    """Слоты получателей: количество, затем идентификатор ключа + длина + обёрнутый ключ"""
+    slots = [struct.pack(">B", len(public_keys))]
+    for public_key in public_keys:
+        wrapped_key = wrap_data_key(public_key, data_key)
+        slots.append(key_id(public_key) + struct.pack(">H", len(wrapped_key)) + wrapped_key)
+    return b"".join(slots)
+
+
+def unwrap_for_recipient(private_key, recipients):
+    """Поиск своего слота по идентификатору ключа и расшифровка ключа данных"""
+    own_id = private_key_id(private_key)
+    for recipient_id, wrapped_key in recipients:
+        if recipient_id == own_id:
+            return unwrap_data_key(private_key, wrapped_key)
+    raise ValueError("Файл зашифрован не для этого ключа")
+
+
+def as_key_list(public_keys):
+    if isinstance(public_keys, (list, tuple)):
+        return list(public_keys)
+    return [public_keys]
+
+
+def new_batch_data_key(public_keys):
+    """Ключ данных пакета и слоты получателей (обёртка один раз на получателя за запуск)"""
+    data_key = AESGCM.generate_key(bit_length=256)
+    return data_key, wrap_for_recipients(data_key, as_key_list(public_keys))
+
+
+def new_batch_key(password, kdf=None):
+    """Соль, мастер-ключ и параметры KDF для одного запуска пакетного шифрования"""
+    kdf = kdf or load_kdf_settings()
+    salt = os.urandom(SALT_SIZE)
+    return salt, derive_master_key(password, salt, kdf), kdf
+
+
+def chunk_nonce(prefix, index, last):
+    """Nonce блока: префикс файла + номер блока + признак последнего блока"""
+    return prefix + struct.pack(">IB", index, 1 if last else 0)
+
+
+def kdf_params(kdf, flags):
+    """Флаги и блок параметров KDF; прежний PBKDF2 пишется без блока, чтобы файл читали старые версии"""
+    if kdf == LEGACY_KDF:
+        return flags, b""
+    return flags | FLAG_KDF, KDF_STRUCT.pack(*kdf)
+
+
+def check_chunk_size(chunk_size):
+    if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Размер блока должен быть от 1 до {MAX_CHUNK_SIZE} байт: {chunk_size}")
+
+
+def build_header(kind, extra, chunk_size=CHUNK_SIZE, cipher=CIPHER_AES_GCM, flags=0):
+    """Заголовок контейнера; целиком используется как AAD для каждого блока"""
+    check_chunk_size(chunk_size)
+    prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = HEADER_STRUCT.pack(MAGIC, FORMAT_VERSION, kind, cipher, flags, chunk_size) + prefix + extra
+    return header, prefix
+
+
+def read_exact(src, size):
+    data = src.read(size)
+    if len(data) != size:
+        raise ValueError("Файл повреждён: неожиданный конец данных")
+    return data
+
+
+def read_header(src):
+    """Чтение и проверка заголовка контейнера (файл должен начинаться с MAGIC)"""
+    fixed = read_exact(src, HEADER_STRUCT.size)
+    magic, version, kind, cipher, flags, chunk_size = HEADER_STRUCT.unpack(fixed)
+    if magic != MAGIC:
+        raise ValueError("Неизвестный формат файла")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Неподдерживаемая версия формата: {version}")
+    if cipher not in CIPHERS:
+        raise ValueError(f"Неподдерживаемый шифр: {cipher}")
+    if flags & COMPRESSION_MASK == COMPRESS_ZSTD and zstandard is None:
+        raise ValueError("Файл сжат zstd: установите пакет zstandard")
+    if flags & COMPRESSION_MASK > COMPRESS_ZSTD:
+        raise ValueError(f"Неподдерживаемый алгоритм сжатия: {flags & COMPRESSION_MASK}")
+    prefix = read_exact(src, NONCE_PREFIX_SIZE)
+    raw = fixed + prefix
+    
+    if not 1 <= chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError("Файл повреждён: некорректный размер блока в заголовке")
+    
+    header = {"kind": kind, "cipher": cipher, "flags": flags, "chunk_size": chunk_size, "prefix": prefix}
+    if kind in (KIND_PASSWORD, KIND_PASSWORD_BATCH):
+        header["kdf"] = LEGACY_KDF
+        if flags & FLAG_KDF:
+            params = read_exact(src, KDF_STRUCT.size)
+            header["kdf"] = check_kdf(KDF_STRUCT.unpack(params))
+            raw += params
+    elif flags & FLAG_KDF:
+        raise ValueError("Файл повреждён: параметры KDF в контейнере без пароля")
+    if kind == KIND_PASSWORD:
+        header["salt"] = read_exact(src, SALT_SIZE)
+        raw += header["salt"]
+    elif kind == KIND_PASSWORD_BATCH:
+        header["batch_salt"] = read_exact(src, SALT_SIZE)
+        header["salt"] = read_exact(src, SALT_SIZE)
+        raw += header["batch_salt"] + header["salt"]
+    elif kind in (KIND_PUBLIC_KEY, KIND_PUBLIC_KEY_BATCH):
+        length_bytes = read_exact(src, 2)
+        (length,) = struct.unpack(">H", length_bytes)
+        header["wrapped_key"] = read_exact(src, length)
+        raw += length_bytes + header["wrapped_key"]
+        if kind == KIND_PUBLIC_KEY_BATCH:
+            header["salt"] = read_exact(src, SALT_SIZE)
+            raw += header["salt"]
+    elif kind == KIND_RECIPIENTS:
+        count_bytes = read_exact(src, 1)
+        raw += count_bytes
+        header["recipients"] = []
+        for _ in range(count_bytes[0]):
+            slot = read_exact(src, KEY_ID_SIZE + 2)
+            (length,) = struct.unpack(">H", slot[KEY_ID_SIZE:])
+            wrapped_key = read_exact(src, length)
+            header["recipients"].append((slot[:KEY_ID_SIZE], wrapped_key))
+            raw += slot + wrapped_key
+        header["salt"] = read_exact(src, SALT_SIZE)
+        raw += header["salt"]
+    else:
+        raise ValueError(f"Неизвестный тип контейнера: {kind}")
+    
+    header["raw"] = raw
+    return header
+
+
+def is_container(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def byte_entropy(sample):
+    """Энтропия Шеннона в битах на байт"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+
+def looks_compressed(data):
+    """Быстрая проверка: сигнатура сжатого формата или высокая энтропия начала данных"""
+    for offset, signature in COMPRESSED_SIGNATURES:
+        if data[offset:offset + len(signature)] == signature:
+            return True
+    return byte_entropy(data[:ENTROPY_SAMPLE_SIZE]) > ENTROPY_THRESHOLD
+
+
+def choose_compression(src, compression, chunk_size):
+    """Чтение первого блока и выбор сжатия для файла (уже сжатые данные не сжимаются)"""
+    check_chunk_size(chunk_size)
+    first_chunk = src.read(chunk_size)
+    if compression and looks_compressed(first_chunk):
+        compression = COMPRESS_NONE
+    return first_chunk, compression
+
+
+def compress_block(data, compression):
+    if compression == COMPRESS_ZLIB:
+        return zlib.compress(data, 6)
+    if compression == COMPRESS_LZMA:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+    if compression == COMPRESS_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Неподдерживаемый алгоритм сжатия: {compression}")
+
+
+def decompress_block(data, compression, max_size):
+    """Распаковка блока с ограничением размера результата"""
+    if compression == COMPRESS_ZLIB:
+        decompressor = zlib.decompressobj()
+        result = decompressor.decompress(data, max_size)
+        complete = decompressor.eof and not decompressor.unconsumed_tail
+    elif compression == COMPRESS_LZMA:
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+        result = decompressor.decompress(data, max_size)
+        complete = decompressor.eof
+    else:
+        result = zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+        complete = True
+    if not complete or len(result) > max_size:
+        raise ValueError("Файл повреждён: некорректный сжатый блок")
+    return result
+
+
+def pack_chunk(chunk, compression):
+    """Блок со сжатием: признак + данные; несжимаемый блок сохраняется как есть"""
+    middle = max(0, len(chunk) // 2 - ENTROPY_SAMPLE_SIZE // 2)
+    if byte_entropy(chunk[middle:middle + ENTROPY_SAMPLE_SIZE]) <= ENTROPY_THRESHOLD:
+        compressed = compress_block(chunk, compression)
+        if len(compressed) < len(chunk):
+            return bytes((CHUNK_COMPRESSED,)) + compressed
+    return bytes((CHUNK_STORED,)) + chunk
+
+
+def unpack_chunk(data, compression, max_size):
+    if not data:
+        raise ValueError("Файл повреждён: пустой блок")
+    if data[0] == CHUNK_STORED:
+        result = data[1:]
+    elif data[0] == CHUNK_COMPRESSED:
+        result = decompress_block(data[1:], compression, max_size)
+    else:
+        raise ValueError("Файл повреждён: неизвестный тип блока")
+    if len(result) > max_size:
+        raise ValueError("Файл повреждён: некорректный размер блока")
+    return result
+
+
+def max_record_length(header):
+    """Наибольшая длина записи блока (при сжатии - плюс байт-признак)"""
+    return header["chunk_size"] + TAG_SIZE + (1 if header["flags"] & COMPRESSION_MASK else 0)
+
+
+def read_into(src, buffer):
+    """Заполнение буфера из потока; меньше размера буфера - только в конце данных"""
+    view = memoryview(buffer)
+    filled = 0
+    readinto = getattr(src, "readinto", None)
+    while filled < len(view):
+        if readinto is not None:
+            count = readinto(view[filled:])
+        else:
+            data = src.read(len(view) - filled)
+            count = len(data)
+            view[filled:filled + count] = data
+        if not count:
+            break
+        filled += count
+    return filled
+
+
+class ReadAhead:
+    """Чтение в фоновом потоке в переиспользуемые буферы; fill(buffer) возвращает элемент (memoryview, ...) или None в конце"""
+    
+    _DONE = object()
+    
+    def __init__(self, fill, buffer_size, depth=PIPELINE_DEPTH):
+        self.fill = fill
+        self.buffer_size = buffer_size
+        self.error = None
+        self.stopped = False
+        self.ready = queue.Queue(depth)
+        self.free = queue.Queue()
+        # Буферы создаются по мере надобности: depth в очереди, один у читающего потока, два у потребителя
+        self.buffers_left = depth + 3
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _buffer(self):
+        try:
+            return self.free.get_nowait()
+        except queue.Empty:
+            if self.buffers_left:
+                self.buffers_left -= 1
+                return bytearray(self.buffer_size)
+        while not self.stopped:
+            try:
+                return self.free.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return None
+    
+    def _put(self, item):
+        while not self.stopped:
+            try:
+                self.ready.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def _run(self):
+        try:
+            while not self.stopped:
+                buffer = self._buffer()
+                item = self.fill(buffer) if buffer is not None else None
+                if item is None:
+                    return
+                self._put(item)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._put(self._DONE)
+    
+    def __iter__(self):
+        while True:
+            item = self.ready.get()
+            if item is self._DONE:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+    
+    def release(self, view):
+        """Возврат буфера после обработки (байтовые строки не из пула пропускаются)"""
+        if isinstance(view, memoryview):
+            self.free.put(view.obj)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped = True
+        self.thread.join()
+
+
+class WriteBehind:
+    """Запись в фоновом потоке через ограниченную очередь; ошибка записи передаётся пишущему"""
+    
+    _DONE = object()
+    
+    def __init__(self, dst, depth=PIPELINE_DEPTH):
+        self.dst = dst
+        self.error = None
+        self.stopped = False
+        self.queue = queue.Queue(depth)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        try:
+            while True:
+                parts = self.queue.get()
+                if parts is self._DONE or self.stopped:
+                    return
+                started = time.perf_counter()
+                for data in parts:
+                    self.dst.write(data)
+                record_stage("write", started, sum(len(data) for data in parts))
+        except Exception as e:
+            self.error = e
+    
+    def write(self, *parts):
+        """Запись частей одного блока (в замерах - одна запись)"""
+        self._put(parts)
+    
+    def _put(self, item):
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._put(self._DONE)
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+            return
+        # Ошибка шифрования: оставшиеся данные не пишутся, поток завершается
+        self.stopped = True
+        try:
+            self.queue.put_nowait(self._DONE)
+        except queue.Full:
+            pass
+        self.thread.join()
+
+
+def encrypt_record(aead, prefix, header, index, chunk, last, compression=COMPRESS_NONE):
+    """Запись блока: длина с признаком последнего блока и шифротекст"""
+    started = time.perf_counter()
+    size = len(chunk)
+    if compression:
+        chunk = pack_chunk(chunk, compression)
+    encrypted = aead.encrypt(chunk_nonce(prefix, index, last), chunk, header)
+    record_stage("encrypt", started, size)
+    return struct.pack(">I", len(encrypted) | (LAST_CHUNK_FLAG if last else 0)), encrypted
+
+
+def encrypt_stream(src, dst, key, header, prefix, chunk_size=CHUNK_SIZE, cipher=DEFAULT_CIPHER,
+                   compression=COMPRESS_NONE, first_chunk=None):
+    """Поблочное шифрование; чтение, шифрование и запись идут одновременно (в памяти - несколько блоков)"""
+    check_chunk_size(chunk_size)
+    aead = CIPHERS[cipher](key)
+    dst.write(header)
+    
+    started = time.perf_counter()
+    chunk = src.read(chunk_size) if first_chunk is None else first_chunk
+    next_chunk = src.read(chunk_size)
+    record_stage("read", started, len(next_chunk) + (len(chunk) if first_chunk is None else 0))
+    if not next_chunk:
+        # Один блок: без фоновых потоков
+        parts = encrypt_record(aead, prefix, header, 0, chunk, True, compression)
+        started = time.perf_counter()
+        for part in parts:
+            dst.write(part)
+        record_stage("write", started, sum(len(part) for part in parts))
+        return
+    
+    def fill(buffer):
+        started = time.perf_counter()
+        count = read_into(src, buffer)
+        record_stage("read", started, count)
+        return (memoryview(buffer)[:count],) if count else None
+    
+    with ReadAhead(fill, chunk_size) as reader, WriteBehind(dst) as writer:
+        writer.write(*encrypt_record(aead, prefix, header, 0, chunk, False, compression))
+        chunk = next_chunk
+        index = 1
+        # Последний блок становится известен, когда следующий оказывается пустым
+        for (next_chunk,) in reader:
+            writer.write(*encrypt_record(aead, prefix, header, index, chunk, False, compression))
+            reader.release(chunk)
+            chunk = next_chunk
+            index += 1
+        writer.write(*encrypt_record(aead, prefix, header, index, chunk, True, compression))
+        reader.release(chunk)
+
+
+def read_record(src, max_length, buffer=None):
+    """Чтение записи блока; с буфером данные читаются в него (возвращается memoryview)"""
+    (length,) = struct.unpack(">I", read_exact(src, 4))
+    last = bool(length & LAST_CHUNK_FLAG)
+    length &= ~LAST_CHUNK_FLAG
+    if length > max_length:
+        raise ValueError("Файл повреждён: некорректный размер блока")
+    if buffer is None:
+        return read_exact(src, length), last
+    view = memoryview(buffer)[:length]
+    if read_into(src, view) != length:
+        raise ValueError("Файл повреждён: неожиданный конец данных")
+    return view, last
+
+
+def check_end(src):
+    """После последнего блока данных быть не должно: дописанное к контейнеру не проходит проверку"""
+    if src.read(1):
+        raise ValueError("Файл повреждён: данные после последнего блока")
+
+
+def decrypt_stream(src, dst, key, header):
+    """Поблочная расшифровка с проверкой тега, порядка блоков и целостности конца"""
+    aead = CIPHERS[header["cipher"]](key)
+    max_length = max_record_length(header)
+    compression = header["flags"] & COMPRESSION_MASK
+    
+    def decrypt_record(encrypted, index, last):
+        started = time.perf_counter()
+        chunk = aead.decrypt(chunk_nonce(header["prefix"], index, last), encrypted, header["raw"])
+        if compression:
+            chunk = unpack_chunk(chunk, compression, header["chunk_size"])
+        record_stage("decrypt", started, len(chunk))
+        return chunk
+    
+    started = time.perf_counter()
+    encrypted, last = read_record(src, max_length)
+    record_stage("read", started, len(encrypted))
+    chunk = decrypt_record(encrypted, 0, last)
+    if last:
+        started = time.perf_counter()
+        dst.write(chunk)
+        record_stage("write", started, len(chunk))
+        check_end(src)
+        return
+    
+    # Читающий поток останавливается на последнем блоке; что после него ничего нет, проверяет check_end
+    finished = False
+    
+    def fill(buffer):
+        nonlocal finished
+        if finished:
+            return None
+        started = time.perf_counter()
+        view, finished = read_record(src, max_length, buffer)
+        record_stage("read", started, len(view))
+        return view, finished
+    
+    with ReadAhead(fill, max_length) as reader, WriteBehind(dst) as writer:
+        writer.write(chunk)
+        for index, (encrypted, last) in enumerate(reader, 1):
+            writer.write(decrypt_record(encrypted, index, last))
+            reader.release(encrypted)
+    check_end(src)
+
+
+def _write_output(output_path, writer):
+    """Атомарная запись: во временный файл рядом, затем переименование; при ошибке временный файл удаляется"""
+    temp_path = output_path + TEMP_SUFFIX
+    try:
+        with open(temp_path, 'wb') as dst:
+            writer(dst)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def fsync_file(path):
+    # В Windows FlushFileBuffers требует доступа на запись
+    fd = os.open(path, os.O_RDWR if os.name == 'nt' else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path):
+    """Сброс записи каталога (переименования); в Windows не поддерживается"""
+    if os.name == 'nt':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def password_key(header, password):
+    """Ключ данных для заголовка, зашифрованного паролем"""
+    kdf = header.get("kdf", LEGACY_KDF)
+    if header["kind"] == KIND_PASSWORD_BATCH:
+        return derive_file_key(derive_master_key(password, header["batch_salt"], kdf), header["salt"])
+    return derive_password_key(password, header["salt"], kdf)
+
+
+def password_header(password, chunk_size=CHUNK_SIZE, batch_key=None, cipher=DEFAULT_CIPHER, flags=0, kdf=None):
+    """Ключ данных и заголовок нового контейнера, зашифрованного паролем; возвращает (ключ, заголовок, префикс).
+    kdf=None - параметры из калибровки (load_kdf_settings)"""
+    salt = os.urandom(SALT_SIZE)
+    if batch_key:
+        # Пакетный режим: KDF уже выполнен один раз на весь запуск
+        batch_salt, master_key, kdf = batch_key
+        flags, params = kdf_params(kdf, flags)
+        key = derive_file_key(master_key, salt)
+        header, prefix = build_header(KIND_PASSWORD_BATCH, params + batch_salt + salt, chunk_size, cipher, flags)
+    else:
+        kdf = kdf or load_kdf_settings()
+        flags, params = kdf_params(kdf, flags)
+        key = derive_password_key(password, salt, kdf)
+        header, prefix = build_header(KIND_PASSWORD, params + salt, chunk_size, cipher, flags)
+    return key, header, prefix
+
+
+def encrypt_password_stream(src, dst, password, chunk_size=CHUNK_SIZE, batch_key=None, cipher=DEFAULT_CIPHER,
+                            compression=COMPRESS_NONE, flags=0, kdf=None):
+    first_chunk, compression = choose_compression(src, compression, chunk_size)
+    key, header, prefix = password_header(password, chunk_size, batch_key, cipher, compression | flags, kdf)
+    encrypt_stream(src, dst, key, header, prefix, chunk_size, cipher, compression, first_chunk)
+
+
+def decrypt_password_stream(src, dst, password):
+    header = read_header(src)
+    if header["kind"] not in (KIND_PASSWORD, KIND_PASSWORD_BATCH):
+        raise ValueError("Файл зашифрован не паролем")
+    decrypt_stream(src, dst, password_key(header, password), header)
+
+
+def recipients_header(public_keys, chunk_size=CHUNK_SIZE, batch_data_key=None, cipher=DEFAULT_CIPHER, flags=0):
+    """Ключ данных и заголовок со слотами получателей; возвращает (ключ, заголовок, префикс)"""
+    # В пакетном режиме слоты получателей общие, у файла своя соль и свой ключ (HKDF)
+    batch_key, recipients = batch_data_key or new_batch_data_key(public_keys)
+    salt = os.urandom(SALT_SIZE)
+    data_key = derive_file_key(batch_key, salt)
+    header, prefix = build_header(KIND_RECIPIENTS, recipients + salt, chunk_size, cipher, flags)
+    return data_key, header, prefix
+
+
+def encrypt_public_key_stream(src, dst, public_keys, chunk_size=CHUNK_SIZE, batch_data_key=None, cipher=DEFAULT_CIPHER,
+                              compression=COMPRESS_NONE, flags=0):
+    """Данные шифруются один раз, ключ данных - для каждого из открытых ключей"""
+    first_chunk, compression = choose_compression(src, compression, chunk_size)
+    data_key, header, prefix = recipients_header(public_keys, chunk_size, batch_data_key, cipher, compression | flags)
+    encrypt_stream(src, dst, data_key, header, prefix, chunk_size, cipher, compression, first_chunk)
+
+
+def decrypt_private_key_stream(src, dst, private_key):
+    header = read_header(src)
+    if header["kind"] == KIND_RECIPIENTS:
+        data_key = derive_file_key(unwrap_for_recipient(private_key, header["recipients"]), header["salt"])
+    elif header["kind"] == KIND_PUBLIC_KEY_BATCH:
+        data_key = derive_file_key(unwrap_data_key(private_key, header["wrapped_key"]), header["salt"])
+    elif header["kind"] == KIND_PUBLIC_KEY:
+        data_key = unwrap_data_key(private_key, header["wrapped_key"])
+    else:
+        raise ValueError("Файл зашифрован не открытым ключом")
+    decrypt_stream(src, dst, data_key, header)
+
+
+class HashingReader:
+    """Обёртка над файлом: считает хеш содержимого по мере чтения (без второго прохода)"""
+    
+    def __init__(self, src, hasher):
+        self.src = src
+        self.hasher = hasher
+    
+    def read(self, size=-1):
+        data = self.src.read(size)
+        self.hasher.update(data)
+        return data
+    
+    def readinto(self, buffer):
+        count = self.src.readinto(buffer)
+        self.hasher.update(memoryview(buffer)[:count])
+        return count
+
+
+class HashingWriter:
+    """Обёртка над приёмником: считает хеш и размер записанных данных"""
+    
+    def __init__(self, dst, hasher):
+        self.dst = dst
+        self.hasher = hasher
+        self.size = 0
+    
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        return self.dst.write(data)
+
+
+def file_sha256(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as src:
+        for block in iter(lambda: src.read(CHUNK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def pread_exact(fd, size, offset):
+    """Чтение по смещению без общей позиции файла (в Windows - через lseek)"""
+    parts = []
+    while size > 0:
+        if hasattr(os, "pread"):
+            data = os.pread(fd, size, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            data = os.read(fd, size)
+        if not data:
+            raise ValueError("Файл повреждён: неожиданный конец данных")
+        parts.append(data)
+        size -= len(data)
+        offset += len(data)
+    return b"".join(parts)
+
+
+def pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def open_segment_files(source_path, output_path):
+    binary = getattr(os, "O_BINARY", 0)
+    src = os.open(source_path, os.O_RDONLY | binary)
+    try:
+        return src, os.open(output_path, os.O_WRONLY | binary)
+    except BaseException:
+        os.close(src)
+        raise
+
+
+def _encrypt_segment(source_path, output_path, key, header, prefix, chunk_size, cipher, size, start, end):
+    """Задача процесса: шифрование блоков [start, end) с записью на вычисленные места контейнера"""
+    aead = CIPHERS[cipher](key)
+    count = max(1, -(-size // chunk_size))
+    record_size = 4 + chunk_size + TAG_SIZE
+    src, dst = open_segment_files(source_path, output_path)
+    try:
+        for index in range(start, end):
+            last = index == count - 1
+            offset = index * chunk_size
+            started = time.perf_counter()
+            chunk = pread_exact(src, min(chunk_size, size - offset), offset)
+            record_stage("read", started, len(chunk))
+            length, encrypted = encrypt_record(aead, prefix, header, index, chunk, last)
+            started = time.perf_counter()
+            pwrite_all(dst, length + encrypted, len(header) + index * record_size)
+            record_stage("write", started, len(length) + len(encrypted))
+    finally:
+        os.close(src)
+        os.close(dst)
+
+
+def _decrypt_segment(source_path, output_path, key, header, count, start, end):
+    """Задача процесса: расшифровка блоков [start, end) несжатого контейнера в нужные места файла"""
+    aead = CIPHERS[header["cipher"]](key)
+    chunk_size = header["chunk_size"]
+    src, dst = open_segment_files(source_path, output_path)
+    try:
+        for index in range(start, end):
+            offset = chunk_record_offset(header, index)
+            (length,) = struct.unpack(">I", pread_exact(src, 4, offset))
+            last = bool(length & LAST_CHUNK_FLAG)
+            length &= ~LAST_CHUNK_FLAG
+            if last != (index == count - 1) or length > chunk_size + TAG_SIZE or (not last and length != chunk_size + TAG_SIZE):
+                raise ValueError("Файл повреждён: некорректный размер блока")
+            started = time.perf_counter()
+            encrypted = pread_exact(src, length, offset + 4)
+            record_stage("read", started, length)
+            started = time.perf_counter()
+            chunk = aead.decrypt(chunk_nonce(header["prefix"], index, last), encrypted, header["raw"])
+            record_stage("decrypt", started, len(chunk))
+            started = time.perf_counter()
+            pwrite_all(dst, chunk, index * chunk_size)
+            record_stage("write", started, len(chunk))
+    finally:
+        os.close(src)
+        os.close(dst)
+
+
+def _run_segment(task, metrics, *args):
+    """Задача отрезка в процессе пула; замеры отрезка возвращаются вызывающему"""
+    global _metrics
+    # Свой объект в каждой задаче: копия замеров родителя (при fork) сюда не пишется
+    _metrics = StageMetrics() if metrics else None
+    task(*args)
+    return _metrics.export() if metrics else None
+
+
+def run_segments(task, count, workers, args, hasher=None, source_path=None):
+    """Блоки файла делятся на отрезки по SEGMENT_CHUNKS и обрабатываются в пуле процессов"""
+    metrics = _metrics
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_segment, task, metrics is not None, *args, start, min(start + SEGMENT_CHUNKS, count))
+                   for start in range(0, count, SEGMENT_CHUNKS)]
+        if hasher is not None:
+            # Хеш для манифеста считается последовательно, пока процессы шифруют
+            with open(source_path, 'rb') as src:
+                for block in iter(lambda: src.read(CHUNK_SIZE), b""):
+                    hasher.update(block)
+        for future in futures:
+            exported = future.result()
+            if exported:
+                metrics.merge(exported)
+
+
+def encrypt_file_segments(file_path, dst, key, header, prefix, chunk_size, cipher, workers, hasher=None):
+    """Несжатый контейнер большого файла: размер известен заранее, каждый блок пишется на своё место"""
+    size = os.path.getsize(file_path)
+    count = max(1, -(-size // chunk_size))
+    dst.write(header)
+    dst.truncate(len(header) + count * (4 + TAG_SIZE) + size)
+    dst.flush()
+    run_segments(_encrypt_segment, count, workers,
+                 (file_path, dst.name, key, header, prefix, chunk_size, cipher, size), hasher, file_path)
+    if os.path.getsize(file_path) != size:
+        raise ValueError("Файл изменился во время шифрования")
+
+
+def decrypt_file_segments(file_path, dst, key, header, workers):
+    """Расшифровка несжатого контейнера по отрезкам; конец файла проверяется до запуска процессов"""
+    with open(file_path, 'rb') as src:
+        size = plaintext_size(src, header)
+        container_size = src.seek(0, os.SEEK_END)
+    chunk_size = header["chunk_size"]
+    count = max(1, -(-size // chunk_size))
+    if size < 0 or container_size != len(header["raw"]) + count * (4 + TAG_SIZE) + size:
+        raise ValueError("Файл повреждён: данные после последнего блока")
+    dst.truncate(size)
+    dst.flush()
+    run_segments(_decrypt_segment, count, workers, (file_path, dst.name, key, header, count))
+
+
+def segment_workers_for(workers):
+    """Процессов на один большой файл, когда папку обрабатывают workers процессов: вместе не больше числа ядер"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def use_segments(file_path, workers, compression=COMPRESS_NONE, chunk_size=CHUNK_SIZE):
+    """Большой файл шифруется по отрезкам, если контейнер будет несжатым (сжатые блоки разной длины)"""
+    if workers <= 1 or os.path.getsize(file_path) < PARALLEL_MIN_SIZE:
+        return False
+    if compression == COMPRESS_NONE:
+        return True
+    with open(file_path, 'rb') as src:
+        return choose_compression(src, compression, chunk_size)[1] == COMPRESS_NONE
+
+
+def encrypt_file_password(file_path, output_path, password, chunk_size=CHUNK_SIZE, batch_key=None, cipher=DEFAULT_CIPHER, hasher=None,
+                          compression=COMPRESS_NONE, workers=1, kdf=None):
+    if use_segments(file_path, workers, compression, chunk_size):
+        key, header, prefix = password_header(password, chunk_size, batch_key, cipher, kdf=kdf)
+        _write_output(output_path, lambda dst: encrypt_file_segments(file_path, dst, key, header, prefix, chunk_size, cipher, workers, hasher))
+        return
+    with open(file_path, 'rb') as src:
+        if hasher is not None:
+            src = HashingReader(src, hasher)
+        _write_output(output_path, lambda dst: encrypt_password_stream(src, dst, password, chunk_size, batch_key, cipher,
+                                                                       compression, kdf=kdf))
+
+
+def decrypt_file_container(src, file_path, output_path, password=None, private_key=None, workers=1):
+    """Расшифровка потокового контейнера в файл; большой несжатый контейнер - по отрезкам в пуле процессов"""
+    header, key = open_container(src, password, private_key)
+    if workers > 1 and not header["flags"] & COMPRESSION_MASK and os.path.getsize(file_path) >= PARALLEL_MIN_SIZE:
+        _write_output(output_path, lambda dst: decrypt_file_segments(file_path, dst, key, header, workers))
+    else:
+        _write_output(output_path, lambda dst: decrypt_stream(src, dst, key, header))
+
+
+def decrypt_file_password(file_path, output_path, password, workers=1):
+    with open(file_path, 'rb') as src:
+        if src.read(len(MAGIC)) != MAGIC:
+            # Старый формат: соль + Fernet-токен целиком
+            src.seek(0)
+            data = src.read()
+            key = base64.urlsafe_b64encode(derive_raw_key(password, data[:SALT_SIZE]))
+            decrypted = Fernet(key).decrypt(data[SALT_SIZE:])
+            _write_output(output_path, lambda dst: dst.write(decrypted))
+            return
+        
+        src.seek(0)
+        if is_reference(src):
+            _write_output(output_path, lambda dst: decrypt_reference(src, file_path, dst, password=password))
+            return
+        if workers > 1:
+            decrypt_file_container(src, file_path, output_path, password=password, workers=workers)
+            return
+        _write_output(output_path, lambda dst: decrypt_password_stream(src, dst, password))
+
+
+def encrypt_file_public_key(file_path, output_path, public_keys, chunk_size=CHUNK_SIZE, batch_data_key=None, cipher=DEFAULT_CIPHER, hasher=None,
+                            compression=COMPRESS_NONE, workers=1):
+    if use_segments(file_path, workers, compression, chunk_size):
+        key, header, prefix = recipients_header(public_keys, chunk_size, batch_data_key, cipher)
+        _write_output(output_path, lambda dst: encrypt_file_segments(file_path, dst, key, header, prefix, chunk_size, cipher, workers, hasher))
+        return
+    with open(file_path, 'rb') as src:
+        if hasher is not None:
+            src = HashingReader(src, hasher)
+        _write_output(output_path, lambda dst: encrypt_public_key_stream(src, dst, public_keys, chunk_size, batch_data_key, cipher, compression))
+
+
+def decrypt_file_private_key(file_path, output_path, private_key, workers=1):
+    with open(file_path, 'rb') as src:
+        if src.read(len(MAGIC)) != MAGIC:
+            # Старый формат: RSA-обёртка ключа + Fernet-токен целиком
+            src.seek(0)
+            fernet, token = legacy_fernet(private_key, src.read())
+            decrypted = fernet.decrypt(token)
+            _write_output(output_path, lambda dst: dst.write(decrypted))
+            return
+        
+        src.seek(0)
+        if is_reference(src):
+            _write_output(output_path, lambda dst: decrypt_reference(src, file_path, dst, private_key=private_key))
+            return
+        if workers > 1:
+            decrypt_file_container(src, file_path, output_path, private_key=private_key, workers=workers)
+            return
+        _write_output(output_path, lambda dst: decrypt_private_key_stream(src, dst, private_key))
+
+
+class NullWriter:
+    """Приёмник, который только считает байты (проверка без записи расшифрованных данных)"""
+    
+    def __init__(self):
+        self.size = 0
+    
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def verify_file(file_path, password=None, private_key=None):
+    """Проверка подлинности всех блоков файла без записи результата; возвращает размер исходных данных"""
+    if password is None and private_key is None:
+        raise ValueError("Для проверки нужен пароль или закрытый ключ")
+    with open(file_path, 'rb') as src:
+        if src.read(len(MAGIC)) != MAGIC:
+            # Старые форматы: Fernet проверяет HMAC всего токена
+            src.seek(0)
+            data = src.read()
+            if private_key is not None:
+                fernet, token = legacy_fernet(private_key, data)
+                return len(fernet.decrypt(token))
+            key = base64.urlsafe_b64encode(derive_raw_key(password, data[:SALT_SIZE]))
+            return len(Fernet(key).decrypt(data[SALT_SIZE:]))
+        
+        src.seek(0)
+        header, key = open_container(src, password, private_key)
+        if header["flags"] & FLAG_REFERENCE:
+            # Ссылка дедупликации: проверяется и она, и объект хранилища (со сверкой SHA-256)
+            src.seek(0)
+            return decrypt_reference(src, file_path, NullWriter(), password, private_key)
+        sink = NullWriter()
+        try:
+            decrypt_stream(src, sink, key, header)
+        except InvalidTag:
+            if sink.size == 0:
+                raise ValueError("Неверный пароль или ключ, либо повреждён первый блок")
+            raise ValueError(f"Файл повреждён: ошибка проверки после {sink.size} байт")
+        return sink.size
+
+
+def open_container(src, password=None, private_key=None):
+    """Чтение заголовка и получение ключа данных (по паролю или закрытому ключу)"""
+    header = read_header(src)
+    if header["kind"] in (KIND_PASSWORD, KIND_PASSWORD_BATCH):
+        if password is None:
+            raise ValueError("Файл зашифрован паролем")
+        return header, password_key(header, password)
+    if private_key is None:
+        raise ValueError("Файл зашифрован открытым ключом")
+    if header["kind"] == KIND_RECIPIENTS:
+        return header, derive_file_key(unwrap_for_recipient(private_key, header["recipients"]), header["salt"])
+    if header["kind"] == KIND_PUBLIC_KEY_BATCH:
+        return header, derive_file_key(unwrap_data_key(private_key, header["wrapped_key"]), header["salt"])
+    return header, unwrap_data_key(private_key, header["wrapped_key"])
+
+
+def chunk_record_offset(header, index):
+    """Индекс блоков: все блоки, кроме последнего, одного размера, поэтому смещение вычисляется"""
+    return len(header["raw"]) + index * (4 + header["chunk_size"] + TAG_SIZE)
+
+
+def chunk_offsets(src, header):
+    """Смещения записей блоков сжатого контейнера: проход по длинам без чтения данных"""
+    offsets = []
+    offset = len(header["raw"])
+    max_length = max_record_length(header)
+    while True:
+        src.seek(offset)
+        (length,) = struct.unpack(">I", read_exact(src, 4))
+        offsets.append(offset)
+        if length & LAST_CHUNK_FLAG:
+            return offsets
+        if length > max_length:
+            raise ValueError("Файл повреждён: некорректный размер блока")
+        offset += 4 + length
+
+
+def read_chunk(src, aead, header, index, offset=None):
+    """Чтение и расшифровка одного блока по его номеру; возвращает (данные, последний ли)"""
+    compression = header["flags"] & COMPRESSION_MASK
+    src.seek(chunk_record_offset(header, index) if offset is None else offset)
+    (length,) = struct.unpack(">I", read_exact(src, 4))
+    last = bool(length & LAST_CHUNK_FLAG)
+    length &= ~LAST_CHUNK_FLAG
+    full_length = header["chunk_size"] + TAG_SIZE
+    if length > max_record_length(header) or (not last and not compression and length != full_length):
+        raise ValueError("Файл повреждён: некорректный размер блока")
+    encrypted = read_exact(src, length)
+    chunk = aead.decrypt(chunk_nonce(header["prefix"], index, last), encrypted, header["raw"])
+    if compression:
+        chunk = unpack_chunk(chunk, compression, header["chunk_size"])
+        if not last and len(chunk) != header["chunk_size"]:
+            raise ValueError("Файл повреждён: некорректный размер блока")
+    return chunk, last
+
+
+def plaintext_size(src, header):
+    """Размер исходных данных по размеру контейнера и длине последнего блока (без сжатия)"""
+    src.seek(0, os.SEEK_END)
+    data_size = src.tell() - len(header["raw"])
+    record_size = 4 + header["chunk_size"] + TAG_SIZE
+    count = max(1, -(-data_size // record_size))
+    src.seek(chunk_record_offset(header, count - 1))
+    (length,) = struct.unpack(">I", read_exact(src, 4))
+    if not length & LAST_CHUNK_FLAG:
+        raise ValueError("Файл повреждён: нет последнего блока")
+    return (count - 1) * header["chunk_size"] + (length & ~LAST_CHUNK_FLAG) - TAG_SIZE
+
+
+class ContainerReader:
+    """Произвольный доступ к открытому тексту контейнера: расшифровываются только нужные блоки"""
+    
+    def __init__(self, src, key, header):
+        self.src = src
+        self.header = header
+        self.chunk_size = header["chunk_size"]
+        self.aead = CIPHERS[header["cipher"]](key)
+        # Последний расшифрованный блок: подряд идущие чтения не расшифровывают его повторно
+        self.cached_index = None
+        self.cached_chunk = None
+        if header["flags"] & COMPRESSION_MASK:
+            # Сжатые блоки разной длины: смещения берутся из прохода по заголовкам записей,
+            # размер данных - по расшифрованному последнему блоку
+            self.offsets = chunk_offsets(src, header)
+            self.size = (len(self.offsets) - 1) * self.chunk_size + len(self.chunk(len(self.offsets) - 1))
+        else:
+            self.offsets = None
+            self.size = plaintext_size(src, header)
+    
+    def chunk(self, index):
+        if index != self.cached_index:
+            offset = self.offsets[index] if self.offsets else None
+            self.cached_chunk, _ = read_chunk(self.src, self.aead, self.header, index, offset)
+            self.cached_index = index
+        return self.cached_chunk
+    
+    def copy(self, dst, offset, length):
+        """Запись диапазона открытого текста в поток dst; возвращает число байтов"""
+        end = min(offset + length, self.size)
+        if offset >= end:
+            return 0
+        written = 0
+        for index in range(offset // self.chunk_size, (end - 1) // self.chunk_size + 1):
+            chunk = self.chunk(index)
+            start = index * self.chunk_size
+            piece = chunk[max(offset - start, 0):end - start]
+            dst.write(piece)
+            written += len(piece)
+        return written
+    
+    def read(self, offset, length):
+        dst = io.BytesIO()
+        self.copy(dst, offset, length)
+        return dst.getvalue()
+
+
+def decrypt_range_stream(src, dst, key, header, offset, length):
+    """Расшифровка диапазона байтов: читаются и проверяются только покрывающие его блоки"""
+    return ContainerReader(src, key, header).copy(dst, offset, length)
+
+
+def decrypt_file_range(file_path, dst, offset, length, password=None, private_key=None):
+    """Расшифровка части файла .enc/.rsa в поток dst; возвращает число записанных байтов"""
+    with open(file_path, 'rb') as src:
+        if src.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Выборочная расшифровка доступна только для потокового формата")
+        src.seek(0)
+        header, key = open_container(src, password, private_key)
+        return decrypt_range_stream(src, dst, key, header, offset, length)
+
+
+class ArchiveSource:
+    """Открытый текст архива для encrypt_stream: файлы подряд, затем индекс и его расположение
+
+    Новые файлы не добавляются, когда размер данных достиг max_size (файл не делится между архивами).
+    hashed - записать в индекс SHA-256 каждого файла (для каталога)
+    """
+    
+    def __init__(self, files, root, max_size=None, on_file=None, hashed=False):
+        self.files = files
+        self.root = root
+        self.max_size = max_size
+        self.on_file = on_file
+        self.hashed = hashed
+        self.entries = []
+        self.errors = []
+        self.offset = 0
+        self.current = None
+        self.current_entry = None
+        self.current_hasher = None
+        self.tail = None
+        self.tail_position = 0
+        self.exhausted = False
+    
+    def _open_next(self):
+        while not (self.max_size and self.entries and self.offset >= self.max_size):
+            file_path = next(self.files, None)
+            if file_path is None:
+                self.exhausted = True
+                return False
+            try:
+                source = open(file_path, 'rb')
+                source_stat = os.fstat(source.fileno())
+            except OSError as e:
+                self.errors.append(f"Ошибка чтения {file_path}: {str(e)}")
+                continue
+            self.current = source
+            self.current_entry = {
+                "name": os.path.relpath(file_path, self.root).replace(os.sep, "/"),
+                "offset": self.offset,
+                "size": 0,
+                "mtime_ns": source_stat.st_mtime_ns,
+                "path": file_path,
+            }
+            self.current_hasher = hashlib.sha256() if self.hashed else None
+            return True
+        return False
+    
+    def _close_current(self):
+        self.current.close()
+        self.current = None
+        entry = self.current_entry
+        if self.current_hasher is not None:
+            entry["sha256"] = self.current_hasher.hexdigest()
+        self.entries.append(entry)
+        if self.on_file:
+            self.on_file(entry["path"], entry["size"])
+    
+    def _build_tail(self):
+        index = json.dumps({
+            "version": ARCHIVE_VERSION,
+            "files": [{key: value for key, value in entry.items() if key != "path"} for entry in self.entries],
+        }, ensure_ascii=False).encode("utf-8")
+        return index + ARCHIVE_TRAILER.pack(self.offset, len(index))
+    
+    def read(self, size):
+        parts = []
+        left = size
+        while left > 0:
+            if self.tail is not None:
+                piece = self.tail[self.tail_position:self.tail_position + left]
+                self.tail_position += len(piece)
+                if not piece:
+                    break
+            elif self.current is not None:
+                piece = self.current.read(left)
+                if not piece:
+                    self._close_current()
+                    continue
+                self.current_entry["size"] += len(piece)
+                self.offset += len(piece)
+                if self.current_hasher is not None:
+                    self.current_hasher.update(piece)
+            elif not self._open_next():
+                self.tail = self._build_tail()
+                continue
+            else:
+                continue
+            parts.append(piece)
+            left -= len(piece)
+        return b"".join(parts)
+
+
+def next_archive_path(folder):
+    """Первое свободное имя архива в папке"""
+    number = 1
+    while True:
+        archive_path = os.path.join(folder, f"{ARCHIVE_PREFIX}{number:04d}{ARCHIVE_EXT}")
+        if not os.path.exists(archive_path):
+            return archive_path
+        number += 1
+
+
+def write_job_container(output_path, source, job, flags):
+    """Шифрование потока source в контейнер с флагами flags (ключи и параметры из задания)"""
+    chunk_size = job.get("chunk_size", CHUNK_SIZE)
+    cipher = job.get("cipher", DEFAULT_CIPHER)
+    compression = job.get("compression", COMPRESS_NONE)
+    if job["asymmetric"]:
+        writer = lambda dst: encrypt_public_key_stream(source, dst, job["public_keys"], chunk_size, job.get("batch_data_key"),
+                                                       cipher, compression, flags)
+    else:
+        writer = lambda dst: encrypt_password_stream(source, dst, job["password"], chunk_size, job.get("batch_key"),
+                                                     cipher, compression, flags)
+    _write_output(output_path, writer)
+
+
+def write_archive(output_path, source, job):
+    """Шифрование потока ArchiveSource в файл архива"""
+    write_job_container(output_path, source, job, FLAG_ARCHIVE)
+
+
+def write_archives(files, root, job, max_size=DEFAULT_ARCHIVE_SIZE, on_file=None, hashed=False):
+    """Упаковка потока файлов в архивы не больше max_size; генератор (путь архива, записи индекса, ошибки)"""
+    files = iter(files)
+    while True:
+        source = ArchiveSource(files, root, max_size, on_file, hashed)
+        archive_path = next_archive_path(root)
+        write_archive(archive_path, source, job)
+        if not source.entries:
+            # Файлы кончились ровно на границе архива: пустой архив не нужен
+            os.remove(archive_path)
+            if source.errors:
+                yield None, [], source.errors
+            return
+        yield archive_path, source.entries, source.errors
+        if source.exhausted:
+            return
+
+
+def open_archive(src, password=None, private_key=None):
+    """Чтение индекса архива; возвращает (ContainerReader, записи индекса)"""
+    header, key = open_container(src, password, private_key)
+    if not header["flags"] & FLAG_ARCHIVE:
+        raise ValueError("Файл не является архивом")
+    reader = ContainerReader(src, key, header)
+    if reader.size < ARCHIVE_TRAILER.size:
+        raise ValueError("Файл повреждён: нет индекса архива")
+    index_offset, index_length = ARCHIVE_TRAILER.unpack(reader.read(reader.size - ARCHIVE_TRAILER.size, ARCHIVE_TRAILER.size))
+    if index_offset + index_length + ARCHIVE_TRAILER.size != reader.size:
+        raise ValueError("Файл повреждён: некорректное расположение индекса")
+    index = json.loads(reader.read(index_offset, index_length).decode("utf-8"))
+    if index.get("version") != ARCHIVE_VERSION:
+        raise ValueError(f"Неподдерживаемая версия архива: {index.get('version')}")
+    return reader, index["files"]
+
+
+def list_archive(file_path, password=None, private_key=None):
+    """Список файлов архива (расшифровываются только блоки с индексом)"""
+    with open(file_path, 'rb') as src:
+        return open_archive(src, password, private_key)[1]
+
+
+def member_path(target_dir, name):
+    """Путь для извлечения файла архива; имена с выходом за пределы папки отвергаются"""
+    parts = name.split("/")
+    if not name or name.startswith("/") or any(part in ("", ".", "..") or ":" in part or "\\" in part for part in parts):
+        raise ValueError(f"Недопустимое имя в архиве: {name}")
+    return os.path.join(target_dir, *parts)
+
+
+def extract_archive_member(file_path, name, dst, password=None, private_key=None):
+    """Извлечение одного файла архива в поток dst без расшифровки остальных"""
+    with open(file_path, 'rb') as src:
+        reader, entries = open_archive(src, password, private_key)
+        for entry in entries:
+            if entry["name"] == name:
+                return reader.copy(dst, entry["offset"], entry["size"])
+    raise ValueError(f"Файл не найден в архиве: {name}")
+
+
+def extract_archive(file_path, target_dir, password=None, private_key=None, names=None, durable=False):
+    """Извлечение файлов архива (всех или из names) в папку; каждый блок расшифровывается один раз
+
+    durable - сбросить извлечённые файлы и папки на диск до возврата (перед удалением архива)
+    """
+    extracted = 0
+    folders = set()
+    with open(file_path, 'rb') as src:
+        reader, entries = open_archive(src, password, private_key)
+        for entry in sorted(entries, key=lambda item: item["offset"]):
+            if names is not None and entry["name"] not in names:
+                continue
+            output_path = member_path(target_dir, entry["name"])
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            _write_output(output_path, lambda dst: reader.copy(dst, entry["offset"], entry["size"]))
+            os.utime(output_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            if durable:
+                fsync_file(output_path)
+                folders.add(os.path.dirname(output_path))
+            extracted += 1
+    for folder in folders:
+        fsync_dir(folder)
+    return extracted
+
+
+def encrypt_job_file(file_path, output_path, job, hasher=None):
+    """Шифрование файла ключами задания (пакетный ключ пароля или ключ данных получателей)"""
+    chunk_size = job.get("chunk_size", CHUNK_SIZE)
+    if job["asymmetric"]:
+        encrypt_file_public_key(file_path, output_path, job["public_keys"], chunk_size,
+                                batch_data_key=job.get("batch_data_key"), cipher=job.get("cipher", DEFAULT_CIPHER),
+                                hasher=hasher, compression=job.get("compression", COMPRESS_NONE),
+                                workers=job.get("segment_workers", 1))
+    else:
+        encrypt_file_password(file_path, output_path, job["password"], chunk_size,
+                              batch_key=job.get("batch_key"), cipher=job.get("cipher", DEFAULT_CIPHER),
+                              hasher=hasher, compression=job.get("compression", COMPRESS_NONE),
+                              workers=job.get("segment_workers", 1))
+
+
+def in_service_dir(file_path, root):
+    """Файл хранилища дедупликации или каталога (не обрабатывается как обычный файл папки)"""
+    return os.path.relpath(file_path, root).split(os.sep)[0] in SERVICE_DIRS
+
+
+def open_store(root, job):
+    """Хранилище дедупликации в корне папки; возвращает (описание для задания, индекс хранилища)
+
+    Имя объекта - HMAC от SHA-256 содержимого. При шифровании паролем ключ HMAC выводится из пароля,
+    и по имени нельзя проверить догадку о содержимом; при шифровании открытыми ключами секрета
+    у шифрующего нет, и ключом служит случайная соль хранилища.
+    """
+    path = os.path.join(root, STORE_NAME)
+    index_path = os.path.join(path, STORE_INDEX)
+    try:
+        with open(index_path, encoding='utf-8') as file:
+            index = json.load(file)
+    except FileNotFoundError:
+        index = {"version": STORE_VERSION, "asymmetric": job["asymmetric"], "identity": manifest_identity(job),
+                 "salt": os.urandom(SALT_SIZE).hex(), "sizes": []}
+    except ValueError:
+        raise ValueError(f"Индекс хранилища повреждён: {index_path}")
+    if index.get("version") != STORE_VERSION or index.get("asymmetric") != job["asymmetric"]:
+        raise ValueError(f"Неподдерживаемое хранилище: {path}")
+    if not identity_matches(index.get("identity") or {}, job):
+        raise ValueError("Хранилище создано с другим паролем или для других получателей")
+    
+    salt = bytes.fromhex(index["salt"])
+    if job["asymmetric"]:
+        key = salt
+    else:
+        identity = index["identity"]
+        master_key = derive_master_key(job["password"], bytes.fromhex(identity["salt"]), check_kdf(identity.get("kdf", LEGACY_KDF)))
+        key = derive_file_key(master_key, salt)
+    return {"path": path, "key": key}, index
+
+
+def save_store_index(store, index, sizes):
+    """Индекс хранилища: параметры и размеры содержимого объектов (дубликат возможен только при том же размере)"""
+    index["sizes"] = sorted(sizes)
+    os.makedirs(store["path"], exist_ok=True)
+    data = json.dumps(index, ensure_ascii=False).encode("utf-8")
+    _write_output(os.path.join(store["path"], STORE_INDEX), lambda dst: dst.write(data))
+
+
+def store_object_path(store, digest, ext):
+    object_id = hmac.new(store["key"], digest, hashlib.sha256).hexdigest()
+    return os.path.join(store["path"], object_id[:2], object_id + ext)
+
+
+def publish_object(pending_path, object_path, durable):
+    """Перенос нового объекта на место; если такой объект уже есть (дубликат в соседнем процессе), копия удаляется"""
+    if os.path.exists(object_path):
+        os.remove(pending_path)
+        return False
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    os.replace(pending_path, object_path)
+    if durable:
+        fsync_file(object_path)
+        fsync_dir(os.path.dirname(object_path))
+    return True
+
+
+def encrypt_deduplicated(file_path, output_path, job, hash_first=False):
+    """Шифрование с дедупликацией: содержимое - объект хранилища (шифруется, только если его ещё нет),
+    на месте файла - зашифрованная ссылка на объект; возвращает (SHA-256, создан ли новый объект)
+
+    hash_first - файл такого размера уже встречался: хеш считается до шифрования, чтобы не шифровать дубликат;
+    иначе хеш считается по ходу шифрования (одно чтение), а имя объекта становится известно в конце
+    """
+    store = job["store"]
+    ext = ".rsa" if job["asymmetric"] else ".enc"
+    size = os.path.getsize(file_path)
+    digest = file_sha256(file_path) if hash_first else None
+    object_path = store_object_path(store, bytes.fromhex(digest), ext) if digest else None
+    created = False
+    if object_path is None or not os.path.exists(object_path):
+        hasher = hashlib.sha256()
+        os.makedirs(store["path"], exist_ok=True)
+        pending_path = os.path.join(store["path"], f"pending-{os.getpid()}-{threading.get_ident()}{ext}")
+        encrypt_job_file(file_path, pending_path, job, hasher)
+        if digest is not None and hasher.hexdigest() != digest:
+            os.remove(pending_path)
+            raise ValueError("Файл изменился во время шифрования")
+        digest = hasher.hexdigest()
+        object_path = store_object_path(store, hasher.digest(), ext)
+        created = publish_object(pending_path, object_path, bool(job.get("defer_delete")))
+    
+    reference = {
+        "version": REFERENCE_VERSION,
+        "object": os.path.relpath(object_path, os.path.dirname(os.path.abspath(output_path))).replace(os.sep, "/"),
+        "sha256": digest,
+        "size": size,
+    }
+    write_job_container(output_path, io.BytesIO(json.dumps(reference).encode("utf-8")), job, FLAG_REFERENCE)
+    return digest, created
+
+
+def is_reference(src):
+    """Контейнер - ссылка дедупликации (позиция в потоке не меняется)"""
+    position = src.tell()
+    try:
+        return bool(read_header(src)["flags"] & FLAG_REFERENCE)
+    finally:
+        src.seek(position)
+
+
+def read_reference(src, password=None, private_key=None):
+    header, key = open_container(src, password, private_key)
+    data = io.BytesIO()
+    decrypt_stream(src, data, key, header)
+    reference = json.loads(data.getvalue().decode("utf-8"))
+    if reference.get("version") != REFERENCE_VERSION:
+        raise ValueError(f"Неподдерживаемая версия ссылки: {reference.get('version')}")
+    return reference
+
+
+def reference_object_path(file_path, reference):
+    """Путь объекта по ссылке (относительно папки ссылки); допускаются только объекты хранилища"""
+    parts = reference["object"].split("/")
+    if STORE_NAME not in parts or any(part in ("", ".") for part in parts):
+        raise ValueError(f"Недопустимая ссылка на объект: {reference['object']}")
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(file_path)), *parts))
+
+
+def decrypt_reference(src, file_path, dst, password=None, private_key=None):
+    """Расшифровка объекта, на который указывает ссылка, в поток dst со сверкой SHA-256; возвращает размер"""
+    reference = read_reference(src, password, private_key)
+    object_path = reference_object_path(file_path, reference)
+    hasher = hashlib.sha256()
+    writer = HashingWriter(dst, hasher)
+    try:
+        object_src = open(object_path, 'rb')
+    except FileNotFoundError:
+        raise ValueError(f"Объект хранилища не найден: {object_path}")
+    with object_src:
+        header, key = open_container(object_src, password, private_key)
+        decrypt_stream(object_src, writer, key, header)
+    if hasher.hexdigest() != reference["sha256"]:
+        raise ValueError(f"Объект хранилища не совпадает со ссылкой: {object_path}")
+    return writer.size
+
+
+def catalog_segments(root):
+    """Части каталога папки в порядке записи (записи поздних частей заменяют ранние)"""
+    folder = os.path.join(root, CATALOG_NAME)
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(folder, name) for name in sorted(names)
+            if name.startswith(CATALOG_PREFIX) and name.endswith(CATALOG_EXT)]
+
+
+def catalog_name(file_path, root):
+    return os.path.relpath(file_path, root).replace(os.sep, "/")
+
+
+def catalog_entry(file_path, root, record):
+    """Запись каталога по записи манифеста зашифрованного файла (контейнер лежит рядом с исходным файлом)"""
+    return {
+        "size": record["size"],
+        "mtime_ns": record["mtime_ns"],
+        "sha256": record["sha256"],
+        "container": catalog_name(os.path.join(os.path.dirname(file_path), record["output"]), root),
+        "offset": None,
+    }
+
+
+def archive_catalog_entry(archive_path, root, entry):
+    """Запись каталога по записи индекса архива: offset - смещение файла в открытом тексте архива"""
+    return {
+        "size": entry["size"],
+        "mtime_ns": entry["mtime_ns"],
+        "sha256": entry.get("sha256"),
+        "container": catalog_name(archive_path, root),
+        "offset": entry["offset"],
+    }
+
+
+def read_catalog_segment(segment_path, password=None, private_key=None):
+    try:
+        with open(segment_path, 'rb') as src:
+            header, key = open_container(src, password, private_key)
+            if not header["flags"] & FLAG_CATALOG:
+                raise ValueError(f"Файл не является частью каталога: {segment_path}")
+            data = io.BytesIO()
+            decrypt_stream(src, data, key, header)
+    except InvalidTag:
+        raise ValueError(f"Неверный пароль или ключ, либо каталог повреждён: {segment_path}")
+    catalog = json.loads(data.getvalue().decode("utf-8"))
+    if catalog.get("version") != CATALOG_VERSION:
+        raise ValueError(f"Неподдерживаемая версия каталога: {catalog.get('version')}")
+    fields = catalog["fields"]
+    return {item[0]: dict(zip(fields, item[1:])) for item in catalog["files"]}
+
+
+def read_catalog_segments(root, password=None, private_key=None):
+    """Части каталога, которые открываются этим паролем или ключом: ([(путь, записи)], [непрочитанные пути])"""
+    readable = []
+    unreadable = []
+    for segment_path in catalog_segments(root):
+        try:
+            readable.append((segment_path, read_catalog_segment(segment_path, password, private_key)))
+        except ValueError:
+            unreadable.append(segment_path)
+    return readable, unreadable
+
+
+def load_catalog(root, password=None, private_key=None, skipped=None):
+    """Каталог папки: путь файла относительно корня (через "/") -> запись; дерево папки не обходится
+
+    Части, записанные другим паролем или для других получателей, пропускаются (их пути - в список skipped);
+    если не открылась ни одна часть - ValueError.
+    """
+    segments = catalog_segments(root)
+    if not segments:
+        raise ValueError(f"Каталог не найден: {os.path.join(root, CATALOG_NAME)}")
+    readable, unreadable = read_catalog_segments(root, password, private_key)
+    if not readable:
+        # Сообщение об ошибке первой части: неверный пароль или ключ, повреждение
+        read_catalog_segment(segments[0], password, private_key)
+    if skipped is not None:
+        skipped.extend(unreadable)
+    entries = {}
+    for segment_path, segment_entries in readable:
+        entries.update(segment_entries)
+    return entries
+
+
+def write_catalog(root, job, entries, replace=(), durable=False):
+    """Новая часть каталога с записями entries (ключами задания); части replace удаляются после её записи"""
+    folder = os.path.join(root, CATALOG_NAME)
+    os.makedirs(folder, exist_ok=True)
+    segments = catalog_segments(root)
+    number = int(os.path.basename(segments[-1])[len(CATALOG_PREFIX):-len(CATALOG_EXT)]) + 1 if segments else 1
+    segment_path = os.path.join(folder, f"{CATALOG_PREFIX}{number:06d}{CATALOG_EXT}")
+    catalog = {
+        "version": CATALOG_VERSION,
+        "fields": list(CATALOG_FIELDS),
+        "files": [[name] + [entry[field] for field in CATALOG_FIELDS] for name, entry in sorted(entries.items())],
+    }
+    data = json.dumps(catalog, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    # Пути и хеши хорошо сжимаются независимо от настройки сжатия файлов
+    write_job_container(segment_path, io.BytesIO(data), dict(job, compression=COMPRESS_ZLIB), FLAG_CATALOG)
+    if durable:
+        fsync_file(segment_path)
+        fsync_dir(folder)
+    for old_path in replace:
+        os.remove(old_path)
+    return segment_path
+
+
+def update_catalog(root, job, entries, durable=False):
+    """Добавление записей шифрования в каталог; возвращает сообщение для лога или None
+
+    При шифровании паролем части каталога, открытые этим паролем, переписываются одной частью (записи об
+    удалённых контейнерах отбрасываются); части другого пароля или получателей остаются как есть.
+    При шифровании открытыми ключами прочитать каталог нечем, и записи дописываются новой частью.
+    """
+    if job["asymmetric"] or not catalog_segments(root):
+        write_catalog(root, job, entries, durable=durable)
+        return None
+    readable, unreadable = read_catalog_segments(root, job["password"])
+    message = None
+    if unreadable:
+        message = f"Части каталога другого пароля или ключа сохранены без изменений: {len(unreadable)}"
+    merged = {}
+    for segment_path, segment_entries in readable:
+        merged.update(segment_entries)
+    
+    def present(entry):
+        try:
+            return os.path.exists(member_path(root, entry["container"]))
+        except ValueError:
+            # Запись указывает за пределы папки: отбрасывается, а не прерывает обновление
+            return False
+    
+    merged = {name: entry for name, entry in merged.items() if present(entry)}
+    merged.update(entries)
+    write_catalog(root, job, merged, [segment_path for segment_path, _ in readable], durable)
+    return message
+
+
+def search_catalog(entries, pattern=None, prefix=None):
+    """Записи каталога по префиксу пути и маске (без "/" - по имени файла, с "/" - по пути); список (путь, запись)"""
+    names = sorted(entries)
+    if prefix:
+        # Имена отсортированы: записи с префиксом идут подряд
+        prefix = prefix.replace("\\", "/")
+        names = names[bisect_left(names, prefix):bisect_left(names, prefix + "\U0010ffff")]
+    if pattern:
+        name_globs, path_globs = split_globs([pattern])
+        names = [name for name in names if glob_match(name_globs, path_globs, name.rsplit("/", 1)[-1], name)]
+    return [(name, entries[name]) for name in names]
+
+
+def restore_from_catalog(root, name, output_path, password=None, private_key=None, entries=None):
+    """Восстановление одного файла по каталогу: расшифровывается только его контейнер (в архиве - только его блоки)
+
+    Содержимое сверяется с SHA-256 из каталога; возвращает размер
+    """
+    if entries is None:
+        entries = load_catalog(root, password, private_key)
+    entry = entries.get(name.replace(os.sep, "/"))
+    if entry is None:
+        raise ValueError(f"Файл не найден в каталоге: {name}")
+    container_path = member_path(root, entry["container"])
+    hasher = hashlib.sha256()
+    
+    def restore(dst):
+        writer = HashingWriter(dst, hasher)
+        with open(container_path, 'rb') as src:
+            if entry["offset"] is not None:
+                header, key = open_container(src, password, private_key)
+                if not header["flags"] & FLAG_ARCHIVE:
+                    raise ValueError(f"Файл не является архивом: {container_path}")
+                ContainerReader(src, key, header).copy(writer, entry["offset"], entry["size"])
+            elif is_reference(src):
+                decrypt_reference(src, container_path, writer, password, private_key)
+            else:
+                header, key = open_container(src, password, private_key)
+                decrypt_stream(src, writer, key, header)
+        if writer.size != entry["size"] or (entry["sha256"] and hasher.hexdigest() != entry["sha256"]):
+            raise ValueError(f"Содержимое {container_path} не совпадает с каталогом")
+    
+    _write_output(output_path, restore)
+    os.utime(output_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    return entry["size"]
+
+
+def encrypt_text_password(text, password, cipher=DEFAULT_CIPHER, kdf=None):
+    """Шифрование текста паролем: контейнер в base64"""
+    dst = io.BytesIO()
+    encrypt_password_stream(io.BytesIO(text.encode()), dst, password, cipher=cipher, kdf=kdf)
+    return base64.urlsafe_b64encode(dst.getvalue()).decode()
+
+
+def decrypt_text_password(text, password):
+    data = base64.urlsafe_b64decode(text)
+    if data[:len(MAGIC)] != MAGIC:
+        # Старый формат: соль + Fernet-токен
+        key = base64.urlsafe_b64encode(derive_raw_key(password, data[:SALT_SIZE]))
+        return Fernet(key).decrypt(data[SALT_SIZE:]).decode()
+    dst = io.BytesIO()
+    decrypt_password_stream(io.BytesIO(data), dst, password)
+    return dst.getvalue().decode()
+
+
+def encrypt_text_public_key(text, public_keys, cipher=DEFAULT_CIPHER):
+    """Гибридное шифрование текста: длина текста не ограничена размером ключа RSA"""
+    dst = io.BytesIO()
+    encrypt_public_key_stream(io.BytesIO(text.encode()), dst, public_keys, cipher=cipher)
+    return base64.b64encode(dst.getvalue()).decode()
+
+
+def decrypt_text_private_key(text, private_key):
+    data = base64.b64decode(text)
+    if data[:len(MAGIC)] != MAGIC:
+        # Старый формат: текст, зашифрованный RSA-OAEP напрямую
+        if not isinstance(private_key, rsa.RSAPrivateKey):
+            raise ValueError("Текст старого формата расшифровывается только ключом RSA")
+        return private_key.decrypt(data, OAEP_PADDING).decode()
+    dst = io.BytesIO()
+    decrypt_private_key_stream(io.BytesIO(data), dst, private_key)
+    return dst.getvalue().decode()
+
+
+def decrypted_path(file_path, ext):
+    """Путь для расшифрованного файла: убираем расширение .enc/.rsa"""
+    if file_path.endswith(ext):
+        return file_path[:-len(ext)]
+    return file_path + '.dec'
+
+
+def manifest_record(source_stat, output_path, sha256):
+    output_stat = os.stat(output_path)
+    return {
+        "size": source_stat.st_size,
+        "mtime_ns": source_stat.st_mtime_ns,
+        "sha256": sha256,
+        "output": os.path.basename(output_path),
+        "output_size": output_stat.st_size,
+        "output_mtime_ns": output_stat.st_mtime_ns,
+    }
+
+
+def process_file(file_path, job, known_hash=None, hash_first=False):
+    """Обработка одного файла пакетной операции; возвращает (успех, сообщения для лога, запись манифеста, размер)
+
+    hash_first - при дедупликации хешировать файл до шифрования (файл такого размера уже встречался)
+    """
+    started = time.perf_counter()
+    outcome = _process_file(file_path, job, known_hash, hash_first)
+    # Время файла целиком - вместе с проверкой, удалением оригинала и ошибками
+    record_stage("file", started, outcome[-1])
+    return outcome
+
+
+def _process_file(file_path, job, known_hash, hash_first):
+    operation = job["operation"]
+    asymmetric = job["asymmetric"]
+    messages = []
+    record = None
+    # Размер входного файла - для подсчёта скорости обработки
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        size = 0
+    try:
+        if operation == "verify":
+            # Только проверка: в лог попадают лишь файлы, не прошедшие проверку
+            try:
+                verify_file(file_path, job["password"], job["private_key"])
+                return True, messages, None, size
+            except Exception as e:
+                messages.append(f"Не прошёл проверку: {file_path} - {str(e)}")
+                return False, messages, None, size
+        
+        if operation == "encrypt":
+            output_path = file_path + ('.rsa' if asymmetric else '.enc')
+            source_stat = os.stat(file_path) if job.get("manifest") else None
+            
+            # Время изменения другое, но размер прежний: сверяем хеш, прежде чем шифровать заново
+            if known_hash and file_sha256(file_path) == known_hash:
+                messages.append(f"Без изменений: {file_path}")
+                return True, messages, dict(manifest_record(source_stat, output_path, known_hash), unchanged=True), size
+            
+            hasher = hashlib.sha256() if job.get("manifest") else None
+            try:
+                if job.get("store"):
+                    # Дедупликация: признак дубликата передаётся в run_folder вместе с записью манифеста
+                    digest, created = encrypt_deduplicated(file_path, output_path, job, hash_first)
+                    record = {"duplicate": not created}
+                    if hasher is not None:
+                        record.update(manifest_record(source_stat, output_path, digest))
+                else:
+                    encrypt_job_file(file_path, output_path, job, hasher)
+                    if hasher is not None:
+                        record = manifest_record(source_stat, output_path, hasher.hexdigest())
+                result = True
+            except Exception as e:
+                kind = "асимметричном шифровании" if asymmetric else "шифровании"
+                messages.append(f"Ошибка при {kind} {file_path}: {str(e)}")
+                result = False
+
+            # Удаляем оригинал только после успешного шифрования
+            # (при групповом fsync - после сброса результата на диск, см. commit_outputs)
+            if result and job["delete_original"] and not job.get("defer_delete"):
+                try:
+                    os.remove(file_path)
+                    messages.append(f"Удален исходный файл: {file_path}")
+                except Exception as e:
+                    messages.append(f"Ошибка удаления файла: {file_path} - {str(e)}")
+        else:
+            ext = ".rsa" if asymmetric else ".enc"
+            if file_path.endswith(ext) or file_path.endswith(ARCHIVE_EXT):
+                try:
+                    if file_path.endswith(ARCHIVE_EXT):
+                        # Архив распаковывается рядом с собой, с восстановлением структуры папок
+                        count = extract_archive(file_path, os.path.dirname(file_path), job["password"], job["private_key"],
+                                                durable=bool(job.get("defer_delete")))
+                        messages.append(f"Извлечено файлов: {count} из {file_path}")
+                    elif asymmetric:
+                        decrypt_file_private_key(file_path, decrypted_path(file_path, ext), job["private_key"],
+                                                 job.get("segment_workers", 1))
+                    else:
+                        decrypt_file_password(file_path, decrypted_path(file_path, ext), job["password"],
+                                              job.get("segment_workers", 1))
+                    result = True
+                except Exception as e:
+                    kind = "асимметричной расшифровке" if asymmetric else "расшифровке"
+                    messages.append(f"Ошибка при {kind} {file_path}: {str(e)}")
+                    result = False
+            else:
+                messages.append(f"Пропущен файл (не {ext}): {file_path}")
+                result = False
+
+            # Удаляем зашифрованный файл только после успешной расшифровки
+            if result and job["delete_original"] and not job.get("defer_delete"):
+                try:
+                    os.remove(file_path)
+                    messages.append(f"Удален зашифрованный файл: {file_path}")
+                except Exception as e:
+                    messages.append(f"Ошибка удаления файла: {file_path} - {str(e)}")
+
+        if result:
+            messages.append(f"Успешно: {file_path}")
+        else:
+            messages.append(f"Ошибка: {file_path}")
+        return result, messages, record, size
+    except Exception as e:
+        messages.append(f"Критическая ошибка: {file_path} - {str(e)}")
+        return False, messages, None, size
+
+
+# Задание для процессов-обработчиков (ключи RSA передаются в PEM, так как объекты ключей не сериализуются)
+_worker_job = None
+
+
+def public_key_to_pem(public_key):
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+def private_key_to_pem(private_key):
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+
+def generate_private_key(key_size=2048):
+    return rsa.generate_private_key(public_exponent=65537, key_size=key_size, backend=default_backend())
+
+
+def generate_key(key_type=DEFAULT_KEY_TYPE):
+    """Новый закрытый ключ типа из KEY_TYPES"""
+    key_size = KEY_TYPES[key_type]
+    if key_size is None:
+        return x25519.X25519PrivateKey.generate()
+    return generate_private_key(key_size)
+
+
+def key_type_name(key):
+    """Тип ключа для сообщений: RSA-<размер> или X25519"""
+    if isinstance(key, (x25519.X25519PrivateKey, x25519.X25519PublicKey)):
+        return "X25519"
+    return f"RSA-{key.key_size}"
+
+
+def check_key(key):
+    """Поддерживаются ключи RSA (не короче RSA_MIN_KEY_SIZE) и X25519"""
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        if key.key_size < RSA_MIN_KEY_SIZE:
+            raise ValueError(f"Ключ RSA слишком короткий: {key.key_size} бит (нужно не меньше {RSA_MIN_KEY_SIZE})")
+        return key
+    if isinstance(key, (x25519.X25519PrivateKey, x25519.X25519PublicKey)):
+        return key
+    raise ValueError("Поддерживаются только ключи RSA и X25519")
+
+
+def load_public_key_from_pem(pem):
+    return check_key(serialization.load_pem_public_key(pem, backend=default_backend()))
+
+
+def load_private_key_from_pem(pem):
+    return check_key(serialization.load_pem_private_key(pem, password=None, backend=default_backend()))
+
+
+class KeyPool:
+    """Заранее созданные ключи: RSA-4096 создаётся секунды, поэтому следующий ключ готовится в фоне.
+    Генерация в cryptography отпускает GIL и не задерживает интерфейс"""
+    
+    def __init__(self, size=1):
+        self.size = size
+        self.keys = {}
+        self.filling = set()
+        self.lock = threading.Lock()
+    
+    def fill(self, key_type):
+        """Фоновое пополнение пула до size ключей этого типа"""
+        with self.lock:
+            if key_type in self.filling or len(self.keys.get(key_type, ())) >= self.size:
+                return
+            self.filling.add(key_type)
+        threading.Thread(target=self._fill, args=(key_type,), daemon=True).start()
+    
+    def _fill(self, key_type):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.keys.setdefault(key_type, deque())) >= self.size:
+                        return
+                key = generate_key(key_type)
+                with self.lock:
+                    self.keys[key_type].append(key)
+        finally:
+            with self.lock:
+                self.filling.discard(key_type)
+    
+    def get(self, key_type=DEFAULT_KEY_TYPE):
+        """Готовый ключ из пула или новый, если пул пуст; пул сразу пополняется заново"""
+        with self.lock:
+            keys = self.keys.get(key_type)
+            key = keys.popleft() if keys else None
+        if key is None:
+            key = generate_key(key_type)
+        self.fill(key_type)
+        return key
+
+
+def export_job(job):
+    exported = dict(job)
+    if exported.get("public_keys"):
+        exported["public_keys"] = [public_key_to_pem(public_key) for public_key in exported["public_keys"]]
+    if exported.get("private_key") is not None:
+        exported["private_key"] = private_key_to_pem(exported["private_key"])
+    return exported
+
+
+def _init_worker(exported_job, metrics=False):
+    global _worker_job, _metrics
+    job = dict(exported_job)
+    if job.get("public_keys"):
+        job["public_keys"] = [load_public_key_from_pem(pem) for pem in job["public_keys"]]
+    if job.get("private_key") is not None:
+        job["private_key"] = load_private_key_from_pem(job["private_key"])
+    _worker_job = job
+    # Замеры обработчика передаются вместе с результатами каждой пачки
+    _metrics = StageMetrics() if metrics else None
+
+
+def _process_batch_in_worker(batch):
+    outcomes = [process_file(file_path, _worker_job, known_hash, hash_first) for file_path, known_hash, hash_first in batch]
+    return outcomes, _metrics.export(reset=True) if _metrics is not None else None
+
+
+def compile_globs(patterns):
+    """Один регулярный шаблон на группу масок (None - масок нет)"""
+    patterns = [pattern.strip() for pattern in patterns if pattern and pattern.strip()]
+    if not patterns:
+        return None
+    flags = re.IGNORECASE if os.path.normcase("A") == "a" else 0
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns), flags)
+
+
+def glob_match(name_globs, path_globs, name, relative):
+    return bool(
+        (name_globs and name_globs.match(name)) or
+        (path_globs and path_globs.match(relative))
+    )
+
+
+def split_globs(patterns):
+    """Маски без "/" сравниваются с именем, с "/" - с путём относительно корня обхода"""
+    patterns = list(patterns or ())
+    names = [pattern for pattern in patterns if "/" not in pattern.replace("\\", "/")]
+    paths = [pattern.replace("\\", "/").strip("/") for pattern in patterns if "/" in pattern.replace("\\", "/")]
+    return compile_globs(names), compile_globs(paths)
+
+
+class FileSelector:
+    """Скомпилированные правила отбора файлов, проверяемые прямо во время обхода папки
+
+    Сначала проверяется то, что не требует обращения к диску (расширение, маски),
+    stat вызывается только для оставшихся кандидатов и только если есть условия по размеру или времени.
+    """
+    
+    def __init__(self, extensions=None, include=None, exclude=None, prune_dirs=None,
+                 min_size=None, max_size=None, newer_than=None, older_than=None, skip_encrypted=None):
+        include, exclude, prune_dirs = list(include or ()), list(exclude or ()), list(prune_dirs or ())
+        # Для журнала задания: продолжать можно только с теми же правилами. Границы времени задаются
+        # относительно момента запуска, поэтому учитывается только их наличие
+        self.rules = [sorted(extensions) if extensions is not None else None, include, exclude, prune_dirs,
+                      min_size, max_size, newer_than is not None, older_than is not None, skip_encrypted]
+        self.extensions = {ext.lower() for ext in extensions} if extensions is not None else None
+        self.include = split_globs(include)
+        self.has_include = any(self.include)
+        self.exclude = split_globs(exclude)
+        self.prune_dirs = split_globs(prune_dirs)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.newer_than = newer_than
+        self.older_than = older_than
+        # Расширение результата шифрования: файлы с актуальной зашифрованной копией рядом пропускаются
+        self.skip_encrypted = skip_encrypted
+        self.needs_stat = any(value is not None for value in (min_size, max_size, newer_than, older_than))
+    
+    def digest(self):
+        return hashlib.sha256(json.dumps(self.rules, ensure_ascii=False).encode("utf-8")).hexdigest()
+    
+    def prune(self, entry, relative):
+        """True - папку не обходить"""
+        return glob_match(*self.prune_dirs, entry.name, relative)
+    
+    def match_name(self, name, relative):
+        if self.extensions is not None and os.path.splitext(name)[1].lower() not in self.extensions:
+            return False
+        if self.has_include and not glob_match(*self.include, name, relative):
+            return False
+        if glob_match(*self.exclude, name, relative):
+            return False
+        return True
+    
+    def match_stat(self, file_stat):
+        if self.min_size is not None and file_stat.st_size < self.min_size:
+            return False
+        if self.max_size is not None and file_stat.st_size > self.max_size:
+            return False
+        if self.newer_than is not None and file_stat.st_mtime < self.newer_than:
+            return False
+        if self.older_than is not None and file_stat.st_mtime > self.older_than:
+            return False
+        return True
+    
+    def match(self, entry, relative, names):
+        """Проверка файла; names - имена в той же папке (для поиска зашифрованной копии без лишних stat)"""
+        if not self.match_name(entry.name, relative):
+            return False
+        encrypted = self.skip_encrypted and entry.name + self.skip_encrypted in names
+        if not (self.needs_stat or encrypted):
+            return entry.is_file()
+        try:
+            file_stat = entry.stat()
+        except OSError:
+            return False
+        if not (entry.is_file() and self.match_stat(file_stat)):
+            return False
+        if encrypted:
+            try:
+                output_stat = os.stat(entry.path + self.skip_encrypted)
+            except OSError:
+                return True
+            # Копия актуальна, если записана не раньше последнего изменения исходника
+            if output_stat.st_mtime_ns >= file_stat.st_mtime_ns:
+                return False
+        return True
+    
+    def match_path(self, path):
+        """Проверка отдельного файла, выбранного напрямую"""
+        name = os.path.basename(path)
+        if not self.match_name(name, name):
+            return False
+        try:
+            file_stat = os.stat(path)
+            if not self.match_stat(file_stat):
+                return False
+            if self.skip_encrypted:
+                return os.stat(path + self.skip_encrypted).st_mtime_ns < file_stat.st_mtime_ns
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+        return True
+
+
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_size(text):
+    """Размер вида "500", "10K", "2.5M", "1G" в байтах (пустая строка - без ограничения)"""
+    text = text.strip().upper().replace(" ", "")
+    if not text:
+        return None
+    match = re.fullmatch(r"(\d+(?:[.,]\d+)?)([KMGT]?)(?:I?B)?", text)
+    if not match:
+        raise ValueError(f"Некорректный размер: {text}")
+    return int(float(match.group(1).replace(",", ".")) * SIZE_UNITS[match.group(2)])
+
+
+def parse_patterns(text):
+    return [pattern.strip() for pattern in text.replace(";", ",").split(",") if pattern.strip()]
+
+
+def as_selector(rules):
+    """Набор расширений или готовые правила -> FileSelector"""
+    if isinstance(rules, FileSelector):
+        return rules
+    return FileSelector(rules)
+
+
+def scan_files(path, rules, recursive=True):
+    """Потоковый обход папки через os.scandir: файлы выдаются сразу, без построения полного списка
+
+    rules - набор расширений или FileSelector; отсечённые папки не читаются вовсе
+    """
+    selector = as_selector(rules)
+    if os.path.isfile(path):
+        if selector.match_path(path):
+            yield path
+        return
+    
+    stack = [(path, "")]
+    while stack:
+        folder, prefix = stack.pop()
+        subfolders = []
+        started = time.perf_counter()
+        try:
+            with os.scandir(folder) as iterator:
+                entries = list(iterator)
+        except OSError:
+            # Пропускаем папки с ошибками доступа
+            continue
+        record_stage("scan", started)
+        names = {entry.name for entry in entries} if selector.skip_encrypted else ()
+        for entry in entries:
+            relative = prefix + entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and not selector.prune(entry, relative):
+                        subfolders.append((entry.path, relative + "/"))
+                elif selector.match(entry, relative, names):
+                    yield entry.path
+            except OSError:
+                continue
+        stack.extend(reversed(subfolders))
+
+
+def collect_files(path, rules, recursive):
+    """Список файлов папки (или одного файла) с фильтрацией по расширениям или правилам отбора"""
+    return list(scan_files(path, rules, recursive))
+
+
+class FileScanner:
+    """Производитель для конвейера: сканирует папку в отдельном потоке и отдаёт задания через ограниченную очередь"""
+    
+    _DONE = object()
+    
+    def __init__(self, path, rules, recursive, select=None, queue_size=SCAN_QUEUE_SIZE):
+        self.found = 0
+        self.done = False
+        self.stopped = False
+        self.error = None
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._run, args=(path, rules, recursive, select), daemon=True)
+        self.thread.start()
+    
+    def _put(self, item):
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def _run(self, path, rules, recursive, select):
+        try:
+            for file_path in scan_files(path, rules, recursive):
+                if self.stopped:
+                    return
+                # select возвращает задание (путь, известный хеш) или None, если файл не нужен
+                item = select(file_path) if select else (file_path, None)
+                if item is not None:
+                    self.found += 1
+                    self._put(item)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._put(self._DONE)
+    
+    def take(self, count):
+        """Пачка заданий: ждём первое, остальные - только уже готовые (пустой список - конец)"""
+        batch = []
+        while len(batch) < count:
+            try:
+                item = self.queue.get(block=not batch)
+            except queue.Empty:
+                break
+            if item is self._DONE:
+                # Оставляем признак конца для следующего вызова
+                self.queue.put(item)
+                break
+            batch.append(item)
+        return batch
+    
+    def __iter__(self):
+        while True:
+            batch = self.take(1)
+            if not batch:
+                return
+            yield batch[0]
+    
+    def stop(self):
+        self.stopped = True
+
+
+def manifest_location(path):
+    return os.path.join(path if os.path.isdir(path) else os.path.dirname(path), MANIFEST_NAME)
+
+
+def manifest_identity(job):
+    """Чем зашифрованы файлы манифеста: смена пароля или получателей требует полного прохода"""
+    if job["asymmetric"]:
+        return {"recipients": sorted(key_id(public_key).hex() for public_key in job["public_keys"])}
+    batch_salt, master_key, kdf = job["batch_key"]
+    return {"salt": batch_salt.hex(), "kdf": list(kdf), "check": derive_file_key(master_key, MANIFEST_CHECK_SALT).hex()}
+
+
+def journal_identity(job):
+    """Чем выполняется задание журнала: проверочное значение пароля или идентификаторы ключей"""
+    if job["asymmetric"]:
+        if job["operation"] == "encrypt":
+            return manifest_identity(job)
+        return {"key": private_key_id(job["private_key"]).hex()}
+    if job.get("batch_key") is None:
+        # Расшифровка: мастер-ключа запуска нет, проверочное значение выводится с новой солью
+        job = dict(job, batch_key=new_batch_key(job["password"]))
+    return manifest_identity(job)
+
+
+def journal_identity_matches(identity, job):
+    if job["asymmetric"]:
+        return identity == journal_identity(job)
+    return identity_matches(identity, job)
+
+
+def load_manifest(path, job):
+    """Записи манифеста, если он создан тем же паролем/получателями, иначе пустой словарь"""
+    try:
+        with open(path, encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("asymmetric") != job["asymmetric"]:
+        return {}
+    
+    valid = identity_matches(manifest.get("identity") or {}, job)
+    return manifest.get("files", {}) if valid else {}
+
+
+def identity_matches(identity, job):
+    """Тот ли пароль или набор получателей, которым создан манифест или хранилище"""
+    if job["asymmetric"]:
+        return identity == manifest_identity(job)
+    try:
+        # Один вывод ключа с солью и KDF прошлого запуска для проверки пароля
+        kdf = check_kdf(identity.get("kdf", LEGACY_KDF))
+        master_key = derive_master_key(job["password"], bytes.fromhex(identity["salt"]), kdf)
+        return derive_file_key(master_key, MANIFEST_CHECK_SALT).hex() == identity["check"]
+    except (KeyError, ValueError):
+        return False
+
+
+def save_manifest(path, job, entries):
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "asymmetric": job["asymmetric"],
+        "identity": manifest_identity(job),
+        "files": entries,
+    }
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def check_unchanged(file_path, entries, root, ext):
+    """Проверка по stat: ("skip", запись) - файл не изменился, ("hash", хеш) - сверить содержимое, ("process", None)"""
+    entry = entries.get(os.path.relpath(file_path, root))
+    if not entry:
+        return "process", None
+    try:
+        source_stat = os.stat(file_path)
+        output_stat = os.stat(file_path + ext)
+    except OSError:
+        return "process", None
+    output_intact = output_stat.st_size == entry["output_size"] and output_stat.st_mtime_ns == entry["output_mtime_ns"]
+    if output_intact and source_stat.st_size == entry["size"] and source_stat.st_mtime_ns == entry["mtime_ns"]:
+        return "skip", entry
+    if output_intact and source_stat.st_size == entry["size"]:
+        return "hash", entry["sha256"]
+    return "process", None
+
+
+class JobJournal:
+    """Журнал пакетного задания: заголовок и по строке JSON на каждый завершённый файл"""
+    
+    def __init__(self, path, params, job=None):
+        """job - задание make_job: прерванное задание продолжается только тем же паролем или ключом"""
+        self.path = path
+        self.done = {}
+        self.resumed = False
+        # Журнал был, но не подошёл (другая операция, правила отбора, пароль или ключ)
+        self.rejected = False
+        try:
+            with open(path, encoding='utf-8') as file:
+                lines = file.read().splitlines()
+            header = json.loads(lines[0]) if lines else None
+            identity = header.pop("identity", None) if isinstance(header, dict) else None
+            self.rejected = header is not None
+            if header == params and (job is None or journal_identity_matches(identity or {}, job)):
+                self.rejected = False
+                for line in lines[1:]:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Недописанная при сбое строка
+                        continue
+                    self.done[entry["done"]] = entry.get("record")
+                self.resumed = True
+        except (OSError, ValueError):
+            pass
+        
+        if self.resumed:
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            if job is not None:
+                params = dict(params, identity=journal_identity(job))
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write(json.dumps(params, ensure_ascii=False) + "\n")
+    
+    def mark_done(self, relative, record=None):
+        self.file.write(json.dumps({"done": relative, "record": record}, ensure_ascii=False) + "\n")
+    
+    def sync(self, durable):
+        self.file.flush()
+        if durable:
+            os.fsync(self.file.fileno())
+    
+    def finish(self):
+        """Задание завершено целиком: журнал больше не нужен"""
+        self.file.close()
+        os.remove(self.path)
+    
+    def close(self):
+        self.file.close()
+
+
+def output_path_for(file_path, job):
+    ext = ".rsa" if job["asymmetric"] else ".enc"
+    if job["operation"] == "encrypt":
+        return file_path + ext
+    return decrypted_path(file_path, ext)
+
+
+def commit_outputs(pending, job, journal, durable):
+    """Фиксация группы файлов: fsync результатов и папок, затем удаление исходных и запись в журнал"""
+    messages = []
+    if durable:
+        folders = set()
+        for file_path, relative, record in pending:
+            output_path = output_path_for(file_path, job)
+            if os.path.exists(output_path):
+                fsync_file(output_path)
+            folders.add(os.path.dirname(output_path) or ".")
+        for folder in folders:
+            fsync_dir(folder)
+    
+    for file_path, relative, record in pending:
+        if job["delete_original"] and job.get("defer_delete") and os.path.exists(file_path):
+            kind = "исходный" if job["operation"] == "encrypt" else "зашифрованный"
+            try:
+                os.remove(file_path)
+                messages.append(f"Удален {kind} файл: {file_path}")
+            except Exception as e:
+                messages.append(f"Ошибка удаления файла: {file_path} - {str(e)}")
+        journal.mark_done(relative, record)
+    journal.sync(durable)
+    pending.clear()
+    return messages
+
+
+def make_job(operation, password, delete_original, asymmetric, public_keys=None, private_key=None,
+             cipher=DEFAULT_CIPHER, chunk_size=CHUNK_SIZE, compression=COMPRESS_NONE, segment_workers=1, kdf=None):
+    """Параметры пакетной операции для process_file (общие для всех файлов и процессов)"""
+    return {
+        "operation": operation,
+        "password": password,
+        "public_keys": public_keys,
+        "private_key": private_key,
+        "delete_original": delete_original,
+        "asymmetric": asymmetric,
+        "cipher": cipher,
+        "chunk_size": chunk_size,
+        "compression": compression,
+        # Процессов на один большой файл (см. PARALLEL_MIN_SIZE)
+        "segment_workers": segment_workers,
+        # Мастер-ключ выводится один раз на запуск, а не для каждого файла
+        "batch_key": new_batch_key(password, kdf) if operation == "encrypt" and not asymmetric else None,
+        "batch_data_key": new_batch_data_key(public_keys) if operation == "encrypt" and asymmetric else None,
+    }
+
+
+def _work_item(item):
+    """Задание для process_file: (путь, известный хеш, хешировать до шифрования)"""
+    if not isinstance(item, tuple):
+        return item, None, False
+    return item + (None, False)[len(item) - 1:]
+
+
+def run_jobs(files, job, workers=1):
+    """Генератор результатов (путь, успех, сообщения, запись манифеста, размер) в исходном порядке файлов
+
+    files - список путей или поток заданий (путь, известный хеш[, хешировать до шифрования]), например FileScanner
+    """
+    if workers <= 1:
+        for item in files:
+            file_path, known_hash, hash_first = _work_item(item)
+            yield (file_path,) + process_file(file_path, job, known_hash, hash_first)
+        return
+    
+    if hasattr(files, "take"):
+        take = files.take
+    else:
+        items = iter(files)
+        take = lambda count: list(islice(items, count))
+    
+    # Ограниченное число пачек в работе: память не растёт с размером папки, порядок результатов сохраняется
+    metrics = _metrics
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(export_job(job), metrics is not None)) as executor:
+        in_flight = deque()
+        
+        def submit_next():
+            batch = [_work_item(item) for item in take(WORKER_BATCH_SIZE)]
+            if batch:
+                in_flight.append((batch, executor.submit(_process_batch_in_worker, batch)))
+            return bool(batch)
+        
+        for _ in range(workers * 2):
+            if not submit_next():
+                break
+        while in_flight:
+            batch, future = in_flight.popleft()
+            submit_next()
+            outcomes, stats = future.result()
+            if stats:
+                metrics.merge(stats)
+            for (file_path, _, _), outcome in zip(batch, outcomes):
+                yield (file_path,) + outcome
+
+
+class FolderWatcher:
+    """Шифрование новых и изменённых файлов папки по событиям файловой системы, без периодического обхода
+
+    Файл берётся в работу, когда после последнего события о нём прошло debounce секунд
+    и его размер и время изменения совпали при двух проверках подряд (файл дописан).
+    Неизменённые файлы пропускаются по манифесту, как в инкрементальном режиме.
+    """
+    
+    def __init__(self, path, job, rules=None, workers=1, debounce=WATCH_DEBOUNCE, initial=True, log=print):
+        if Observer is None:
+            raise ValueError("Для слежения за папкой установите пакет watchdog")
+        self.root = os.path.abspath(path)
+        self.job = dict(job, manifest=True)
+        self.selector = as_selector(rules) if rules is not None else FileSelector(prune_dirs=parse_patterns(DEFAULT_PRUNE))
+        self.workers = workers
+        self.debounce = debounce
+        self.initial = initial
+        self.log = log
+        self.ext = ".rsa" if job["asymmetric"] else ".enc"
+        self.manifest_path = os.path.join(self.root, MANIFEST_NAME)
+        self.entries = load_manifest(self.manifest_path, self.job)
+        self.events = queue.SimpleQueue()
+        # Путь -> [срок следующей проверки, (размер, время изменения) при прошлой проверке]
+        self.pending = {}
+        self.stopped = threading.Event()
+    
+    def dispatch(self, event):
+        """Обработчик событий watchdog (вызывается в потоке наблюдателя)"""
+        if event.event_type in ("created", "modified", "moved", "closed"):
+            path = getattr(event, "dest_path", "") or event.src_path
+            self.events.put((os.fsdecode(path), event.is_directory, event.event_type))
+    
+    def wanted(self, path):
+        """Результаты шифрования, служебные и временные файлы, исключённые папки не берутся"""
+        name = os.path.basename(path)
+        if name.startswith((MANIFEST_NAME, JOURNAL_NAME)) or name.endswith((".enc", ".rsa", ARCHIVE_EXT, TEMP_SUFFIX)):
+            return False
+        relative = os.path.relpath(path, self.root)
+        if relative.startswith(os.pardir) or in_service_dir(path, self.root):
+            return False
+        parts = relative.split(os.sep)
+        for i in range(len(parts) - 1):
+            if glob_match(*self.selector.prune_dirs, parts[i], "/".join(parts[:i + 1])):
+                return False
+        return self.selector.match_name(name, "/".join(parts))
+    
+    def touch(self, path):
+        if not self.wanted(path):
+            return
+        deadline = time.monotonic() + self.debounce
+        entry = self.pending.get(path)
+        if entry:
+            entry[0] = deadline
+        else:
+            self.pending[path] = [deadline, None]
+    
+    def drain_events(self):
+        while True:
+            try:
+                path, is_directory, event_type = self.events.get_nowait()
+            except queue.Empty:
+                return
+            if not is_directory:
+                self.touch(path)
+            elif event_type in ("created", "moved"):
+                # Папка, перенесённая целиком, может прийти одним событием: обходим только её
+                for file_path in scan_files(path, self.selector):
+                    self.touch(file_path)
+    
+    def ready_files(self):
+        """Дописанные файлы, которые нужно зашифровать: (путь, известный хеш) для run_jobs"""
+        now = time.monotonic()
+        ready = []
+        for path, entry in list(self.pending.items()):
+            if entry[0] > now:
+                continue
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            signature = (file_stat.st_size, file_stat.st_mtime_ns)
+            if signature != entry[1]:
+                # Файл ещё пишется (или проверяется впервые): ждём следующего интервала
+                entry[:] = [now + self.debounce, signature]
+                continue
+            del self.pending[path]
+            if not os.path.isfile(path) or not self.selector.match_stat(file_stat):
+                continue
+            state, value = check_unchanged(path, self.entries, self.root, self.ext)
+            if state != "skip":
+                ready.append((path, value if state == "hash" else None))
+        return ready
+    
+    def process(self, files):
+        for file_path, result, messages, record, size in run_jobs(files, self.job, self.workers):
+            for message in messages:
+                self.log(message)
+            if record is not None:
+                record.pop("unchanged", None)
+                self.entries[os.path.relpath(file_path, self.root)] = record
+        save_manifest(self.manifest_path, self.job, self.entries)
+    
+    def run(self):
+        """Слежение до вызова stop() (или KeyboardInterrupt)"""
+        observer = Observer()
+        observer.schedule(self, self.root, recursive=True)
+        observer.start()
+        try:
+            if self.initial:
+                # Один обход при запуске: файлы, появившиеся, пока слежение не работало
+                for file_path in scan_files(self.root, self.selector):
+                    self.touch(file_path)
+            self.log(f"Слежение за папкой: {self.root}")
+            while not self.stopped.wait(WATCH_TICK):
+                self.drain_events()
+                files = self.ready_files()
+                if files:
+                    self.process(files)
+        finally:
+            observer.stop()
+            observer.join()
+    
+    def stop(self):
+        self.stopped.set()
+
+
+def run_folder(job, path, rules, recursive=True, workers=1, incremental=False, fsync_every=DEFAULT_FSYNC_EVERY,
+               archive=False, archive_size=DEFAULT_ARCHIVE_SIZE, progress=None, dedup=False, catalog=False):
+    """Пакетная операция над папкой по заданию make_job: шифрование, расшифровка или проверка
+    
+    progress получает сообщения (log), результаты файлов (report) и состояние (set_status);
+    dedup - одинаковое содержимое шифруется один раз в хранилище, на месте файлов - ссылки;
+    catalog - добавить зашифрованные файлы в каталог папки (поиск и восстановление без обхода дерева);
+    возвращает (успешно, всего файлов)
+    """
+    progress = progress or ConsoleProgress(quiet=True)
+    operation = job["operation"]
+    asymmetric = job["asymmetric"]
+    
+    # Служебные файлы задания в корне папки не обрабатываются
+    manifest_path = manifest_location(path)
+    state_root = os.path.dirname(manifest_path)
+    journal_path = os.path.join(state_root, JOURNAL_NAME)
+    
+    if archive and operation == "encrypt":
+        return pack_folder(path, rules, recursive, job, state_root, archive_size, fsync_every > 0, progress, catalog)
+    if operation == "verify":
+        return verify_folder(path, rules, recursive, job, workers, progress)
+    
+    # Хранилище дедупликации: размеры уже сохранённого содержимого - из индекса прошлых запусков
+    store_sizes = None
+    if dedup and operation == "encrypt":
+        store, store_index = open_store(state_root, job)
+        job["store"] = store
+        store_sizes = set(store_index["sizes"])
+    dedup_counts = {"unique": 0, "duplicate": 0, "saved": 0}
+    
+    # Журнал: после сбоя повторный запуск той же операции продолжает с места остановки
+    journal = JobJournal(journal_path, {
+        "journal": 2,
+        "operation": operation,
+        "asymmetric": asymmetric,
+        "path": os.path.abspath(path),
+        "recursive": recursive,
+        "rules": as_selector(rules).digest(),
+    }, job)
+    if journal.resumed:
+        progress.log(f"Продолжение прерванного задания, уже обработано: {len(journal.done)}")
+    elif journal.rejected:
+        progress.log("Журнал прерванного задания не подходит (другая операция, правила отбора, пароль или ключ): "
+                     "задание выполняется заново")
+    
+    # При групповом fsync исходные файлы удаляются только после сброса результатов на диск
+    job["defer_delete"] = fsync_every > 0
+    
+    # Инкрементальный режим: неизменённые с прошлого запуска файлы пропускаются по stat
+    manifest_entries = None
+    manifest_known = {}
+    unchanged = {}
+    if incremental and operation == "encrypt":
+        job["manifest"] = True
+        manifest_known = load_manifest(manifest_path, job)
+        manifest_entries = {relative: record for relative, record in journal.done.items() if record}
+    
+    # Каталог: хеш и время изменения берутся из записей манифеста (считаются по ходу шифрования)
+    catalog_entries = None
+    if catalog and operation == "encrypt":
+        job["manifest"] = True
+        catalog_entries = {}
+        for relative, record in journal.done.items():
+            if record and "sha256" in record:
+                file_path = os.path.join(state_root, relative)
+                catalog_entries[catalog_name(file_path, state_root)] = catalog_entry(file_path, state_root, record)
+    ext = ".rsa" if asymmetric else ".enc"
+    
+    def select(file_path):
+        # Вызывается в потоке сканера, пока обработчики уже заняты найденными файлами
+        if file_path in (manifest_path, journal_path) or in_service_dir(file_path, state_root):
+            return None
+        relative = os.path.relpath(file_path, state_root)
+        if relative in journal.done:
+            return None
+        known_hash = None
+        if manifest_entries is not None:
+            state, value = check_unchanged(file_path, manifest_known, state_root, ext)
+            if state == "skip":
+                unchanged[relative] = value
+                return None
+            known_hash = value if state == "hash" else None
+        if store_sizes is None:
+            return file_path, known_hash
+        # Дубликат возможен только среди файлов одного размера: их хеш считается до шифрования
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return file_path, known_hash
+        hash_first = size in store_sizes
+        store_sizes.add(size)
+        return file_path, known_hash, hash_first
+    
+    # Конвейер: обход папки идёт параллельно с обработкой, список всех файлов не строится
+    scanner = FileScanner(path, rules, recursive, select)
+    
+    progress.set_status("Подготовка к обработке...")
+    
+    # Обрабатываем файлы (при workers > 1 - в пуле процессов, результаты приходят по порядку)
+    success_count = 0
+    verified_unchanged = 0
+    total_files = 0
+    pending = []
+    try:
+        for i, (file_path, result, messages, record, size) in enumerate(run_jobs(scanner, job, workers)):
+            # Пока сканирование не закончено, общее число файлов растёт
+            total_files = max(scanner.found, i + 1)
+            progress.report(i, total_files, file_path, result, messages, not scanner.done, size)
+            if result:
+                success_count += 1
+            relative = os.path.relpath(file_path, state_root)
+            if record is not None:
+                if "duplicate" in record:
+                    duplicate = record.pop("duplicate")
+                    dedup_counts["duplicate" if duplicate else "unique"] += 1
+                    if duplicate:
+                        dedup_counts["saved"] += size
+                if record.pop("unchanged", False):
+                    verified_unchanged += 1
+                if manifest_entries is not None:
+                    manifest_entries[relative] = record
+                if catalog_entries is not None and result:
+                    catalog_entries[catalog_name(file_path, state_root)] = catalog_entry(file_path, state_root, record)
+                record = record or None
+            
+            # Файл считается готовым только после фиксации группы (fsync и запись в журнал)
+            if result:
+                pending.append((file_path, relative, record))
+            if len(pending) >= max(fsync_every, 1):
+                for message in commit_outputs(pending, job, journal, fsync_every > 0):
+                    progress.log(message)
+        
+        for message in commit_outputs(pending, job, journal, fsync_every > 0):
+            progress.log(message)
+    except BaseException:
+        scanner.stop()
+        journal.close()
+        raise
+    if scanner.error:
+        progress.log(f"Ошибка при обходе папки: {str(scanner.error)}")
+    journal.finish()
+    if manifest_entries is not None:
+        manifest_entries.update(unchanged)
+        save_manifest(manifest_path, job, manifest_entries)
+    if store_sizes is not None:
+        save_store_index(job["store"], store_index, store_sizes)
+    if catalog_entries is not None:
+        # Каталог паролем переписывается целиком: в него попадают и пропущенные без изменений файлы
+        # (части для открытых ключей только дописываются, неизменённые файлы в них уже есть)
+        if not asymmetric:
+            for relative, record in unchanged.items():
+                file_path = os.path.join(state_root, relative)
+                catalog_entries[catalog_name(file_path, state_root)] = catalog_entry(file_path, state_root, record)
+        if catalog_entries:
+            message = update_catalog(state_root, job, catalog_entries, fsync_every > 0)
+            if message:
+                progress.log(message)
+            progress.log(f"Каталог обновлён, записей о файлах: {len(catalog_entries)}")
+    
+    if total_files == 0:
+        if unchanged or journal.resumed:
+            progress.log(f"Все файлы без изменений, пропущено: {len(unchanged)}")
+            return 0, 0
+        progress.log("Файлы для обработки не найдены")
+        return 0, 0
+    
+    progress.set_status("Обработка завершена")
+    progress.log(f"\nОбработка завершена! Успешно: {success_count}/{total_files}")
+    if manifest_entries is not None:
+        progress.log(
+            f"Пропущено без изменений: {len(unchanged) + verified_unchanged}, зашифровано: {success_count - verified_unchanged}"
+        )
+    if store_sizes is not None:
+        progress.log(
+            f"Дедупликация: уникального содержимого {dedup_counts['unique']}, дубликатов {dedup_counts['duplicate']}, "
+            f"не зашифровано повторно {dedup_counts['saved'] / (1024 * 1024):.1f} МБ"
+        )
+    
+    # Возвращаем статистику для уведомления
+    return success_count, total_files
+
+
+def pack_folder(path, rules, recursive, job, root, archive_size, durable, progress, catalog=False):
+    """Упаковка файлов папки в зашифрованные архивы вместо отдельного контейнера на каждый файл"""
+    reserved = (os.path.join(root, MANIFEST_NAME), os.path.join(root, JOURNAL_NAME))
+    
+    def select(file_path):
+        if file_path in reserved or file_path.endswith(ARCHIVE_EXT) or file_path.endswith(TEMP_SUFFIX) or in_service_dir(file_path, root):
+            return None
+        return file_path, None
+    
+    scanner = FileScanner(path, rules, recursive, select)
+    counter = {"done": 0}
+    
+    def on_file(file_path, size):
+        counter["done"] += 1
+        total = max(scanner.found, counter["done"])
+        progress.report(counter["done"] - 1, total, file_path, True, [], not scanner.done, size)
+    
+    success_count = 0
+    archive_count = 0
+    catalog_entries = {}
+    try:
+        for archive_path, entries, errors in write_archives((item[0] for item in scanner), root, job, archive_size or None, on_file,
+                                                            catalog):
+            for message in errors:
+                progress.log(message)
+            if archive_path is None:
+                continue
+            if durable:
+                fsync_file(archive_path)
+                fsync_dir(os.path.dirname(archive_path))
+            archive_count += 1
+            success_count += len(entries)
+            progress.log(f"Архив {archive_path}: файлов {len(entries)}")
+            if catalog:
+                for entry in entries:
+                    catalog_entries[entry["name"]] = archive_catalog_entry(archive_path, root, entry)
+            
+            # Исходные файлы удаляются только после записи архива целиком
+            if job["delete_original"]:
+                failed = 0
+                for entry in entries:
+                    try:
+                        os.remove(entry["path"])
+                    except OSError:
+                        failed += 1
+                if failed:
+                    progress.log(f"Не удалось удалить исходных файлов: {failed}")
+    except BaseException:
+        scanner.stop()
+        raise
+    if catalog_entries:
+        message = update_catalog(root, job, catalog_entries, durable)
+        if message:
+            progress.log(message)
+        progress.log(f"Каталог обновлён, записей о файлах: {len(catalog_entries)}")
+    
+    total_files = scanner.found
+    if total_files == 0:
+        progress.log("Файлы для обработки не найдены")
+        return 0, 0
+    
+    progress.set_status("Обработка завершена")
+    progress.log(f"\nОбработка завершена! Успешно: {success_count}/{total_files}, архивов: {archive_count}")
+    return success_count, total_files
+
+
+def verify_folder(path, rules, recursive, job, workers, progress):
+    """Проверка подлинности зашифрованных файлов на всех ядрах; на диск ничего не пишется"""
+    # Объекты хранилища дедупликации проверяются через ссылки на них, части каталога - при его чтении
+    root = os.path.dirname(manifest_location(path))
+    scanner = FileScanner(path, rules, recursive, lambda file_path: None if in_service_dir(file_path, root) else (file_path, None))
+    progress.set_status("Проверка...")
+    
+    started = time.perf_counter()
+    ok_count = 0
+    failed = 0
+    total_bytes = 0
+    total_files = 0
+    try:
+        for i, (file_path, result, messages, _, size) in enumerate(run_jobs(scanner, job, workers)):
+            total_files = max(scanner.found, i + 1)
+            progress.report(i, total_files, file_path, result, messages, not scanner.done, size)
+            total_bytes += size
+            if result:
+                ok_count += 1
+            else:
+                failed += 1
+    except BaseException:
+        scanner.stop()
+        raise
+    
+    if total_files == 0:
+        progress.log("Файлы для проверки не найдены")
+        return 0, 0
+    
+    seconds = max(time.perf_counter() - started, 1e-9)
+    progress.set_status("Проверка завершена")
+    progress.log(
+        f"\nПроверка завершена! Целых: {ok_count}/{total_files}, с ошибками: {failed}\n"
+        f"Скорость: {total_bytes / (1024 * 1024) / seconds:.1f} МБ/с, {total_files / seconds:.1f} файлов/с"
+    )
+    return ok_count, total_files
+
+
+
+class ConsoleProgress:
+    """Ход пакетной операции без интерфейса: сообщения - в stderr, с as_json - строка JSON на файл в stdout"""
+    
+    def __init__(self, as_json=False, quiet=False):
+        self.as_json = as_json
+        self.quiet = quiet
+    
+    def log(self, message):
+        if not self.quiet:
+            print(message, file=sys.stderr)
+    
+    def report(self, i, total_files, file_path, result, messages, scanning=False, size=0):
+        if self.as_json:
+            print(json.dumps({"event": "file", "path": file_path, "ok": bool(result), "size": size, "messages": messages},
+                             ensure_ascii=False), flush=True)
+            return
+        for message in messages:
+            self.log(message)
+    
+    def set_status(self, status):
+        pass
+
+
+def load_private_key_file(key_path):
+    with open(key_path, "rb") as key_file:
+        return load_private_key_from_pem(key_file.read())
+
+
+def load_public_key_file(key_path):
+    with open(key_path, "rb") as key_file:
+        return load_public_key_from_pem(key_file.read())
+
+
+def non_negative_int(text):
+    """Тип аргумента argparse: целое число не меньше нуля"""
+    try:
+        value = int(text)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"ожидается целое число не меньше нуля: {text}")
+    return value
+
+
+def chunk_size_arg(text):
+    """Тип аргумента argparse: размер блока от 1 до MAX_CHUNK_SIZE байт"""
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if not 1 <= value <= MAX_CHUNK_SIZE:
+        raise argparse.ArgumentTypeError(f"ожидается размер блока от 1 до {MAX_CHUNK_SIZE} байт: {text}")
+    return value
+
+
+def cli_credentials(args):
+    private_key = load_private_key_file(args.key) if args.key else None
+    password = None if private_key else (os.environ.get("SHFR_PASSWORD") or getpass.getpass("Пароль: "))
+    return password, private_key
+
+
+def cli_new_password():
+    """Пароль для шифрования: из SHFR_PASSWORD или с повторным вводом (None - не совпал)"""
+    password = os.environ.get("SHFR_PASSWORD")
+    if password:
+        return password
+    password = getpass.getpass("Пароль: ")
+    if getpass.getpass("Повторите пароль: ") != password:
+        print("Пароли не совпадают", file=sys.stderr)
+        return None
+    return password
+
+
+def cli_encrypt_credentials(args):
+    """Открытые ключи получателей (-k) или новый пароль; (None, None) - пароль не подтверждён"""
+    if args.key:
+        return None, [load_public_key_file(key_path) for key_path in args.key]
+    return cli_new_password(), None
+
+
+def cli_kdf_params(args):
+    """Параметры KDF для --kdf: калиброванные для этого алгоритма или стандартные"""
+    return kdf_for(KDF_NAMES[args.kdf] if args.kdf else None)
+
+
+def cli_print_json(data):
+    print(json.dumps(data, ensure_ascii=False), flush=True)
+
+
+def cli_open(path, mode):
+    """Файл или stdin/stdout для "-" (без закрытия стандартного потока)"""
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin.buffer if "r" in mode else sys.stdout.buffer)
+    return open(path, mode)
+
+
+def cli_encrypt(args):
+    password, public_keys = cli_encrypt_credentials(args)
+    if password is None and public_keys is None:
+        return 2
+    cipher = CIPHER_NAMES[args.cipher]
+    compression = COMPRESSION_NAMES[args.compression]
+    kdf = cli_kdf_params(args)
+    output = args.output or (args.input + (".rsa" if public_keys else ".enc") if args.input != "-" else "-")
+    started = time.perf_counter()
+    if args.input != "-" and output != "-":
+        if public_keys:
+            encrypt_file_public_key(args.input, output, public_keys, args.chunk_size, cipher=cipher, compression=compression,
+                                    workers=args.workers)
+        else:
+            encrypt_file_password(args.input, output, password, args.chunk_size, cipher=cipher, compression=compression,
+                                  workers=args.workers, kdf=kdf)
+    else:
+        # Потоковый режим: stdin и/или stdout, память не зависит от объёма данных
+        def encrypt(dst):
+            with cli_open(args.input, 'rb') as src:
+                if public_keys:
+                    encrypt_public_key_stream(src, dst, public_keys, args.chunk_size, cipher=cipher, compression=compression)
+                else:
+                    encrypt_password_stream(src, dst, password, args.chunk_size, cipher=cipher, compression=compression,
+                                            kdf=kdf)
+        if output == "-":
+            encrypt(sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            _write_output(output, encrypt)
+    if args.json:
+        cli_print_json({"event": "encrypt", "input": args.input, "output": output, "seconds": round(time.perf_counter() - started, 4),
+                        "output_size": os.path.getsize(output) if output != "-" else None})
+    return 0
+
+
+def cli_decrypt(args):
+    password, private_key = cli_credentials(args)
+    if args.input != "-":
+        ext = os.path.splitext(args.input)[1]
+        output = args.output or decrypted_path(args.input, ext if ext in (".enc", ".rsa") else ".enc")
+    else:
+        output = args.output or "-"
+    started = time.perf_counter()
+    if args.input != "-" and output != "-":
+        # Файлы: поддерживаются и старые форматы (Fernet), большие контейнеры - по отрезкам
+        if private_key:
+            decrypt_file_private_key(args.input, output, private_key, args.workers)
+        else:
+            decrypt_file_password(args.input, output, password, args.workers)
+    else:
+        def decrypt(dst):
+            with cli_open(args.input, 'rb') as src:
+                header, key = open_container(src, password, private_key)
+                decrypt_stream(src, dst, key, header)
+        if output == "-":
+            decrypt(sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            _write_output(output, decrypt)
+    if args.json:
+        cli_print_json({"event": "decrypt", "input": args.input, "output": output, "seconds": round(time.perf_counter() - started, 4),
+                        "output_size": os.path.getsize(output) if output != "-" else None})
+    return 0
+
+
+def cli_keygen(args):
+    if args.type is None and args.bits < RSA_MIN_KEY_SIZE:
+        print(f"Размер ключа RSA должен быть не меньше {RSA_MIN_KEY_SIZE} бит", file=sys.stderr)
+        return 2
+    private_key = generate_key(args.type) if args.type else generate_private_key(args.bits)
+    # Закрытый ключ доступен только владельцу файла
+    fd = os.open(args.private, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as key_file:
+        key_file.write(private_key_to_pem(private_key))
+    with open(args.public, 'wb') as key_file:
+        key_file.write(public_key_to_pem(private_key.public_key()))
+    if args.json:
+        cli_print_json({"event": "keygen", "private": args.private, "public": args.public,
+                        "type": key_type_name(private_key), "key_id": key_id(private_key.public_key()).hex()})
+    return 0
+
+
+def cli_folder(args):
+    operation = args.operation
+    if operation == "encrypt":
+        password, public_keys = cli_encrypt_credentials(args)
+        if password is None and public_keys is None:
+            return 2
+        private_key = None
+    else:
+        if args.key and len(args.key) > 1:
+            print("Для расшифровки нужен один закрытый ключ", file=sys.stderr)
+            return 2
+        private_key = load_private_key_file(args.key[0]) if args.key else None
+        password = None if private_key else (os.environ.get("SHFR_PASSWORD") or getpass.getpass("Пароль: "))
+        public_keys = None
+    asymmetric = bool(public_keys or private_key)
+    
+    if args.ext:
+        extensions = {ext if ext.startswith(".") else "." + ext for ext in (ext.lower() for ext in parse_patterns(args.ext))}
+    elif operation == "encrypt":
+        extensions = None
+    else:
+        extensions = {".rsa" if asymmetric else ".enc", ARCHIVE_EXT}
+    exclude = parse_patterns(args.exclude or "")
+    if operation == "encrypt":
+        # Результаты шифрования и временные файлы повторно не шифруются
+        exclude += ["*.enc", "*.rsa", "*" + ARCHIVE_EXT, "*" + TEMP_SUFFIX]
+    rules = FileSelector(extensions, include=parse_patterns(args.include or ""), exclude=exclude,
+                         prune_dirs=parse_patterns(args.prune), min_size=parse_size(args.min_size or ""),
+                         max_size=parse_size(args.max_size or ""))
+    
+    workers = args.workers or os.cpu_count() or 1
+    job = make_job(operation, password, args.delete, asymmetric, public_keys=public_keys, private_key=private_key,
+                   cipher=CIPHER_NAMES[args.cipher], compression=COMPRESSION_NAMES[args.compression],
+                   segment_workers=segment_workers_for(workers), kdf=cli_kdf_params(args) if password else None)
+    started = time.perf_counter()
+    success_count, total_files = run_folder(job, args.path, rules, not args.no_recursive, workers, args.incremental,
+                                            args.fsync_every, args.archive is not None and operation == "encrypt",
+                                            parse_size(args.archive or "") or DEFAULT_ARCHIVE_SIZE,
+                                            ConsoleProgress(args.json, args.quiet), args.dedup, args.catalog)
+    if args.json:
+        cli_print_json({"event": "summary", "operation": operation, "path": args.path, "success": success_count,
+                        "total": total_files, "seconds": round(time.perf_counter() - started, 4)})
+    return 0 if success_count == total_files else 1
+
+
+def cli_range(args):
+    password, private_key = cli_credentials(args)
+    if args.output:
+        with open(args.output, 'wb') as dst:
+            written = decrypt_file_range(args.file, dst, args.offset, args.length, password, private_key)
+    else:
+        written = decrypt_file_range(args.file, sys.stdout.buffer, args.offset, args.length, password, private_key)
+    print(f"Расшифровано байт: {written}", file=sys.stderr)
+    return 0
+
+
+def cli_list(args):
+    password, private_key = cli_credentials(args)
+    for entry in list_archive(args.archive, password, private_key):
+        print(f"{entry['size']:>12}  {entry['name']}")
+    return 0
+
+
+def cli_extract(args):
+    password, private_key = cli_credentials(args)
+    if args.member and args.output == "-":
+        written = extract_archive_member(args.archive, args.member, sys.stdout.buffer, password, private_key)
+        print(f"Извлечено байт: {written}", file=sys.stderr)
+        return 0
+    target_dir = args.output or os.path.dirname(os.path.abspath(args.archive))
+    count = extract_archive(args.archive, target_dir, password, private_key, names={args.member} if args.member else None)
+    print(f"Извлечено файлов: {count}", file=sys.stderr)
+    return 0 if count or not args.member else 1
+
+
+def cli_catalog(args):
+    password, private_key = cli_credentials(args)
+    root = os.path.dirname(manifest_location(args.path))
+    skipped = []
+    entries = load_catalog(root, password, private_key, skipped)
+    if skipped:
+        print(f"Пропущено частей каталога другого пароля или ключа: {len(skipped)}", file=sys.stderr)
+    if args.restore:
+        output = args.output or member_path(root, args.restore)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        size = restore_from_catalog(root, args.restore, output, password, private_key, entries)
+        if args.json:
+            cli_print_json({"event": "restore", "name": args.restore, "output": output, "size": size})
+        else:
+            print(f"Восстановлен {args.restore}: {output}", file=sys.stderr)
+        return 0
+    found = search_catalog(entries, args.pattern, args.prefix)
+    for name, entry in found:
+        if args.json:
+            cli_print_json(dict(entry, name=name))
+        else:
+            print(f"{entry['size']:>12}  {name}  ->  {entry['container']}")
+    print(f"Найдено: {len(found)} из {len(entries)}", file=sys.stderr)
+    return 0 if found else 1
+
+
+def cli_verify(args):
+    password, private_key = cli_credentials(args)
+    rules = FileSelector({".rsa" if private_key else ".enc", ARCHIVE_EXT})
+    job = make_job("verify", password, False, private_key is not None, private_key=private_key)
+    workers = args.workers or os.cpu_count() or 1
+    
+    # Тот же путь, что и у folder verify: служебные папки (хранилище, каталог) не проверяются как файлы
+    progress = ConsoleProgress()
+    ok_count = total_files = 0
+    for path in args.paths:
+        path_ok, path_total = verify_folder(path, rules, True, job, workers, progress)
+        ok_count += path_ok
+        total_files += path_total
+    return 0 if ok_count == total_files else 1
+
+
+def cli_watch(args):
+    password, public_keys = cli_encrypt_credentials(args)
+    if password is None and public_keys is None:
+        return 2
+    extensions = None
+    if args.ext:
+        extensions = {ext if ext.startswith(".") else "." + ext for ext in (ext.lower() for ext in parse_patterns(args.ext))}
+    rules = FileSelector(extensions, include=parse_patterns(args.include or ""), exclude=parse_patterns(args.exclude or ""),
+                         prune_dirs=parse_patterns(args.prune))
+    job = make_job("encrypt", password, args.delete, public_keys is not None, public_keys=public_keys,
+                   cipher=CIPHER_NAMES[args.cipher], compression=COMPRESSION_NAMES[args.compression],
+                   kdf=cli_kdf_params(args) if password else None)
+    watcher = FolderWatcher(args.folder, job, rules, args.workers, args.debounce, not args.no_initial,
+                            log=lambda message: print(message, flush=True))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def cli_kdf(args):
+    if args.show:
+        kdf = load_kdf_settings()
+    else:
+        kdf = calibrate_kdf(KDF_NAMES[args.algorithm], args.target)
+        save_kdf_settings(kdf, args.target)
+    seconds = measure_kdf(kdf, os.urandom(SALT_SIZE))
+    if args.json:
+        cli_print_json({"event": "kdf", "algorithm": kdf_name(kdf[0]), "kdf": list(kdf), "seconds": round(seconds, 4),
+                        "settings": KDF_SETTINGS_PATH})
+    else:
+        print(f"{describe_kdf(kdf)}: {seconds:.2f} с на ключ")
+    return 0
+
+
+def add_encrypt_options(parser):
+    parser.add_argument("--cipher", choices=list(CIPHER_NAMES), default="AES-256-GCM")
+    parser.add_argument("--compression", choices=list(COMPRESSION_NAMES), default="Без сжатия")
+    parser.add_argument("--kdf", choices=list(KDF_NAMES), help="получение ключа из пароля (по умолчанию - из калибровки)")
+
+
+def add_metrics_option(parser):
+    parser.add_argument("--metrics", metavar="FILE", help="отчёт о времени этапов (обход, KDF, чтение, шифрование, запись): .json или .csv")
+
+
+def main(argv=None):
+    """Командная строка (без графического интерфейса)"""
+    parser = argparse.ArgumentParser(description="Криптографическая программа: командная строка")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    encrypt_parser = commands.add_parser("encrypt", help="зашифровать файл или поток (- для stdin/stdout)")
+    encrypt_parser.add_argument("input", help="файл или - (stdin)")
+    encrypt_parser.add_argument("-o", "--output", help="файл результата или - (stdout); по умолчанию имя + .enc/.rsa")
+    encrypt_parser.add_argument("-k", "--key", action="append", help="открытый ключ PEM получателя (можно несколько); иначе пароль")
+    encrypt_parser.add_argument("--chunk-size", type=chunk_size_arg, default=CHUNK_SIZE)
+    encrypt_parser.add_argument("-j", "--workers", type=int, default=1, help="процессов на большой файл")
+    encrypt_parser.add_argument("--json", action="store_true", help="итог в виде JSON")
+    add_encrypt_options(encrypt_parser)
+    add_metrics_option(encrypt_parser)
+    encrypt_parser.set_defaults(handler=cli_encrypt)
+    
+    decrypt_parser = commands.add_parser("decrypt", help="расшифровать файл или поток (- для stdin/stdout)")
+    decrypt_parser.add_argument("input", help="файл или - (stdin)")
+    decrypt_parser.add_argument("-o", "--output", help="файл результата или - (stdout); по умолчанию имя без .enc/.rsa")
+    decrypt_parser.add_argument("-k", "--key", help="закрытый ключ PEM (для .rsa); иначе запрашивается пароль")
+    decrypt_parser.add_argument("-j", "--workers", type=int, default=1, help="процессов на большой файл")
+    decrypt_parser.add_argument("--json", action="store_true", help="итог в виде JSON")
+    add_metrics_option(decrypt_parser)
+    decrypt_parser.set_defaults(handler=cli_decrypt)
+    
+    keygen_parser = commands.add_parser("keygen", help="создать пару ключей RSA или X25519 (PEM)")
+    keygen_parser.add_argument("private", help="файл закрытого ключа")
+    keygen_parser.add_argument("public", help="файл открытого ключа")
+    keygen_parser.add_argument("--bits", type=int, default=2048, help="размер ключа RSA")
+    keygen_parser.add_argument("--type", choices=list(KEY_TYPES), help="тип ключа (вместо --bits)")
+    keygen_parser.add_argument("--json", action="store_true", help="итог в виде JSON")
+    keygen_parser.set_defaults(handler=cli_keygen)
+    
+    folder_parser = commands.add_parser("folder", help="зашифровать, расшифровать или проверить файлы папки")
+    folder_parser.add_argument("operation", choices=("encrypt", "decrypt", "verify"))
+    folder_parser.add_argument("path", help="папка или файл")
+    folder_parser.add_argument("-k", "--key", action="append",
+                               help="шифрование: открытые ключи получателей; расшифровка: закрытый ключ; иначе пароль")
+    folder_parser.add_argument("--ext", help="расширения через запятую (шифрование: по умолчанию все файлы)")
+    folder_parser.add_argument("--include", help="маски включаемых файлов через запятую")
+    folder_parser.add_argument("--exclude", help="маски исключаемых файлов через запятую")
+    folder_parser.add_argument("--prune", default=DEFAULT_PRUNE, help="пропускаемые папки через запятую")
+    folder_parser.add_argument("--min-size", help="минимальный размер файла (например 10K)")
+    folder_parser.add_argument("--max-size", help="максимальный размер файла (например 2G)")
+    folder_parser.add_argument("--no-recursive", action="store_true", help="без вложенных папок")
+    folder_parser.add_argument("--delete", action="store_true", help="удалять исходные файлы после обработки")
+    folder_parser.add_argument("--incremental", action="store_true", help="пропускать файлы без изменений (манифест)")
+    folder_parser.add_argument("--archive", nargs="?", const="", help="упаковать в архивы .shfa (размер архива, например 1G)")
+    folder_parser.add_argument("--dedup", action="store_true",
+                               help="одинаковое содержимое шифровать один раз (хранилище " + STORE_NAME + " и ссылки)")
+    folder_parser.add_argument("--catalog", action="store_true",
+                               help="вести зашифрованный каталог файлов (" + CATALOG_NAME + ") для поиска и восстановления")
+    folder_parser.add_argument("--fsync-every", type=int, default=DEFAULT_FSYNC_EVERY, help="файлов на один fsync (0 - без fsync)")
+    folder_parser.add_argument("-j", "--workers", type=int, help="число процессов (по умолчанию все ядра)")
+    folder_parser.add_argument("--json", action="store_true", help="результаты файлов и итог - строками JSON")
+    folder_parser.add_argument("-q", "--quiet", action="store_true", help="без сообщений в stderr")
+    add_encrypt_options(folder_parser)
+    add_metrics_option(folder_parser)
+    folder_parser.set_defaults(handler=cli_folder)
+    
+    range_parser = commands.add_parser("range", help="расшифровать диапазон байтов файла .enc/.rsa")
+    range_parser.add_argument("file")
+    range_parser.add_argument("offset", type=non_negative_int)
+    range_parser.add_argument("length", type=non_negative_int)
+    range_parser.add_argument("-k", "--key", help="закрытый ключ PEM (для .rsa); иначе запрашивается пароль")
+    range_parser.add_argument("-o", "--output", help="файл результата (по умолчанию stdout)")
+    range_parser.set_defaults(handler=cli_range)
+    
+    list_parser = commands.add_parser("ls", help="список файлов архива .shfa")
+    list_parser.add_argument("archive")
+    list_parser.add_argument("-k", "--key", help="закрытый ключ PEM; иначе запрашивается пароль")
+    list_parser.set_defaults(handler=cli_list)
+    
+    extract_parser = commands.add_parser("extract", help="извлечь файлы из архива .shfa")
+    extract_parser.add_argument("archive")
+    extract_parser.add_argument("member", nargs="?", help="имя файла в архиве (по умолчанию все)")
+    extract_parser.add_argument("-k", "--key", help="закрытый ключ PEM; иначе запрашивается пароль")
+    extract_parser.add_argument("-o", "--output", help="папка для извлечения или - для вывода файла в stdout")
+    extract_parser.set_defaults(handler=cli_extract)
+    
+    catalog_parser = commands.add_parser("catalog", help="поиск в каталоге зашифрованной папки и восстановление файла")
+    catalog_parser.add_argument("path", help="папка с каталогом")
+    catalog_parser.add_argument("pattern", nargs="?", help="маска: без / - по имени файла, с / - по пути")
+    catalog_parser.add_argument("--prefix", help="начало пути относительно папки (например docs/2024/)")
+    catalog_parser.add_argument("--restore", metavar="NAME", help="восстановить файл с этим путём из каталога")
+    catalog_parser.add_argument("-o", "--output", help="куда восстановить (по умолчанию - на прежнее место)")
+    catalog_parser.add_argument("-k", "--key", help="закрытый ключ PEM; иначе запрашивается пароль")
+    catalog_parser.add_argument("--json", action="store_true", help="записи строками JSON")
+    catalog_parser.set_defaults(handler=cli_catalog)
+    
+    verify_parser = commands.add_parser("verify", help="проверить подлинность файлов .enc/.rsa и архивов без записи результата")
+    verify_parser.add_argument("paths", nargs="+", help="файлы или папки")
+    verify_parser.add_argument("-k", "--key", help="закрытый ключ PEM (для .rsa); иначе запрашивается пароль")
+    verify_parser.add_argument("-j", "--workers", type=int, help="число процессов (по умолчанию все ядра)")
+    add_metrics_option(verify_parser)
+    verify_parser.set_defaults(handler=cli_verify)
+    
+    watch_parser = commands.add_parser("watch", help="шифровать новые и изменённые файлы папки по мере появления")
+    watch_parser.add_argument("folder")
+    watch_parser.add_argument("-k", "--key", action="append", help="открытый ключ PEM получателя (можно несколько); иначе пароль")
+    watch_parser.add_argument("--ext", help="расширения через запятую (по умолчанию все файлы)")
+    watch_parser.add_argument("--include", help="маски включаемых файлов через запятую")
+    watch_parser.add_argument("--exclude", help="маски исключаемых файлов через запятую")
+    watch_parser.add_argument("--prune", default=DEFAULT_PRUNE, help="пропускаемые папки через запятую")
+    watch_parser.add_argument("--delete", action="store_true", help="удалять исходные файлы после шифрования")
+    watch_parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE, help="секунд без изменений до шифрования")
+    watch_parser.add_argument("--no-initial", action="store_true", help="не обрабатывать файлы, уже лежащие в папке")
+    watch_parser.add_argument("-j", "--workers", type=int, default=1, help="число процессов")
+    add_encrypt_options(watch_parser)
+    watch_parser.set_defaults(handler=cli_watch)
+    
+    kdf_parser = commands.add_parser("kdf", help="подобрать параметры получения ключа из пароля для этой машины")
+    kdf_parser.add_argument("--algorithm", choices=list(KDF_NAMES), default="PBKDF2-SHA256")
+    kdf_parser.add_argument("--target", type=float, default=DEFAULT_KDF_TARGET, help="секунд на получение ключа")
+    kdf_parser.add_argument("--show", action="store_true", help="показать сохранённые параметры без калибровки")
+    kdf_parser.add_argument("--json", action="store_true", help="итог в виде JSON")
+    kdf_parser.set_defaults(handler=cli_kdf)
+    
+    args = parser.parse_args(argv)
+    metrics = StageMetrics() if getattr(args, "metrics", None) else None
+    started = time.perf_counter()
+    try:
+        with collect_metrics(metrics):
+            return args.handler(args)
+    except (OSError, ValueError, InvalidTag, InvalidToken) as e:
+        # Для скриптов: краткое сообщение и код возврата вместо трассировки
+        error = str(e) if str(e) else "Неверный пароль или ключ, либо файл повреждён"
+        if getattr(args, "json", False):
+            cli_print_json({"event": "error", "command": args.command, "error": error})
+        print(f"Ошибка: {error}", file=sys.stderr)
+        return 1
+    finally:
+        if metrics is not None:
+            metrics.write_report(args.metrics, {"command": args.command, "seconds": round(time.perf_counter() - started, 4)})
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())